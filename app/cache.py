@@ -0,0 +1,96 @@
+# Copyright 2017 NYU-FOXTROT. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Process-local cache
+
+Classes
+-------
+LRUCache - bounded, thread safe least-recently-used cache with a time to live
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    Bounded LRU cache whose entries expire after ttl seconds
+
+    Readers that go to the database on a miss should call token() before
+    the read and pass it to set(): if any key was invalidated in between,
+    the value they read may already be stale and is not stored
+    """
+
+    def __init__(self, size=1024, ttl=30.0):
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key):
+        """ Returns the cached value for key or None """
+        with self.__lock:
+            entry = self.__entries.pop(key, None)
+            if entry is None or entry[1] < time.time():
+                self.misses += 1
+                return None
+            self.__entries[key] = entry  # re-insert as most recently used
+            self.hits += 1
+            return entry[0]
+
+    def token(self):
+        """ Returns a marker of the invalidations seen so far """
+        return self.invalidations
+
+    def set(self, key, value, token=None):
+        """ Stores value for key unless anything was invalidated since token """
+        if self.size <= 0:
+            return
+        with self.__lock:
+            if token is not None and token != self.invalidations:
+                return
+            self.__entries.pop(key, None)
+            self.__entries[key] = (value, time.time() + self.ttl)
+            while len(self.__entries) > self.size:
+                self.__entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        """ Drops key from the cache """
+        with self.__lock:
+            self.invalidations += 1
+            self.__entries.pop(key, None)
+
+    def clear(self):
+        """ Drops every entry from the cache """
+        with self.__lock:
+            self.invalidations += 1
+            self.__entries.clear()
+
+    def stats(self):
+        """ Returns the hit, miss and size counters as a dictionary """
+        with self.__lock:
+            return {
+                'size': len(self.__entries),
+                'capacity': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
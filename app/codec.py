@@ -0,0 +1,150 @@
+# Copyright 2017 NYU-FOXTROT. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Record codecs for Inventory values stored in Redis
+
+Every value written by a codec starts with that codec's version byte so
+that values written by different codecs can live side by side while a
+migration is running. Values without a known version byte are legacy
+pickles from before codecs existed.
+
+Codecs
+------
+JsonCodec - compact JSON array, always available
+MsgpackCodec - MessagePack array, needs the optional msgpack package
+PickleCodec - the legacy format, only read when allow_pickle is set
+"""
+
+import json
+import pickle
+
+try:
+    import msgpack
+except ImportError:  # msgpack is an optional dependency
+    msgpack = None
+
+# field order of the compact array encodings, which end with the record version
+FIELDS = ('id', 'name', 'quantity', 'status')
+
+
+def to_array(data):
+    """ Lists the fields of a record in FIELDS order followed by its version """
+    return [data[field] for field in FIELDS] + [data.get('version', 0)]
+
+
+def from_array(values):
+    """ Builds a record from to_array() output; older arrays have no version """
+    data = dict(zip(FIELDS, values))
+    data['version'] = values[len(FIELDS)] if len(values) > len(FIELDS) else 0
+    return data
+
+
+class CodecError(Exception):
+    """ Used when a stored value cannot be decoded """
+    pass
+
+
+class Codec(object):
+    """ Turns Inventory dictionaries into bytes and back """
+    name = None
+    version = None
+
+    def encode(self, data):
+        """ Encodes a dictionary, prefixed with the version byte """
+        raise NotImplementedError
+
+    def decode(self, value):
+        """ Decodes a value written by encode() """
+        raise NotImplementedError
+
+
+class JsonCodec(Codec):
+    """ JSON array of the fields in FIELDS order and the version """
+    name = 'json'
+    version = b'\x01'
+
+    def encode(self, data):
+        return self.version + json.dumps(to_array(data), separators=(',', ':'))
+
+    def decode(self, value):
+        return from_array(json.loads(value[1:]))
+
+
+class MsgpackCodec(Codec):
+    """ MessagePack array of the fields in FIELDS order and the version """
+    name = 'msgpack'
+    version = b'\x02'
+
+    def __init__(self):
+        if msgpack is None:
+            raise CodecError('The msgpack codec needs the msgpack package installed')
+
+    def encode(self, data):
+        return self.version + msgpack.packb(to_array(data), use_bin_type=True)
+
+    def decode(self, value):
+        return from_array(msgpack.unpackb(value[1:], raw=False))
+
+
+class PickleCodec(Codec):
+    """ The legacy pickle format, which has no version byte """
+    name = 'pickle'
+
+    def encode(self, data):
+        return pickle.dumps(data)
+
+    def decode(self, value):
+        return pickle.loads(value)
+
+
+CODECS = dict((codec.name, codec) for codec in (JsonCodec, MsgpackCodec, PickleCodec))
+
+
+def get_codec(name):
+    """ Returns a codec instance by name """
+    if name not in CODECS:
+        raise CodecError('Unknown codec {}, expected one of {}'.format(
+            name, ', '.join(sorted(CODECS))))
+    return CODECS[name]()
+
+
+class Registry(object):
+    """ Writes with one codec and reads the values of every known codec """
+
+    def __init__(self, codec, allow_pickle=False):
+        self.codec = codec
+        self.allow_pickle = allow_pickle
+        self.__readers = {JsonCodec.version: JsonCodec()}
+        if msgpack is not None:
+            self.__readers[MsgpackCodec.version] = MsgpackCodec()
+        self.__pickle = PickleCodec()
+
+    def encode(self, data):
+        """ Encodes a dictionary with the current codec """
+        return self.codec.encode(data)
+
+    def decode(self, value):
+        """ Decodes a value written by any codec """
+        reader = self.__readers.get(value[:1])
+        if reader is not None:
+            return reader.decode(value)
+        if self.allow_pickle:
+            return self.__pickle.decode(value)
+        raise CodecError('Refusing to unpickle a legacy value; run the codec migration first')
+
+    def is_current(self, value):
+        """ Tells whether a value was written by the current codec """
+        if self.codec.version is None:
+            return value[:1] not in self.__readers
+        return value[:1] == self.codec.version
@@ -0,0 +1,224 @@
+# Copyright 2017 NYU-FOXTROT. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Storage layouts for Inventory records in Redis
+
+A layout decides which keys hold a record and how its fields are laid
+out in them. Reads take either the Redis client or a pipeline that is
+WATCHing (and so executes immediately); writes are queued on a pipeline
+so that they commit together with the index updates.
+
+Layouts
+-------
+StringLayout - one string per record under its id, encoded by a codec
+HashLayout - one hash per record under inventory:{id}, one field per attribute
+BucketLayout - encoded records packed into small hashes under bucket:{id // size}
+"""
+
+
+class LayoutError(Exception):
+    """ Used for an unknown layout name """
+    pass
+
+
+class Layout(object):
+    """ Maps Inventory records onto Redis keys """
+    name = None
+    # True when the quantity is a field Redis can increment in place
+    field_updates = False
+
+    def __init__(self, codec=None):
+        self.codec = codec
+
+    def key(self, inventory_id):
+        """ Returns the key that holds a record, for WATCH """
+        raise NotImplementedError
+
+    def read(self, client, inventory_id):
+        """ Returns a record as a dictionary, or None if it does not exist """
+        raise NotImplementedError
+
+    def read_many(self, redis, ids):
+        """ Returns the records for ids in one round trip, None where missing """
+        raise NotImplementedError
+
+    def read_quantity(self, client, inventory_id):
+        """ Returns just the quantity of a record, or None if it does not exist """
+        data = self.read(client, inventory_id)
+        return None if data is None else data['quantity']
+
+    def write(self, pipe, data):
+        """ Queues the commands that store a record """
+        raise NotImplementedError
+
+    def delete(self, pipe, inventory_id):
+        """ Queues the commands that remove a record """
+        pipe.delete(self.key(inventory_id))
+
+    def scan(self, redis, cursor, count):
+        """ Returns the next SCAN cursor and the ids of the records on this page """
+        raise NotImplementedError
+
+    def read_values(self, redis, ids):
+        """ Returns the encoded values stored for ids, empty if nothing is encoded """
+        return []
+
+
+class StringLayout(Layout):
+    """ One string value per record, keyed by the bare id """
+    name = 'string'
+
+    def key(self, inventory_id):
+        return inventory_id
+
+    def __decode(self, value):
+        return None if value is None else self.codec.decode(value)
+
+    def read(self, client, inventory_id):
+        return self.__decode(client.get(inventory_id))
+
+    def read_many(self, redis, ids):
+        return [self.__decode(value) for value in self.read_values(redis, ids)]
+
+    def read_values(self, redis, ids):
+        if not ids:
+            return []
+        return redis.mget(ids)
+
+    def write(self, pipe, data):
+        pipe.set(data['id'], self.codec.encode(data))
+
+    def scan(self, redis, cursor, count):
+        # only record keys are numeric; skip the id counter and index sets
+        return redis.scan(cursor, match='[0-9]*', count=count)
+
+
+class HashLayout(Layout):
+    """ One hash per record with a field for each attribute """
+    name = 'hash'
+    prefix = 'inventory:'
+    field_updates = True
+
+    def key(self, inventory_id):
+        return '%s%s' % (self.prefix, inventory_id)
+
+    @staticmethod
+    def __decode(inventory_id, fields):
+        if not fields:
+            return None
+        return {
+            'id': int(inventory_id),
+            'name': fields[b'name'].decode('utf-8'),
+            'quantity': int(fields[b'quantity']),
+            'status': fields[b'status'].decode('utf-8'),
+            'version': int(fields.get(b'version', 0))
+        }
+
+    def read(self, client, inventory_id):
+        return self.__decode(inventory_id, client.hgetall(self.key(inventory_id)))
+
+    def read_many(self, redis, ids):
+        pipe = redis.pipeline(transaction=False)
+        for inventory_id in ids:
+            pipe.hgetall(self.key(inventory_id))
+        return [self.__decode(inventory_id, fields)
+                for inventory_id, fields in zip(ids, pipe.execute())]
+
+    def read_quantity(self, client, inventory_id):
+        quantity = client.hget(self.key(inventory_id), 'quantity')
+        return None if quantity is None else int(quantity)
+
+    def write(self, pipe, data):
+        pipe.hset(self.key(data['id']), mapping={
+            'name': data['name'],
+            'quantity': data['quantity'],
+            'status': data['status'],
+            'version': data.get('version', 0)
+        })
+
+    def scan(self, redis, cursor, count):
+        cursor, keys = redis.scan(cursor, match=self.prefix + '[0-9]*', count=count)
+        return cursor, [int(key[len(self.prefix):]) for key in keys]
+
+
+class BucketLayout(Layout):
+    """
+    Encoded records packed into hashes of at most size records each
+
+    A small hash is kept in Redis' compact ziplist/listpack encoding, which
+    saves the dictionary entry, key object and expiry bookkeeping a top
+    level key costs per record. Keep size at or below the server's
+    hash-max-ziplist-entries (128 by default) and records shorter than
+    hash-max-ziplist-value (64 bytes) for the compact encoding to apply
+    """
+    name = 'bucket'
+    prefix = 'bucket:'
+
+    def __init__(self, codec=None, size=100):
+        super(BucketLayout, self).__init__(codec)
+        self.size = size
+
+    def key(self, inventory_id):
+        return '%s%d' % (self.prefix, int(inventory_id) // self.size)
+
+    def field(self, inventory_id):
+        """ Returns the hash field that holds a record within its bucket """
+        return int(inventory_id) % self.size
+
+    def __decode(self, value):
+        return None if value is None else self.codec.decode(value)
+
+    def read(self, client, inventory_id):
+        return self.__decode(client.hget(self.key(inventory_id), self.field(inventory_id)))
+
+    def read_many(self, redis, ids):
+        return [self.__decode(value) for value in self.read_values(redis, ids)]
+
+    def read_values(self, redis, ids):
+        pipe = redis.pipeline(transaction=False)
+        for inventory_id in ids:
+            pipe.hget(self.key(inventory_id), self.field(inventory_id))
+        return pipe.execute() if ids else []
+
+    def write(self, pipe, data):
+        pipe.hset(self.key(data['id']), self.field(data['id']), self.codec.encode(data))
+
+    def delete(self, pipe, inventory_id):
+        pipe.hdel(self.key(inventory_id), self.field(inventory_id))
+
+    def scan(self, redis, cursor, count):
+        # SCAN counts keys, and every key here holds up to size records
+        cursor, keys = redis.scan(cursor, match=self.prefix + '[0-9]*',
+                                  count=max(1, count // self.size))
+        pipe = redis.pipeline(transaction=False)
+        for key in keys:
+            pipe.hkeys(key)
+        ids = []
+        for key, fields in zip(keys, pipe.execute() if keys else []):
+            base = int(key[len(self.prefix):]) * self.size
+            ids.extend(base + int(field) for field in fields)
+        return cursor, ids
+
+
+LAYOUTS = dict((layout.name, layout) for layout in (StringLayout, HashLayout, BucketLayout))
+
+
+def get_layout(name, codec, bucket_size=100):
+    """ Returns a layout instance by name; codec encodes string values """
+    if name not in LAYOUTS:
+        raise LayoutError('Unknown layout {}, expected one of {}'.format(
+            name, ', '.join(sorted(LAYOUTS))))
+    if name == BucketLayout.name:
+        return BucketLayout(codec, bucket_size)
+    return LAYOUTS[name](codec)
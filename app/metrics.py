@@ -0,0 +1,400 @@
+# Copyright 2017 NYU-FOXTROT. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Process-local metrics in the Prometheus text exposition format
+
+Recording a value is a dictionary update under a lock; the text is only
+built when /metrics is scraped. Every worker process keeps its own
+metrics, so scrape each worker (or aggregate them) when running more
+than one.
+
+Classes
+-------
+Counter - totals per label set
+Gauge - current values per label set
+Histogram - cumulative buckets, sum and count per label set
+Registry - renders a group of metrics as text
+InstrumentedRedis - a Redis client that counts and times its round trips
+
+Round trip tracing (INVENTORY_TRACE=true) also keeps the command sequence
+of each request, returns its round trip count in an X-Redis-Round-Trips
+header and logs the sequence of requests that were slow, went over the
+round trip budget, or sent the same command on its own over and over
+(the N+1 pattern that one MGET or pipeline would avoid).
+"""
+
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from redis import Redis
+from redis.client import Pipeline
+
+# set INVENTORY_METRICS=false to skip recording altogether
+enabled = os.getenv('INVENTORY_METRICS', 'true').lower() == 'true'
+# opt-in tracing of the Redis command sequence of each request
+trace = os.getenv('INVENTORY_TRACE', 'false').lower() == 'true'
+# most round trips a request should need before it is reported
+round_trip_budget = int(os.getenv('INVENTORY_ROUND_TRIP_BUDGET', '10'))
+# requests slower than this many seconds have their sequence logged
+slow_request = float(os.getenv('INVENTORY_SLOW_REQUEST_MS', '500')) / 1000
+# the same command sent this many times in its own round trip looks like N+1
+repeat_threshold = int(os.getenv('INVENTORY_REPEAT_THRESHOLD', '5'))
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+ROUND_TRIP_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+
+def _escape(value):
+    """ Escapes a label value for the text format """
+    return unicode(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _format_labels(names, values, extra=None):
+    """ Renders label pairs as {name="value",...} or nothing """
+    pairs = ['{}="{}"'.format(name, _escape(value)) for name, value in zip(names, values)]
+    if extra:
+        pairs.append('{}="{}"'.format(*extra))
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    """ Renders a sample value the way Prometheus expects """
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return repr(int(value))
+    return repr(value)
+
+
+class Metric(object):
+    """ A named metric with a fixed set of label names """
+    kind = None
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        """ Orders the label values of a sample as declared """
+        return tuple(labels[name] for name in self.labels)
+
+    def clear(self):
+        """ Forgets every recorded sample """
+        with self._lock:
+            self._values.clear()
+
+    def samples(self):
+        """ Yields (suffix, label values, extra label, value) for every sample """
+        raise NotImplementedError
+
+    def render(self):
+        """ Returns the metric in the text format """
+        lines = ['# HELP {} {}'.format(self.name, self.description),
+                 '# TYPE {} {}'.format(self.name, self.kind)]
+        for suffix, values, extra, value in self.samples():
+            lines.append('{}{}{} {}'.format(self.name, suffix,
+                                            _format_labels(self.labels, values, extra),
+                                            _format_value(value)))
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    """ A total that only goes up """
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        """ Adds amount to the total for labels """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        """ Returns the total for labels """
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for values, total in items:
+            yield '', values, None, total
+
+
+class Gauge(Metric):
+    """ A value that is set to its current reading """
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        """ Replaces the value for labels """
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for values, value in items:
+            yield '', values, None, value
+
+
+class Histogram(Metric):
+    """ Observations counted into cumulative buckets """
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        super(Histogram, self).__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        """ Counts value into its bucket for labels """
+        key = self._key(labels)
+        position = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            entry[0][position] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def count(self, **labels):
+        """ Returns how many values were observed for labels """
+        entry = self._values.get(self._key(labels))
+        return entry[2] if entry else 0
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, (list(entry[0]), entry[1], entry[2]))
+                           for key, entry in self._values.items())
+        for values, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield '_bucket', values, ('le', _format_value(float(bound))), cumulative
+            yield '_sum', values, None, total
+            yield '_count', values, None, count
+
+
+class Registry(object):
+    """ A group of metrics rendered together """
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        """ Adds a metric and returns it """
+        self.metrics.append(metric)
+        return metric
+
+    def clear(self):
+        """ Forgets the samples of every metric """
+        for metric in self.metrics:
+            metric.clear()
+
+    def render(self):
+        """ Returns every metric in the text format """
+        return '\n'.join(metric.render() for metric in self.metrics) + '\n'
+
+
+registry = Registry()
+HTTP_REQUESTS = registry.register(Counter(
+    'inventory_http_requests_total', 'HTTP requests by route, method and status code',
+    ('method', 'route', 'status')))
+HTTP_LATENCY = registry.register(Histogram(
+    'inventory_http_request_duration_seconds', 'Time spent serving HTTP requests',
+    ('method', 'route')))
+RESULT_SIZE = registry.register(Histogram(
+    'inventory_list_result_size', 'Inventories returned by list responses',
+    ('method', 'route'), SIZE_BUCKETS))
+REQUEST_ROUND_TRIPS = registry.register(Histogram(
+    'inventory_redis_round_trips_per_request', 'Redis round trips made by one HTTP request',
+    ('method', 'route'), ROUND_TRIP_BUCKETS))
+REQUEST_REDIS_TIME = registry.register(Histogram(
+    'inventory_redis_seconds_per_request', 'Time one HTTP request waited on Redis',
+    ('method', 'route')))
+REDIS_COMMANDS = registry.register(Counter(
+    'inventory_redis_commands_total', 'Redis commands sent, pipelined ones included',
+    ('command',)))
+REDIS_LATENCY = registry.register(Histogram(
+    'inventory_redis_round_trip_duration_seconds',
+    'Time spent on Redis round trips, a pipeline counted as one PIPELINE',
+    ('command',)))
+CACHE = registry.register(Gauge(
+    'inventory_cache', 'Counters of the in-process record cache', ('stat',)))
+POOL = registry.register(Gauge(
+    'inventory_redis_pool_connections', 'Redis connections in the pool', ('state',)))
+OVER_BUDGET = registry.register(Counter(
+    'inventory_round_trip_budget_exceeded_total',
+    'Traced requests that made more Redis round trips than the budget', ('method', 'route')))
+REPEATED_COMMANDS = registry.register(Counter(
+    'inventory_repeated_commands_total',
+    'Traced requests that sent one command in many separate round trips', ('method', 'route')))
+
+
+######################################################################
+#  P E R   R E Q U E S T   A C C O U N T I N G
+######################################################################
+_request = threading.local()
+
+
+def start_request():
+    """ Starts counting the Redis round trips of the current request """
+    _request.round_trips = 0
+    _request.redis_seconds = 0.0
+    _request.sequence = [] if trace else None
+    _request.started = time.time()
+
+
+def finish_request(method, route, status_code):
+    """
+    Records the current request and its Redis usage
+
+    Returns:
+        the number of Redis round trips the request made, or None when
+        the request was not being counted
+    """
+    started = getattr(_request, 'started', None)
+    if started is None:
+        return None
+    elapsed = time.time() - started
+    round_trips = _request.round_trips
+    HTTP_REQUESTS.inc(method=method, route=route, status=status_code)
+    HTTP_LATENCY.observe(elapsed, method=method, route=route)
+    REQUEST_ROUND_TRIPS.observe(round_trips, method=method, route=route)
+    REQUEST_REDIS_TIME.observe(_request.redis_seconds, method=method, route=route)
+    if _request.sequence is not None:
+        _check_trace('{} {}'.format(method, route), elapsed, _request.sequence,
+                     method=method, route=route)
+    _request.started = None
+    return round_trips
+
+
+def _check_trace(request, elapsed, sequence, **labels):
+    """ Logs the command sequence of a request that broke one of the limits """
+    problems = []
+    if len(sequence) > round_trip_budget:
+        OVER_BUDGET.inc(**labels)
+        problems.append('{} round trips, budget is {}'.format(len(sequence), round_trip_budget))
+    repeats = {}
+    for label, _, _ in sequence:
+        if label != 'PIPELINE':
+            repeats[label] = repeats.get(label, 0) + 1
+    repeated = sorted(label for label, count in repeats.items() if count >= repeat_threshold)
+    if repeated:
+        REPEATED_COMMANDS.inc(**labels)
+        problems.append('possible N+1: ' + ', '.join(
+            '{} sent {} times'.format(label, repeats[label]) for label in repeated))
+    if elapsed > slow_request:
+        problems.append('took {:.1f}ms'.format(elapsed * 1000))
+    if problems:
+        logger.warning('%s: %s; Redis calls: %s', request, '; '.join(problems),
+                       ', '.join(_describe(call) for call in sequence))
+
+
+def _describe(call):
+    """ Renders one traced round trip for the log """
+    label, detail, seconds = call
+    return '{} {} ({:.2f}ms)'.format(label, detail, seconds * 1000)
+
+
+def trace_sequence():
+    """ Returns the (command, detail, seconds) round trips traced so far in this request """
+    return list(getattr(_request, 'sequence', None) or [])
+
+
+def record_round_trip(label, seconds, commands, detail=''):
+    """ Records one Redis round trip, timed under label, that carried commands """
+    for command in commands:
+        REDIS_COMMANDS.inc(command=command)
+    REDIS_LATENCY.observe(seconds, command=label)
+    if getattr(_request, 'started', None) is not None:
+        _request.round_trips += 1
+        _request.redis_seconds += seconds
+        if _request.sequence is not None:
+            _request.sequence.append((label, detail, seconds))
+
+
+def _command_name(args):
+    """ Returns the name of the command in a Redis call """
+    return str(args[0]).split(' ')[0].upper()
+
+
+def _command_detail(args):
+    """ Returns the first argument of a Redis call, usually its key, for a trace """
+    if not trace or len(args) < 2:
+        return ''
+    detail = args[1] if isinstance(args[1], basestring) else str(args[1])
+    return detail[:40]
+
+
+def _pipeline_detail(commands):
+    """ Summarizes the commands of a pipeline as NAME x count, for a trace """
+    if not trace:
+        return ''
+    counts = []
+    for command in commands:
+        if counts and counts[-1][0] == command:
+            counts[-1][1] += 1
+        else:
+            counts.append([command, 1])
+    return '[{}]'.format(' '.join(command if count == 1 else '{}x{}'.format(command, count)
+                                  for command, count in counts))
+
+
+class InstrumentedPipeline(Pipeline):
+    """ A pipeline that records its execution as one round trip """
+
+    def immediate_execute_command(self, *args, **options):
+        # commands sent straight away while WATCHing
+        started = time.time()
+        try:
+            return super(InstrumentedPipeline, self).immediate_execute_command(*args, **options)
+        finally:
+            command = _command_name(args)
+            record_round_trip(command, time.time() - started, (command,), _command_detail(args))
+
+    def execute(self, raise_on_error=True):
+        commands = [_command_name(args) for args, _ in self.command_stack]
+        if not commands:
+            return super(InstrumentedPipeline, self).execute(raise_on_error)
+        started = time.time()
+        try:
+            return super(InstrumentedPipeline, self).execute(raise_on_error)
+        finally:
+            record_round_trip('PIPELINE', time.time() - started, commands,
+                              _pipeline_detail(commands))
+
+
+class InstrumentedRedis(Redis):
+    """ A Redis client that counts and times every round trip """
+
+    def execute_command(self, *args, **options):
+        started = time.time()
+        try:
+            return super(InstrumentedRedis, self).execute_command(*args, **options)
+        finally:
+            command = _command_name(args)
+            record_round_trip(command, time.time() - started, (command,), _command_detail(args))
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks,
+                                    transaction, shard_hint)
@@ -26,6 +26,7 @@ id (int) - uuid used to identify one inventory record
 name (string) - the name of the product
 quantity(int) - amount of Product Inventories
 status (string) - the status of the inventory : new, openBox and used
+version (int) - bumped by every write of the record, used for ETags
 
 """
 
@@ -40,14 +41,20 @@ for a server name 'redis' to connect to.
 """
 
 import threading
+import time
 # import enum
 import os
 import json
 import logging
-import pickle
 from cerberus import Validator
-from redis import Redis
-from redis.exceptions import ConnectionError
+from redis import Redis, BlockingConnectionPool
+from redis.exceptions import ConnectionError, TimeoutError
+from app.cache import LRUCache
+from app.codec import Registry, get_codec
+from app.layout import get_layout
+from app.storage import INDEXED, InsufficientQuantityError, MemoryStorage, RedisStorage, \
+    normalize
+from app import metrics
 
 
 class DataValidationError(Exception):
@@ -57,17 +64,26 @@ class DataValidationError(Exception):
 class DatabaseConnectionError(ConnectionError):
     pass
 
+class VersionConflictError(Exception):
+    """ Used when a conditional write finds a version it was not told to expect """
+    pass
+
 ######################################################################
 # Inventory Model for database
-#   This class must be initialized with use_db(redis) before using
-#   where redis is a value connection to a Redis database
+#   This class must be initialized with init_db() or use_storage(storage)
+#   before using
 ######################################################################
 
 class Inventory(object):
     """ Inventory interface to database """
 
+    # no per-instance __dict__, large result sets hold many of these
+    __slots__ = ('id', 'name', 'quantity', 'status', 'version')
     logger = logging.getLogger(__name__)
     redis = None
+    # where records live: a RedisStorage, or a MemoryStorage when
+    # INVENTORY_STORAGE=memory; see app.storage
+    storage = None
     schema = {
         'id': {'type': 'integer'},
         'name': {'type': 'string', 'required': True},
@@ -75,42 +91,86 @@ class Inventory(object):
         'status': {'type': 'string', 'required': True}
     }
     __validator = Validator(schema)
+    # attributes with an index of ids kept in sync by save() and delete()
+    indexed = INDEXED
+    # filters on the bounds of the quantity, answered from its ordered index
+    ranges = ('quantity_min', 'quantity_max')
+    # orders find_sorted() reads from an index, '-' for descending
+    sorts = ('id', 'name', 'quantity', '-quantity')
+    # read-through cache for find(), kept coherent across workers over pub/sub
+    cache = LRUCache(int(os.getenv('INVENTORY_CACHE_SIZE', '1024')),
+                     float(os.getenv('INVENTORY_CACHE_TTL', '30')))
+    invalidation_channel = RedisStorage.invalidation_channel
+    # encoding of stored records; legacy pickles are only read while a codec
+    # migration is pending, unless INVENTORY_ALLOW_PICKLE asks for them
+    codec = Registry(get_codec(os.getenv('INVENTORY_CODEC', 'json')),
+                     os.getenv('INVENTORY_ALLOW_PICKLE',
+                               os.getenv('INVENTORY_MIGRATE_CODEC', 'false')).lower() == 'true')
+    # how records are laid out in Redis: a string per record, a hash per record
+    # or encoded records packed into hashes of INVENTORY_BUCKET_SIZE
+    bucket_size = int(os.getenv('INVENTORY_BUCKET_SIZE', '100'))
+    layout = get_layout(os.getenv('INVENTORY_LAYOUT', 'string'), codec, bucket_size)
+
+    # Redis connection settings: name -> (environment variable, type, default)
+    # a VCAP_SERVICES credential with the same name overrides the default
+    # and the environment variable overrides both
+    redis_options = {
+        'max_connections': ('REDIS_MAX_CONNECTIONS', int, 50),
+        'timeout': ('REDIS_POOL_TIMEOUT', float, 5.0),  # wait for a free connection
+        'socket_timeout': ('REDIS_SOCKET_TIMEOUT', float, 5.0),
+        'socket_connect_timeout': ('REDIS_CONNECT_TIMEOUT', float, 2.0),
+        'health_check_interval': ('REDIS_HEALTH_CHECK_INTERVAL', int, 30),
+        'retry_on_timeout': ('REDIS_RETRY_ON_TIMEOUT', bool, True),
+        'connect_retries': ('REDIS_CONNECT_RETRIES', int, 3),
+        'retry_backoff': ('REDIS_RETRY_BACKOFF', float, 0.5)
+    }
 
-    lock = threading.Lock()
-    data = []
-    index = 0
-
-    def __init__(self, inventoryid=0, name='', quantity=0, status=''):
+    def __init__(self, inventoryid=0, name='', quantity=0, status='', version=0):
         """ Initialize a Inventory """
         self.id = inventoryid
         self.name = name
         self.quantity = quantity
         self.status = status
+        self.version = version
 
-    def save(self):
-        """ Saves an Inventory in the database """
+    def save(self, expected_versions=None):
+        """
+        Saves an Inventory in the database
+
+        Args:
+            expected_versions (collection): optionally only write over a
+                stored record with one of these versions; the check and the
+                write are one compare-and-set, so concurrent writers cannot
+                slip in between
+        Raises:
+            VersionConflictError - if the stored record has another version
+        """
         if self.name is None:  # name is the only required field
             raise DataValidationError('name attribute is not set')
         if self.id == 0:
             self.id = Inventory.__next_index()
-        Inventory.redis.set(self.id, pickle.dumps(self.serialize()))
-        # """
-        # Saves inventory (in - memory data), replace the old inventory record if it already exists
-        # """
-        # if self.id == 0:
-        #     self.id = self.__next_index()
-        #     Inventory.data.append(self)
-        # else:
-        #     for i in range(len(Inventory.data)):
-        #         if Inventory.data[i].id == self.id:
-        #             Inventory.data[i] = self
-        #             break
+        data = self.serialize()
+
+        def update(current):
+            """ Replaces the record if it still has an expected version """
+            old = current[self.id]
+            if expected_versions is not None and \
+                    (old is None or old.get('version', 0) not in expected_versions):
+                raise VersionConflictError(
+                    'Inventory {} is at version {}, expected {}'.format(
+                        self.id, old and old.get('version', 0),
+                        ' or '.join(str(version) for version in sorted(expected_versions))))
+            return [(self.id, old, data)], None
+
+        Inventory.storage.transaction([self.id], update)
+        self.version = data['version']
+        Inventory.cache.invalidate(self.id)
 
     def delete(self):
         """ Deletes an Inventory from the database """
-        Inventory.redis.delete(self.id)
-        # """ Delete inventory record with specified id, name, quantiy and status"""
-        # Inventory.data.remove(self)
+        Inventory.storage.transaction(
+            [self.id], lambda current: ([(self.id, current[self.id], None)], None))
+        Inventory.cache.invalidate(self.id)
 
     def serialize(self):
         """ Serializes an Inventory into a dictionary """
@@ -120,11 +180,23 @@ class Inventory(object):
             "quantity": self.quantity,
             "status": self.status
         }
-        # """ Serializes Inventory into a dictionary """
-        # return {"id": self.id, "name": self.name, "quantity": self.quantity, "status": self.status}
+
+    @staticmethod
+    def from_record(data):
+        """
+        Builds an Inventory from a record read back from the database
+
+        Records are validated by deserialize() on their way in, so stored
+        data is trusted here and skips the schema check
+        """
+        return Inventory(data['id'], data['name'], data['quantity'], data['status'],
+                         data.get('version', 0))
 
     def deserialize(self, data):
         """ Deserializes an Inventory, marshalling the data """
+        # cerberus counts booleans as integers, but they cannot be counted or indexed
+        if isinstance(data, dict) and isinstance(data.get('quantity'), bool):
+            raise DataValidationError('Invalid Inventory data: quantity must be an integer')
         if isinstance(data, dict) and Inventory.__validator.validate(data):
             self.name = data['name']
             self.quantity = data['quantity']
@@ -132,23 +204,6 @@ class Inventory(object):
         else:
             raise DataValidationError('Invalid Inventory data: ' + str(Inventory.__validator.errors))
         return self
-        # """
-        # Deserializes a Inventory from a dictionary
-        #
-        # Args:
-        #     data (dict): A dictionary containing the Inventory data
-        # """
-        # if not isinstance(data, dict):
-        #     raise DataValidationError('Invalid Inventory: body of request contained bad or no data')
-        # if data.has_key('id'):
-        #     self.id = data['id']
-        # try:
-        #     self.name = data['name']
-        #     self.quantity = data['quantity']
-        #     self.status = data['status']
-        # except KeyError as err:
-        #     raise DataValidationError('Invalid Inventory: missing ' + err.args[0])
-        # return
 
     ######################################################################
     #  S T A T I C   D A T A B S E   M E T H O D S
@@ -157,37 +212,214 @@ class Inventory(object):
     @staticmethod
     def __next_index():
         """ Increments the index and returns it """
-        return Inventory.redis.incr('index')
-        # """ Generates the next index in a continual sequence """
-        # with Inventory.lock:
-        #     Inventory.index += 1
-        # return Inventory.index
+        return Inventory.storage.next_ids()
+
+    @staticmethod
+    def __load(ids):
+        """ Fetches the records with the given ids in a single round trip """
+        results = []
+        for data in Inventory.storage.read_many(ids):
+            if data is not None:  # deleted since the index was read
+                results.append(Inventory.from_record(data))
+        return results
 
     @staticmethod
-    def use_db(redis):
-        Inventory.__redis = redis
+    def __iter_load(ids, batch_size):
+        """ Generator that loads the Inventories for ids batch_size at a time """
+        for start in range(0, len(ids), batch_size):
+            for inventory in Inventory.__load(ids[start:start + batch_size]):
+                yield inventory
+
+    @staticmethod
+    def use_storage(storage):
+        """ Stores Inventories in storage from now on """
+        if Inventory.storage is not None:
+            Inventory.storage.stop_listening()
+        Inventory.storage = storage
+        Inventory.redis = getattr(storage, 'redis', None)
+        Inventory.cache.clear()
+        storage.listen(Inventory.cache)
 
     @staticmethod
     def all():
         """ Query that returns all Inventories """
+        return list(Inventory.iter_all())
+
+    @staticmethod
+    def iter_all(batch_size=500):
+        """
+        Generator that yields all Inventories in id order
+        The id index is paged by score rather than SCANned: SCAN may return
+        a key twice while Redis rehashes, and its order changes between
+        calls. Memory and round trips grow with batch_size, not the catalog
+        """
+        after_id = 0
+        while True:
+            ids = Inventory.storage.select({}, after_id, batch_size)
+            for inventory in Inventory.__load(ids):
+                yield inventory
+            if len(ids) < batch_size:
+                break
+            after_id = ids[-1]
+
+    @staticmethod
+    def migrate_codec(batch_size=500):
+        """
+        Rewrites every record not yet stored with the current codec
+
+        Once every record is current, legacy pickles are no longer read,
+        unless INVENTORY_ALLOW_PICKLE asks for them
+
+        Returns:
+            the number of records that were rewritten, always 0 for
+            storage that does not encode records
+        """
+        migrated = Inventory.storage.migrate_codec(batch_size)
+        if os.getenv('INVENTORY_ALLOW_PICKLE', 'false').lower() != 'true':
+            Inventory.codec.allow_pickle = False
+        return migrated
+
+    @staticmethod
+    def start_codec_migration(batch_size=500):
+        """ Runs migrate_codec() once on a background thread """
+        worker = threading.Thread(target=Inventory.migrate_codec, args=(batch_size,),
+                                  name='codec-migration')
+        worker.daemon = True
+        worker.start()
+        return worker
+
+    @staticmethod
+    def migrate_layout(source, batch_size=500):
+        """
+        Moves every record stored in the source layout to the current layout
+
+        Args:
+            source (string): the name of the layout the records are in now
+            batch_size (int): records moved per transaction
+
+        Returns:
+            the number of records that were moved, always 0 for storage
+            without layouts
+        """
+        return Inventory.storage.migrate_layout(source, batch_size)
+
+    @staticmethod
+    def start_layout_migration(source, batch_size=500):
+        """ Runs migrate_layout() once on a background thread """
+        worker = threading.Thread(target=Inventory.migrate_layout, args=(source, batch_size),
+                                  name='layout-migration')
+        worker.daemon = True
+        worker.start()
+        return worker
+
+    @staticmethod
+    def reindex(batch_size=500):
+        """
+        Rebuilds the index sets and totals from the stored records
+
+        Needed once for records written before an index existed, such
+        as data from older versions; see RedisStorage.reindex()
+
+        Returns:
+            the number of records that were indexed
+        """
+        return Inventory.storage.reindex(batch_size)
+
+    @staticmethod
+    def start_reindex(batch_size=500, source=None):
+        """
+        Runs reindex() once on a background thread
+        The index follows the records, so with a source layout they are
+        moved from it with migrate_layout() first
+        """
+        def rebuild():
+            """ Moves the records if asked to, then indexes them """
+            if source:
+                Inventory.migrate_layout(source, batch_size)
+            Inventory.reindex(batch_size)
+
+        worker = threading.Thread(target=rebuild, name='reindex')
+        worker.daemon = True
+        worker.start()
+        return worker
+
+    @staticmethod
+    def batch(operations):
+        """
+        Applies many creates, updates and deletes in a single transaction
+
+        Ids for all the creates are reserved at once, and the current
+        records for updates and deletes are read and rewritten in one
+        storage transaction
+
+        Args:
+            operations (list): ('create' | 'update' | 'delete', Inventory)
+                pairs, applied in order
+
+        Returns:
+            a list with the written Inventory for each operation, or None
+            where an update or delete named an id that does not exist
+        """
+        creates = [inventory for op, inventory in operations if op == 'create']
+        if creates:
+            first_id = Inventory.storage.next_ids(len(creates))
+            for offset, inventory in enumerate(creates):
+                inventory.id = first_id + offset
+        ids = sorted(set(inventory.id for op, inventory in operations if op != 'create'))
+
+        def apply(current):
+            """ Lists every change against the records as they stand """
+            current = dict(current)
+            changes = []
+            results = []
+            for op, inventory in operations:
+                old = current.get(inventory.id)
+                if op != 'create' and old is None:
+                    results.append((None, None))
+                    continue
+                new = None if op == 'delete' else inventory.serialize()
+                changes.append((inventory.id, old, new))
+                current[inventory.id] = new
+                results.append((inventory, new))
+            return changes, results
+
         results = []
-        for key in Inventory.redis.keys():
-            if key != 'index':  # filer out our id index
-                data = pickle.loads(Inventory.redis.get(key))
-                inventory = Inventory(data['id']).deserialize(data)
-                results.append(inventory)
+        for inventory, new in Inventory.storage.transaction(ids, apply):
+            if new:
+                inventory.version = new['version']
+            results.append(inventory)
+        for op, inventory in operations:
+            Inventory.cache.invalidate(inventory.id)
         return results
-        # """ Returns all of the Inventories in the database """
-        # return [inventory for inventory in Inventory.data]
+
+    @staticmethod
+    def adjust_quantity(inventory_id, delta, floor=None):
+        """
+        Atomically adds delta to the quantity of an Inventory
+
+        Concurrent adjustments are applied one after the other instead of
+        overwriting each other; see Storage.adjust() for how each backend
+        does it
+
+        Args:
+            inventory_id (int): the id of the Inventory to adjust
+            delta (int): the amount to add, negative to take stock out
+            floor (int): optional lowest quantity the adjustment may leave
+
+        Returns:
+            the new quantity, or None if there is no such Inventory
+        Raises:
+            InsufficientQuantityError - if the result would be below floor
+        """
+        quantity = Inventory.storage.adjust(inventory_id, delta, floor)
+        Inventory.cache.invalidate(inventory_id)
+        return quantity
 
     @staticmethod
     def remove_all():
         """ Removes all Inventories from the database """
-        Inventory.redis.flushall()
-        # """ Removes all of the Inventories from the database """
-        # del Inventory.data[:]
-        # Inventory.index = 0
-        # return Inventory.data
+        Inventory.storage.clear()
+        Inventory.cache.clear()
 
     ######################################################################
     #  F I N D E R   M E T H O D S
@@ -196,92 +428,366 @@ class Inventory(object):
     @staticmethod
     def find(inventory_id):
         """ Query that finds Inventories by their id """
-        if Inventory.redis.exists(inventory_id):
-            data = pickle.loads(Inventory.redis.get(inventory_id))
-            inventory = Inventory(data['id']).deserialize(data)
-            return inventory
-        return None
-        # """ Finds a Inventory by it's ID """
-        # if not Inventory.data:
-        #     return None
-        # Inventories = [inventory for inventory in Inventory.data if
-        #                      inventory.id == ProductInventory_id]
-        # if Inventories:
-        #     return Inventories[0]
-        # return None
+        data = Inventory.cache.get(inventory_id)
+        if data is None:
+            token = Inventory.cache.token()
+            data = Inventory.storage.read(inventory_id)
+            if data is None:
+                return None
+            Inventory.cache.set(inventory_id, data, token)
+        return Inventory.from_record(data)
+
+    @staticmethod
+    def find_quantity(inventory_id):
+        """ Query that returns just the quantity of an Inventory, or None """
+        return Inventory.storage.read_quantity(inventory_id)
 
     @staticmethod
     def __find_by(attribute, value):
         """ Generic Query that finds a key with a specific value """
-        # return [inventory for inventory in Inventory.__data if inventory.category == category]
         Inventory.logger.info('Processing %s query for %s', attribute, value)
-        if isinstance(value, str):
-            search_criteria = value.lower()  # make case insensitive
+        return Inventory.__load(Inventory.storage.select({attribute: value}))
+
+    @staticmethod
+    def __check_filters(filters):
+        """ Rejects filters on attributes that have no index """
+        for attribute in filters:
+            if attribute not in Inventory.indexed and attribute not in Inventory.ranges:
+                raise DataValidationError('Cannot query Inventories by ' + attribute)
+
+    @staticmethod
+    def __split_range(filters, minimum=None, maximum=None):
+        """
+        Separates quantity_min and quantity_max from the other filters
+        Returns the other filters and the tightest of those bounds and
+        minimum and maximum
+        """
+        filters = dict(filters)
+        low = filters.pop('quantity_min', None)
+        high = filters.pop('quantity_max', None)
+        if low is not None and (minimum is None or low > minimum):
+            minimum = low
+        if high is not None and (maximum is None or high < maximum):
+            maximum = high
+        return filters, minimum, maximum
+
+    @staticmethod
+    def __matches(inventory, filters):
+        """ Checks a loaded Inventory against filters, case insensitive """
+        filters, minimum, maximum = Inventory.__split_range(filters)
+        if minimum is not None and inventory.quantity < minimum:
+            return False
+        if maximum is not None and inventory.quantity > maximum:
+            return False
+        return all(normalize(getattr(inventory, attribute)) == normalize(value)
+                   for attribute, value in filters.items())
+
+    @staticmethod
+    def __select(filters, after_id=0, count=None):
+        """ Returns the ids matching every filter, in id order """
+        Inventory.__check_filters(filters)
+        query = filters
+        filters, minimum, maximum = Inventory.__split_range(filters)
+        if minimum is None and maximum is None:
+            return Inventory.storage.select(filters, after_id, count)
+        if count and not Inventory.__few_matches(query, count):
+            # a page of a wide range is found by walking the ids in order
+            return Inventory.storage.select(filters, after_id, count, minimum, maximum)
+        # a narrow range comes back in quantity order; only its ids are sorted here
+        ids = sorted(inventory_id for inventory_id in
+                     Inventory.storage.select_by_quantity(filters, minimum, maximum)
+                     if inventory_id > after_id)
+        return ids[:count] if count else ids
+
+    @staticmethod
+    def query(**filters):
+        """
+        Query that finds Inventories matching every given attribute
+
+        Args:
+            **filters: indexed attribute names (name, quantity, status)
+                and the values they must match, case insensitive, and
+                quantity_min or quantity_max to bound the quantity
+
+        Returns:
+            the matching Inventories ordered by id, or all of them when
+            no filters are given
+        """
+        Inventory.logger.info('Processing query for %s', filters)
+        return Inventory.__load(Inventory.__select(filters))
+
+    @staticmethod
+    def iter_query(batch_size=500, **filters):
+        """
+        Query like query() that yields the Inventories instead of listing them
+        The matching ids are selected up front and the records are read
+        batch_size at a time, so memory grows with batch_size, not the result
+        """
+        Inventory.logger.info('Processing query for %s', filters)
+        return Inventory.__iter_load(Inventory.__select(filters), batch_size)
+
+    @staticmethod
+    def __few_matches(filters, limit):
+        """
+        Planner for filtered orders: checks whether reading every match
+        and sorting them costs less than walking an index in the order
+        wanted, which reads about total / matches entries per match found
+        """
+        filters, minimum, maximum = Inventory.__split_range(filters)
+        matches, total = Inventory.storage.estimate(filters, minimum, maximum)
+        return matches * matches <= (limit or total) * total
+
+    @staticmethod
+    def find_sorted(sort, limit=None, name_prefix=None, batch_size=500, **filters):
+        """
+        Query that yields the Inventories matching filters in the order of sort
+
+        Each order is read from an index kept in that order, so with a
+        limit the query stops after limit Inventories instead of sorting
+        the whole result: ids come from the id index, quantities from the
+        quantity index intersected with the filters, and names from the
+        name index with the filters checked on the loaded records. A name
+        filter leaves its matches in id order, and filters with few
+        matches are loaded and sorted here rather than found by walking
+        the name index. Only the matches of a name_prefix are sorted here
+        for other orders, since those come from the name index
+
+        Args:
+            sort (string): id, name, quantity, or -quantity for highest first
+            limit (int): optionally stop after this many Inventories
+            name_prefix (string): optionally only names that start with this
+            **filters: optional attribute values to match, as in query()
+
+        Returns:
+            a generator of the matching Inventories
+        Raises:
+            DataValidationError - if sort is not one of Inventory.sorts
+        """
+        if sort not in Inventory.sorts:
+            raise DataValidationError('Cannot sort Inventories by {}, expected one of {}'.format(
+                sort, ', '.join(Inventory.sorts)))
+        Inventory.__check_filters(filters)
+        if sort == 'name' and 'name' in filters:
+            # every match has that one name, so they are listed by id
+            if name_prefix and not normalize(filters['name']).startswith(normalize(name_prefix)):
+                return iter([])
+            return Inventory.find_sorted('id', limit, None, batch_size, **filters)
+        if sort == 'name' and filters and Inventory.__few_matches(filters, limit):
+            inventories = [inventory for inventory in
+                           Inventory.__iter_load(Inventory.__select(filters), batch_size)
+                           if not name_prefix or
+                           normalize(inventory.name).startswith(normalize(name_prefix))]
+            inventories.sort(key=lambda inventory: (normalize(inventory.name), inventory.id))
+            return iter(inventories[:limit])
+        if sort == 'name' or name_prefix:
+            inventories = Inventory.find_by_name_prefix(
+                name_prefix or '', limit if sort == 'name' else None, batch_size, **filters)
+            if sort == 'name':
+                return inventories
+            attribute = sort.lstrip('-')
+            # ties go by the digits of the id, as in the quantity index
+            inventories = sorted(inventories, reverse=sort.startswith('-'),
+                                 key=lambda inventory: (getattr(inventory, attribute),
+                                                        str(inventory.id)))
+            return iter(inventories[:limit])
+        Inventory.logger.info('Processing query for %s sorted by %s', filters, sort)
+        if sort == 'id':
+            ids = Inventory.__select(filters, 0, limit)
         else:
-            search_criteria = value
-        results = []
-        for key in Inventory.redis.keys():
-            if key != 'index':  # filer out our id index
-                data = pickle.loads(Inventory.redis.get(key))
-                # perform case insensitive search on strings
-                if isinstance(data[attribute], str):
-                    test_value = data[attribute].lower()
-                else:
-                    test_value = data[attribute]
-                if test_value == search_criteria:
-                    results.append(Inventory(data['id']).deserialize(data))
-        return results
+            filters, minimum, maximum = Inventory.__split_range(filters)
+            ids = Inventory.storage.select_by_quantity(filters, minimum, maximum, limit,
+                                                       sort == '-quantity')
+        return Inventory.__iter_load(ids, batch_size)
+
+    @staticmethod
+    def find_by_quantity_range(minimum=None, maximum=None, limit=None, **filters):
+        """
+        Query that finds Inventories with a quantity from minimum to maximum
+
+        The ids are read from the index ordered by quantity, so the cost
+        grows with the Inventories returned, not with the catalog
+
+        Args:
+            minimum (int): the lowest quantity to return, None for no bound
+            maximum (int): the highest quantity to return, None for no bound
+            limit (int): optionally return only the first limit Inventories
+            **filters: optional attribute values to match, as in query()
+
+        Returns:
+            the matching Inventories ordered by quantity
+        """
+        Inventory.logger.info('Processing quantity range query for %s to %s and %s',
+                              minimum, maximum, filters)
+        Inventory.__check_filters(filters)
+        filters, minimum, maximum = Inventory.__split_range(filters, minimum, maximum)
+        return Inventory.__load(
+            Inventory.storage.select_by_quantity(filters, minimum, maximum, limit))
+
+    @staticmethod
+    def find_low_stock(threshold, limit=None, **filters):
+        """ Query that finds Inventories with less than threshold, lowest quantity first """
+        return Inventory.find_by_quantity_range(None, threshold - 1, limit, **filters)
+
+    @staticmethod
+    def find_by_name_prefix(prefix, limit=None, batch_size=500, **filters):
+        """
+        Query that yields Inventories whose name starts with prefix, for type-ahead
+
+        The name index is read in order a page at a time, so the cost
+        grows with the Inventories returned (and those skipped by
+        filters), not with the catalog
+
+        Args:
+            prefix (string): the start of the names to match, case insensitive
+            limit (int): optionally stop after this many Inventories
+            **filters: optional attribute values to match, as in query()
+
+        Returns:
+            a generator of the matching Inventories ordered by name
+        """
+        Inventory.logger.info('Processing name prefix query for %s and %s', prefix, filters)
+        Inventory.__check_filters(filters)
+        # without filters every entry read is returned, so read no more than limit
+        count = min(limit, batch_size) if limit and not filters else batch_size
+
+        def generate():
+            """ Walks the name index until limit Inventories matched """
+            found = 0
+            after = None
+            while True:
+                entries = Inventory.storage.select_names(prefix, after, count)
+                for inventory in Inventory.__load([entry[1] for entry in entries]):
+                    if Inventory.__matches(inventory, filters):
+                        yield inventory
+                        found += 1
+                        if found == limit:
+                            return
+                if len(entries) < count:
+                    return
+                after = entries[-1]
+
+        return generate()
+
+    @staticmethod
+    def find_page(limit, after_id=0, **filters):
+        """
+        Query that returns one page of Inventories ordered by id
+
+        Args:
+            limit (int): the largest number of Inventories to return
+            after_id (int): only return Inventories with a greater id
+            **filters: optional attribute values to match, as in query()
+
+        Returns:
+            the Inventories on the page and the id to pass as after_id
+            for the next page, or None if this is the last page
+        """
+        # ask for one extra id to learn whether another page follows
+        ids = Inventory.__select(filters, after_id, limit + 1)
+        next_id = int(ids[limit - 1]) if len(ids) > limit else None
+        return Inventory.__load(ids[:limit]), next_id
+
+    @staticmethod
+    def total_quantity(name, status=None):
+        """
+        Query that returns the total quantity of Inventories with a name
+
+        Args:
+            name (string): the name of the Inventories to count
+            status (string): optionally only count Inventories in this status
+        """
+        return Inventory.storage.total_quantity(name, status)
+
+    @staticmethod
+    def generation():
+        """ Query that returns a counter bumped by every write to any Inventory """
+        return Inventory.storage.generation()
+
+    @staticmethod
+    def epoch():
+        """ Query that returns a value that changes whenever ids and versions start over """
+        return Inventory.storage.epoch()
 
     @staticmethod
     def find_by_status(status):
         """ Query that finds Inventories by their status """
         return Inventory.__find_by('status', status)
-        # """ Returns all of the Inventories in a status
-        #
-        # Args:
-        #  status (string): the status of the Inventories you want to match
-        # """
-        # return [inventory for inventory in Inventory.data if inventory.status == status]
 
     @staticmethod
     def find_by_quantity(quantity):
         """ Query that finds Inventories by their quantity """
         return Inventory.__find_by('quantity', quantity)
-        # """ Returns all of the Inventories in a status
-        #
-        # Args:
-        #  quantity (int): the quantity of the Inventories you want to match
-        # """
-        # return [inventory for inventory in Inventory.data if inventory.quantity == quantity]
 
     @staticmethod
     def find_by_name(name):
         """ Query that finds Inventories by their name """
         return Inventory.__find_by('name', name)
-        # """ Returns all Inventories with the given name
-        #
-        # Args:
-        #     name (string): the name of the Inventories you want to match
-        # """
-        # return [inventory for inventory in Inventory.data if inventory.name == name]
 
     ######################################################################
     #  R E D I S   D A T A B A S E   C O N N E C T I O N   M E T H O D S
     ######################################################################
 
     @staticmethod
-    def connect_to_redis(hostname, port, password):
-        """ Connects to Redis and tests the connection """
+    def listen_for_invalidations():
+        """ Subscribes a background thread to cache invalidations from other workers """
+        Inventory.storage.listen(Inventory.cache)
+
+    @staticmethod
+    def redis_settings(creds=None):
+        """ Returns the connection settings for Redis from creds and the environment """
+        creds = creds or {}
+        settings = {}
+        for name, (variable, kind, default) in Inventory.redis_options.items():
+            value = os.getenv(variable, creds.get(name, default))
+            if kind is bool:
+                value = str(value).lower() in ('1', 'true', 'yes')
+            settings[name] = kind(value)
+        return settings
+
+    @staticmethod
+    def connect_to_redis(hostname, port, password, settings=None):
+        """ Connects to Redis and tests the connection, backing off between attempts """
         Inventory.logger.info("Testing Connection to: %s:%s", hostname, port)
-        Inventory.redis = Redis(host=hostname, port=port, password=password)
-        try:
-            Inventory.redis.ping()
-            Inventory.logger.info("Connection established")
-        except ConnectionError:
-            Inventory.logger.info("Connection Error from: %s:%s", hostname, port)
-            Inventory.redis = None
+        settings = dict(settings or Inventory.redis_settings())
+        retries = max(settings.pop('connect_retries'), 1)
+        backoff = settings.pop('retry_backoff')
+        pool = BlockingConnectionPool(host=hostname, port=int(port), password=password, **settings)
+        client = metrics.InstrumentedRedis if metrics.enabled or metrics.trace else Redis
+        Inventory.redis = client(connection_pool=pool)
+        for attempt in range(retries):
+            try:
+                Inventory.redis.ping()
+                Inventory.logger.info("Connection established")
+                return Inventory.redis
+            except (ConnectionError, TimeoutError):
+                Inventory.logger.info("Connection Error from: %s:%s (attempt %d of %d)",
+                                      hostname, port, attempt + 1, retries)
+                if attempt + 1 < retries:
+                    time.sleep(backoff * 2 ** attempt)
+        pool.disconnect()
+        Inventory.redis = None
         return Inventory.redis
 
+    @staticmethod
+    def pool_stats():
+        """ Returns how many Redis connections are open, in use and idle """
+        return Inventory.storage.pool_stats()
+
+    @staticmethod
+    def disconnect():
+        """
+        Drops the Redis connection, the invalidation listener and the cache
+
+        Call this in a freshly forked worker so that it does not share the
+        sockets of its parent; the next init_db() connects again. Memory
+        storage is kept, since it has no connection to drop
+        """
+        if isinstance(Inventory.storage, RedisStorage):
+            Inventory.storage.close()
+            Inventory.storage = None
+        Inventory.redis = None
+        Inventory.cache.clear()
+
     @staticmethod
     def init_db(redis=None):
         """
@@ -291,10 +797,18 @@ class Inventory(object):
           2) With Redis running on the local server as with Travis CI
           3) With Redis --link in a Docker container called 'redis'
           4) Passing in your own Redis connection object
+        With INVENTORY_STORAGE=memory no connection is made and records
+        are kept in this process instead; they survive later calls to
+        init_db() but are not shared with any other process
         Exception:
         ----------
           redis.ConnectionError - if ping() test fails
         """
+        if redis is None and os.getenv('INVENTORY_STORAGE', 'redis') == 'memory':
+            if not isinstance(Inventory.storage, MemoryStorage):
+                Inventory.logger.info("Using in-process memory storage")
+                Inventory.use_storage(MemoryStorage())
+            return
         if redis:
             Inventory.logger.info("Using client connection...")
             Inventory.redis = redis
@@ -305,6 +819,7 @@ class Inventory(object):
                 Inventory.logger.error("Client Connection Error!")
                 Inventory.redis = None
                 raise ConnectionError('Could not connect to the Redis Service')
+            Inventory.__use_redis()
             return
         # Get the credentials from the Bluemix environment
         if 'VCAP_SERVICES' in os.environ:
@@ -314,7 +829,8 @@ class Inventory(object):
             creds = services['rediscloud'][0]['credentials']
             Inventory.logger.info("Conecting to Redis on host %s port %s",
                                   creds['hostname'], creds['port'])
-            Inventory.connect_to_redis(creds['hostname'], creds['port'], creds['password'])
+            Inventory.connect_to_redis(creds['hostname'], creds['port'], creds['password'],
+                                       Inventory.redis_settings(creds))
         else:
             Inventory.logger.info("VCAP_SERVICES not found, checking localhost for Redis")
             Inventory.connect_to_redis('127.0.0.1', 6379, None)
@@ -325,3 +841,22 @@ class Inventory(object):
             # if you end up here, redis instance is down.
             Inventory.logger.fatal('*** FATAL ERROR: Could not connect to the Redis Service')
             raise ConnectionError('Could not connect to the Redis Service')
+        Inventory.__use_redis()
+
+    @staticmethod
+    def __use_redis():
+        """ Stores Inventories through the connected Redis client """
+        Inventory.use_storage(RedisStorage(Inventory.redis, Inventory.layout,
+                                           Inventory.codec, Inventory.bucket_size))
+        Inventory.__start_migrations()
+
+    @staticmethod
+    def __start_migrations():
+        """ Starts the data migrations requested through the environment """
+        if os.getenv('INVENTORY_MIGRATE_CODEC', 'false').lower() == 'true':
+            Inventory.start_codec_migration()
+        source = os.getenv('INVENTORY_MIGRATE_LAYOUT')
+        if os.getenv('INVENTORY_REINDEX', 'false').lower() == 'true':
+            Inventory.start_reindex(source=source)
+        elif source:
+            Inventory.start_layout_migration(source)
@@ -18,23 +18,35 @@ Inventory Store Service
 Paths:
 ------
 GET / - Displays a UI for Selenium testing
-GET /inventories - returns a list all of the Inventories
+GET /inventories - returns a list all of the Inventories (one page of them with limit/cursor,
+                   or those whose name starts with name_prefix, in the order of sort)
 GET /inventories/{id} - returns the Inventory with a given id number
 POST /inventories - creates a new Inventory record in the database
+POST /inventories/batch - applies many creates, updates and deletes in one transaction
 PUT /inventories/{id} - updates a Inventory record in the database
 DELETE /inventories/{id} - deletes a Inventory record in the database
+PATCH /inventories/{id}/adjust - atomically adds a delta to the quantity of an Inventory
 GET /inventories/count - returns total amount of product with given name/id/status(whatever status)
 GET /inventories/query - returns the inventory record based on the query string (name and status)
+GET /inventories/low-stock - returns the Inventories with a quantity below a threshold
+GET /healthcheck - reports that the service is up with cache and connection pool stats
+GET /metrics - request, Redis and result size metrics in the Prometheus text format
 """
 
 import os
 import sys
+import hashlib
 import logging
-from flask import Flask, jsonify, request, json, url_for, make_response, abort
+from flask import Flask, Response, jsonify, request, json, url_for, make_response, abort, g
 from flask_api import status  # HTTP Status Codes
-from flask_restplus import Api as BaseApi, Resource, fields
+from flask_restplus import Api as BaseApi, Resource, fields, marshal
+from redis.exceptions import ConnectionError, TimeoutError
 from werkzeug.exceptions import NotFound
-from app.models import Inventory, DataValidationError, DatabaseConnectionError
+from werkzeug.http import quote_etag
+from werkzeug.urls import url_encode
+from app.models import Inventory, DataValidationError, DatabaseConnectionError, \
+    InsufficientQuantityError, VersionConflictError
+from app import metrics
 from . import app
 
 # https://github.com/noirbizarre/flask-restplus/issues/247
@@ -77,6 +89,34 @@ inventory_model = api.model('Inventory', {
 
 })
 
+# lists skip marshalling while serialize() gives exactly the fields of the model
+MARSHAL_LISTS = set(inventory_model) != set(Inventory().serialize())
+
+adjust_model = api.model('Adjustment', {
+    'delta': fields.Integer(required=True,
+                            description='The amount to add to the quantity (negative to remove)'),
+    'floor': fields.Integer(required=False,
+                            description='Reject the adjustment if it would leave less than this')
+})
+
+adjustment_result_model = api.model('AdjustmentResult', {
+    'id': fields.Integer(description='The unique id of the adjusted Inventory'),
+    'quantity': fields.Integer(description='The quantity after the adjustment')
+})
+batch_operation_model = api.model('BatchOperation', {
+    'op': fields.String(required=True, enum=['create', 'update', 'delete'],
+                        description='The operation to apply'),
+    'id': fields.Integer(description='The Inventory to update or delete'),
+    'data': fields.Nested(inventory_model,
+                          description='The Inventory to create or its new values for an update')
+})
+
+class NotModified(Exception):
+    """ Used to end a conditional GET whose representation has not changed """
+    def __init__(self, etag, vary=None):
+        super(NotModified, self).__init__(etag)
+        self.etag = etag
+        self.vary = vary
 
 # Error handlers reuire app to be initialized so we must import
 # then only after we have initialized the Flask app instance
@@ -84,7 +124,7 @@ inventory_model = api.model('Inventory', {
 ######################################################################
 # Error Handlers
 ######################################################################
-@app.errorhandler(DataValidationError)
+@api.errorhandler(DataValidationError)
 def request_validation_error(error):
     """ Handles Value Errors from bad data """
     message = error.message or str(error)
@@ -98,6 +138,37 @@ def database_connection_error(error):
     app.logger.critical(message)
     return {'status':500, 'error': 'Server Error', 'message': message}, 500
 
+@api.errorhandler(ConnectionError)
+@api.errorhandler(TimeoutError)
+def database_unavailable_error(error):
+    """ Handles Redis calls that failed or timed out with 503_SERVICE_UNAVAILABLE """
+    message = str(error) or 'The Redis Service is not available'
+    app.logger.error(message)
+    return {'status':503, 'error': 'Service Unavailable', 'message': message}, 503
+
+@api.errorhandler(NotModified)
+def not_modified(error):
+    """ Answers a conditional GET that still matches with 304_NOT_MODIFIED """
+    # werkzeug drops the body and entity headers of a 304
+    headers = {'ETag': quote_etag(error.etag)}
+    if error.vary:
+        headers['Vary'] = error.vary
+    return {}, status.HTTP_304_NOT_MODIFIED, headers
+
+@api.errorhandler(VersionConflictError)
+def version_conflict_error(error):
+    """ Handles conditional writes whose If-Match no longer holds with 412_PRECONDITION_FAILED """
+    message = error.message or str(error)
+    app.logger.info(message)
+    return {'status':412, 'error': 'Precondition Failed', 'message': message}, 412
+
+@api.errorhandler(InsufficientQuantityError)
+def insufficient_quantity_error(error):
+    """ Handles adjustments that would break a quantity floor """
+    message = error.message or str(error)
+    app.logger.info(message)
+    return {'status':409, 'error': 'Conflict', 'message': message}, 409
+
 @app.errorhandler(400)
 def bad_request(error):
     """ Handles bad requests with 400_BAD_REQUEST """
@@ -143,7 +214,42 @@ def internal_server_error(error):
 @app.route('/healthcheck')
 def healthcheck():
     """ Let them know our heart is still beating """
-    return make_response(jsonify(status=200, message='Healthy'), status.HTTP_200_OK)
+    return make_response(jsonify(status=200, message='Healthy', cache=Inventory.cache.stats(),
+                                 pool=Inventory.pool_stats()),
+                         status.HTTP_200_OK)
+
+######################################################################
+# GET METRICS
+######################################################################
+@app.route('/metrics')
+def metrics_report():
+    """ Exposes the metrics of this worker in the Prometheus text format """
+    for stat, value in Inventory.cache.stats().items():
+        metrics.CACHE.set(value, stat=stat)
+    if Inventory.redis:
+        for state, value in Inventory.pool_stats().items():
+            metrics.POOL.set(value, state=state)
+    return make_response(metrics.registry.render(), status.HTTP_200_OK,
+                         {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+
+@app.before_request
+def start_request_metrics():
+    """ Starts timing the request and counting its Redis round trips """
+    if metrics.enabled or metrics.trace:
+        metrics.start_request()
+
+
+@app.after_request
+def finish_request_metrics(response):
+    """ Records the timing, status and Redis usage of the request """
+    # a streamed list finishes its metrics once the body has been written
+    if (metrics.enabled or metrics.trace) and not g.get('streaming'):
+        round_trips = metrics.finish_request(request.method, request_route(),
+                                             response.status_code)
+        if metrics.trace and round_trips is not None:
+            response.headers['X-Redis-Round-Trips'] = str(round_trips)
+    return response
 
 ######################################################################
 # GET INDEX
@@ -177,6 +283,7 @@ class InventoryResource(Resource):
     # RETRIEVE AN INVENTORY
     #------------------------------------------------------------------
     @ns.doc('get_inventories')
+    @ns.response(304, 'The Inventory still matches the ETag sent in If-None-Match')
     @ns.response(404, 'Inventory not found')
     @ns.marshal_with(inventory_model)
     def get(self, inventory_id):
@@ -188,7 +295,9 @@ class InventoryResource(Resource):
         inventory = Inventory.find(inventory_id)
         if not inventory:
             raise NotFound("Inventory with id '{}' was not found.".format(inventory_id))
-        return inventory.serialize(), status.HTTP_200_OK
+        headers = check_not_modified(representation_etag(record_etag(inventory)),
+                                     app.config['RESTPLUS_MASK_HEADER'])
+        return inventory.serialize(), status.HTTP_200_OK, headers
 
     #------------------------------------------------------------------
     # UPDATE AN EXISTING INVENTORY
@@ -196,6 +305,7 @@ class InventoryResource(Resource):
     @ns.doc('update_inventories')
     @ns.response(404, 'Inventory not found')
     @ns.response(400, 'The posted Inventory data was not valid')
+    @ns.response(412, 'The Inventory no longer matches the ETag sent in If-Match')
     @ns.expect(inventory_model)
     @ns.marshal_with(inventory_model)
     def put(self, inventory_id):
@@ -214,8 +324,9 @@ class InventoryResource(Resource):
         app.logger.info(data)
         inventory.deserialize(data)
         inventory.id = inventory_id
-        inventory.save()
-        return inventory.serialize(), status.HTTP_200_OK
+        inventory.save(expected_versions(inventory_id))
+        return inventory.serialize(), status.HTTP_200_OK, \
+            {'ETag': quote_etag(record_etag(inventory))}
 
     #------------------------------------------------------------------
     # DELETE AN INVENTORY
@@ -234,6 +345,39 @@ class InventoryResource(Resource):
         return '', status.HTTP_204_NO_CONTENT
 
 
+######################################################################
+#  PATH: /inventories/{id}/adjust
+######################################################################
+@ns.route('/<int:inventory_id>/adjust')
+@ns.param('inventory_id', 'The Inventory identifier')
+class AdjustmentResource(Resource):
+    """ Atomic stock adjustments on an Inventory """
+    @ns.doc('adjust_inventories')
+    @ns.expect(adjust_model)
+    @ns.response(400, 'The posted adjustment was not valid')
+    @ns.response(404, 'Inventory not found')
+    @ns.response(409, 'The adjustment would take the quantity below its floor')
+    @ns.marshal_with(adjustment_result_model)
+    def patch(self, inventory_id):
+        """
+        Adjust the quantity of an Inventory
+        This endpoint will add delta to the quantity without a read-modify-write by the client
+        """
+        app.logger.info('Request to Adjust a inventory with id [%s]', inventory_id)
+        check_content_type('application/json')
+        data = api.payload
+        if not isinstance(data, dict):
+            abort(status.HTTP_400_BAD_REQUEST, 'Adjustment must be a JSON object')
+        delta = data.get('delta')
+        floor = data.get('floor')
+        if not is_integer(delta) or (floor is not None and not is_integer(floor)):
+            abort(status.HTTP_400_BAD_REQUEST, 'delta and floor must be integers')
+        quantity = Inventory.adjust_quantity(inventory_id, delta, floor)
+        if quantity is None:
+            raise NotFound('Inventory with id [{}] was not found.'.format(inventory_id))
+        app.logger.info('Inventory [%s] adjusted by %s to %s', inventory_id, delta, quantity)
+        return {'id': inventory_id, 'quantity': quantity}, status.HTTP_200_OK
+
 
 ######################################################################
 #  PATH: /inventories
@@ -246,33 +390,59 @@ class InventoryCollection(Resource):
     #------------------------------------------------------------------
     @ns.doc('list_inventories')
     @ns.param('quantity', 'List Inventories by quantity')
+    @ns.param('quantity_min', 'List Inventories with at least this quantity')
+    @ns.param('quantity_max', 'List Inventories with at most this quantity')
     @ns.param('status', 'List Inventories by status')
     @ns.param('name', 'List Inventories by name')
-    @ns.marshal_list_with(inventory_model)
+    @ns.param('name_prefix', 'List Inventories whose name starts with this, ordered by name')
+    @ns.param('sort', 'Order Inventories by id (the default), name, quantity or -quantity. '
+                      'Equal names come in id order, equal quantities in the order of the '
+                      'digits of their ids (10 before 2), reversed for -quantity')
+    @ns.param('limit', 'Return at most this many Inventories and a Link to the next page')
+    @ns.param('cursor', 'Resume after the page that ended with this cursor (alias: after_id)')
+    @ns.param('Accept', 'application/x-ndjson streams one Inventory per line', _in='header')
+    @ns.response(304, 'Nothing was written since the ETag sent in If-None-Match')
+    @ns.response(400, 'The paging, sort or filter parameters were not valid')
+    @ns.doc(responses={200: (None, [inventory_model])}, __mask__=True)
     def get(self):
         """
         Returns all of the Inventories
-        This endpoint will return all inventories by given name, status and quantity
+        This endpoint will return all inventories by given name, status and quantity,
+        streamed as they are read
         """
         app.logger.info('Request to list Inventories...')
         inventories = []
-        quantity = request.args.get('quantity')
-        status = request.args.get('status')
-        name = request.args.get('name')
-        if quantity:
-            q = int(quantity)
-            inventories = Inventory.find_by_quantity(q)
-        elif status:
-            inventories = Inventory.find_by_status(status)
-        elif name:
-            inventories = Inventory.find_by_name(name)
+        filters = get_filters()
+        name_prefix = request.args.get('name_prefix')
+        sort = request.args.get('sort')
+        limit = get_int_arg('limit', minimum=1)
+        cursor = get_int_arg('cursor')
+        if cursor is None:
+            cursor = get_int_arg('after_id')
+        if sort is not None and sort not in Inventory.sorts:
+            abort(status.HTTP_400_BAD_REQUEST,
+                  'sort must be one of {}'.format(', '.join(Inventory.sorts)))
+        ordered = name_prefix or sort not in (None, 'id')
+        if ordered and cursor is not None:
+            abort(status.HTTP_400_BAD_REQUEST,
+                  'cursor pages in id order and cannot be combined with name_prefix or sort')
+        # read before the records, so a write in between only makes the tag older
+        etag = representation_etag(collection_etag(Inventory.generation()), wants_ndjson())
+        headers = check_not_modified(etag, 'Accept, ' + app.config['RESTPLUS_MASK_HEADER'])
+        if ordered:
+            # a name_prefix alone lists in name order
+            inventories = Inventory.find_sorted(sort or 'name', limit, name_prefix, **filters)
+        elif limit is not None or cursor is not None:
+            limit = limit or app.config['DEFAULT_PAGE_LIMIT']
+            inventories, next_id = Inventory.find_page(limit, cursor or 0, **filters)
+            if next_id is not None:
+                headers['Link'] = next_page_link(next_id)
+        elif filters or sort:
+            # filtered lists are read from the index sets
+            inventories = Inventory.iter_query(**filters)
         else:
-            inventories = Inventory.all()
-        
-
-        app.logger.info('[%s] Inventories returned', len(inventories))
-        results = [inventory.serialize() for inventory in inventories]
-        return results
+            inventories = Inventory.iter_all()
+        return stream_inventories(inventories, headers)
 
     #------------------------------------------------------------------
     # ADD A NEW INVENTORY
@@ -295,7 +465,37 @@ class InventoryCollection(Resource):
         inventory.save()
         app.logger.info('Inventory with new id [%s] saved!', inventory.id)
         location_url = api.url_for(InventoryResource, inventory_id=inventory.id, _external=True)
-        return inventory.serialize(), status.HTTP_201_CREATED, {'Location': location_url}
+        return inventory.serialize(), status.HTTP_201_CREATED, \
+            {'Location': location_url, 'ETag': quote_etag(record_etag(inventory))}
+
+######################################################################
+#  PATH: /inventories/batch
+######################################################################
+@ns.route('/batch')
+class BatchResource(Resource):
+    """ Bulk changes to many Inventories at once """
+    @ns.doc('batch_inventories')
+    @ns.expect([batch_operation_model])
+    @ns.response(200, 'The operations were applied; each result carries its own status')
+    @ns.response(400, 'One or more operations were not valid and nothing was written')
+    def post(self):
+        """
+        Apply a batch of Inventory operations
+        This endpoint will validate every operation and then write them all in one transaction
+        """
+        app.logger.info('Request to apply a batch of Inventory operations')
+        check_content_type('application/json')
+        operations, errors = parse_batch(api.payload)
+        if errors:
+            app.logger.info('Rejected batch with %s invalid operations', len(errors))
+            return {'status': 400, 'error': 'Bad Request',
+                    'message': 'Invalid operations in batch, nothing was written',
+                    'errors': errors}, status.HTTP_400_BAD_REQUEST
+        written = Inventory.batch(operations)
+        results = [batch_result(op, inventory, saved)
+                   for (op, inventory), saved in zip(operations, written)]
+        app.logger.info('[%s] batch operations applied', len(results))
+        return results, status.HTTP_200_OK
 
 
 ######################################################################
@@ -303,9 +503,12 @@ class InventoryCollection(Resource):
 ######################################################################
 @ns.route('/count')
 @ns.param('name', 'Count inventories by name')
+@ns.param('status', 'Only count inventories in this status')
+@ns.param('records', 'Also return the counted records when true')
 class PurchaseResource(Resource):
     """ Count actions on an Inventory """
     @ns.doc('count_inventories')
+    @ns.response(400, 'The name to count was not given')
     @ns.response(404, 'Inventory not found')
     @ns.response(409, 'The Inventory is not available for count')
     def get(self):
@@ -315,15 +518,21 @@ class PurchaseResource(Resource):
         """
         app.logger.info('Request to Count an Inventory')
         name = request.args.get('name')
-        if name:
-            results = Inventory.find_by_name(name)
-            quantities = [record.quantity for record in results]
-            quantity_sum = sum(quantities)
-            inventories_by_name = Inventory.find_by_name(name)
-            results1 = [inventory.serialize() for inventory in inventories_by_name]
-        
-        resp = {'records': results1, 'name':name, 'count': quantity_sum}    
-        app.logger.info('Inventory with name [%s] has been counted!', inventory.name)
+        inventory_status = request.args.get('status')
+        if not name:
+            abort(status.HTTP_400_BAD_REQUEST, 'name is required to count inventories')
+        quantity_sum = Inventory.total_quantity(name, inventory_status)
+        resp = {'name': name, 'count': quantity_sum}
+        if inventory_status:
+            resp['status'] = inventory_status
+        if request.args.get('records', '').lower() == 'true':
+            filters = {'name': name}
+            if inventory_status:
+                filters['status'] = inventory_status
+            records = Inventory.query(**filters)
+            resp['records'] = [record.serialize() for record in records]
+            record_result_size(len(resp['records']))
+        app.logger.info('Inventory with name [%s] has been counted!', name)
         return resp, status.HTTP_200_OK
 
 
@@ -333,6 +542,9 @@ class PurchaseResource(Resource):
 @ns.route('/query')
 @ns.param('name', 'Query inventories by name')
 @ns.param('status', 'Query inventories by status')
+@ns.param('quantity', 'Query inventories by quantity')
+@ns.param('quantity_min', 'Query inventories with at least this quantity')
+@ns.param('quantity_max', 'Query inventories with at most this quantity')
 class QueryResource(Resource):
     """ Query actions on an Inventory """
     @ns.doc('query_inventories')
@@ -341,23 +553,50 @@ class QueryResource(Resource):
     def get(self):
         """
         Query an Inventory
-        This endpoint will query inventory with given name and status
+        This endpoint will query inventory matching every given name, status and quantity
         """
         app.logger.info('Request to Query an Inventory')
-        name = request.args.get('name')
-        status = request.args.get('status')
-        inventories_by_name = Inventory.find_by_name(name)
-        inventories_by_status = Inventory.find_by_status(status)
-        if not inventories_by_status or not inventories_by_name:
-            raise NotFound("Query Inventory with name '{}' and status '{}'  was not found.".format(name, status))
-        results1 = [inventory.serialize() for inventory in inventories_by_name]
-        results2 = [inventory.serialize() for inventory in inventories_by_status]
-        results = [r for r in results1 if r in results2]
-            
+        filters = get_filters()
+        inventories = Inventory.query(**filters) if filters else []
+        if not inventories:
+            raise NotFound("Query Inventory with {} was not found.".format(
+                ' and '.join("{} '{}'".format(key, value)
+                             for key, value in sorted(filters.items())) or 'no filters'))
+        results = [inventory.serialize() for inventory in inventories]
         app.logger.info('[%s] Inventories returned', len(results))
+        record_result_size(len(results))
         return results
 
 
+######################################################################
+#  PATH: /inventories/low-stock
+######################################################################
+@ns.route('/low-stock')
+@ns.param('threshold', 'List Inventories with a quantity below this')
+@ns.param('status', 'Only list Inventories in this status')
+@ns.param('limit', 'Return at most this many Inventories')
+class LowStockResource(Resource):
+    """ Replenishment queries on the quantity of Inventories """
+    @ns.doc('list_low_stock_inventories')
+    @ns.response(400, 'The threshold or limit was not valid')
+    @ns.marshal_list_with(inventory_model)
+    def get(self):
+        """
+        Returns the Inventories running low
+        This endpoint will return the inventories with less than threshold, lowest quantity first
+        """
+        app.logger.info('Request to list low stock Inventories')
+        threshold = get_int_arg('threshold', minimum=None)
+        if threshold is None:
+            abort(status.HTTP_400_BAD_REQUEST, 'threshold is required to list low stock')
+        limit = get_int_arg('limit', minimum=1)
+        inventories = Inventory.find_low_stock(threshold, limit, **get_filters())
+        results = [inventory.serialize() for inventory in inventories]
+        app.logger.info('[%s] Inventories below %s returned', len(results), threshold)
+        record_result_size(len(results))
+        return results, status.HTTP_200_OK
+
+
 ######################################################################
 # DELETE ALL INVENTORY DATA (for testing only)
 ######################################################################
@@ -378,9 +617,10 @@ def init_db(redis=None):
 
 # load sample data
 def data_load(payload):
-    """ Loads an Inventory into the database """
-    inventory = Inventory(0, payload['name'], payload['quantity'], payload['status'])
-    inventory.save()
+    """ Loads an Inventory, or a list of them, into the database in one transaction """
+    payloads = payload if isinstance(payload, list) else [payload]
+    Inventory.batch([('create', Inventory(0, item['name'], item['quantity'], item['status']))
+                     for item in payloads])
 
 
 def data_reset():
@@ -396,6 +636,221 @@ def check_content_type(content_type):
     abort(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, 'Content-Type must be {}'.format(content_type))
 
 
+def get_int_arg(name, minimum=0):
+    """ Returns an integer query parameter or None if it was not sent """
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        number = int(value)
+    except ValueError:
+        number = None
+    if number is None:
+        abort(status.HTTP_400_BAD_REQUEST, '{} must be an integer'.format(name))
+    if minimum is not None and number < minimum:
+        abort(status.HTTP_400_BAD_REQUEST,
+              '{} must be an integer of at least {}'.format(name, minimum))
+    return number
+
+
+def get_filters():
+    """ Collects the name, status, quantity and quantity range query parameters sent """
+    filters = {}
+    for attribute in ('name', 'status'):
+        if request.args.get(attribute):
+            filters[attribute] = request.args[attribute]
+    for attribute in ('quantity', 'quantity_min', 'quantity_max'):
+        if request.args.get(attribute):
+            filters[attribute] = get_int_arg(attribute, minimum=None)
+    return filters
+
+
+def is_integer(value):
+    """ Checks that a JSON value is an integer and not a boolean """
+    return isinstance(value, (int, long)) and not isinstance(value, bool)
+
+
+def parse_batch(payload):
+    """ Validates batch operations, returning (op, Inventory) pairs and per-item errors """
+    if not isinstance(payload, list):
+        abort(status.HTTP_400_BAD_REQUEST, 'Batch must be a JSON array of operations')
+    if len(payload) > app.config['MAX_BATCH_SIZE']:
+        abort(status.HTTP_400_BAD_REQUEST,
+              'Batch may hold at most {} operations'.format(app.config['MAX_BATCH_SIZE']))
+    operations = []
+    errors = []
+    for position, item in enumerate(payload):
+        try:
+            operations.append(parse_batch_operation(item))
+        except DataValidationError as error:
+            errors.append({'index': position, 'message': error.message or str(error)})
+    return operations, errors
+
+
+def parse_batch_operation(item):
+    """ Turns one batch item into an (op, Inventory) pair """
+    if not isinstance(item, dict) or item.get('op') not in ('create', 'update', 'delete'):
+        raise DataValidationError('op must be one of create, update or delete')
+    op = item['op']
+    if op == 'create':
+        inventory = Inventory()
+    elif is_integer(item.get('id')):
+        inventory = Inventory(item['id'])
+    else:
+        raise DataValidationError('{} needs the integer id of an Inventory'.format(op))
+    if op != 'delete':
+        inventory.deserialize(item.get('data'))
+    return op, inventory
+
+
+def batch_result(op, inventory, saved):
+    """ Describes the outcome of one batch operation """
+    result = {'op': op, 'id': inventory.id}
+    if op == 'delete':
+        result['status'] = status.HTTP_204_NO_CONTENT
+    elif saved is None:
+        result['status'] = status.HTTP_404_NOT_FOUND
+        result['message'] = 'Inventory with id [{}] was not found.'.format(inventory.id)
+    else:
+        result['status'] = status.HTTP_201_CREATED if op == 'create' else status.HTTP_200_OK
+        result['data'] = saved.serialize()
+    return result
+
+
+def request_route():
+    """ Returns the URL rule that matched the request, to label its metrics """
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+
+def record_result_size(count):
+    """ Records how many Inventories a list response returned """
+    if metrics.enabled:
+        metrics.RESULT_SIZE.observe(count, method=request.method, route=request_route())
+
+
+def stream_inventories(inventories, headers):
+    """
+    Streams Inventories as a JSON array, or one per line for application/x-ndjson
+
+    Records are encoded as they come off storage and sent in chunks of
+    STREAM_CHUNK_SIZE, so neither the records nor the body are ever held
+    whole. They are only marshalled when a field mask is sent, or if
+    serialize() no longer matches inventory_model
+    """
+    mask = request.headers.get(app.config['RESTPLUS_MASK_HEADER'])
+    if mask or MARSHAL_LISTS:
+        encode = lambda inventory: marshal(inventory.serialize(), inventory_model, mask=mask)
+    else:
+        encode = lambda inventory: inventory.serialize()
+    ndjson = wants_ndjson()
+    if metrics.trace:
+        # read everything up front so the round trip header covers it
+        inventories = list(inventories)
+    g.streaming = metrics.enabled and not metrics.trace
+    chunk_size = app.config['STREAM_CHUNK_SIZE']
+    # the body is written after the request context is gone
+    method, route = request.method, request_route()
+
+    def generate():
+        """ Yields the body a chunk of records at a time """
+        count = 0
+        try:
+            chunk = [] if ndjson else ['[']
+            for inventory in inventories:
+                data = json.dumps(encode(inventory))
+                if ndjson:
+                    chunk.append(data + '\n')
+                else:
+                    chunk.append(',' + data if count else data)
+                count += 1
+                if len(chunk) >= chunk_size:
+                    yield ''.join(chunk)
+                    chunk = []
+            if not ndjson:
+                chunk.append(']')
+            if chunk:
+                yield ''.join(chunk)
+            app.logger.info('[%s] Inventories returned', count)
+        finally:
+            if metrics.enabled:
+                metrics.RESULT_SIZE.observe(count, method=method, route=route)
+                if not metrics.trace:
+                    metrics.finish_request(method, route, status.HTTP_200_OK)
+
+    mimetype = 'application/x-ndjson' if ndjson else 'application/json'
+    return Response(generate(), status.HTTP_200_OK, headers, mimetype=mimetype)
+
+
+def record_etag(inventory):
+    """
+    Returns the entity tag of an Inventory, which changes with every write
+    to it, and with the storage epoch since ids and versions start over
+    """
+    return '{}-{}-{}'.format(Inventory.epoch(), inventory.id, inventory.version)
+
+
+def collection_etag(generation):
+    """ Returns the entity tag of a list, which changes with every write to any Inventory """
+    return '{}-g{}'.format(Inventory.epoch(), generation)
+
+
+def wants_ndjson():
+    """ Checks whether the client prefers NDJSON to a JSON array """
+    return request.accept_mimetypes['application/x-ndjson'] > \
+        request.accept_mimetypes['application/json']
+
+
+def representation_etag(etag, ndjson=False):
+    """
+    Returns etag told apart by the representation sent: NDJSON, and the
+    X-Fields mask as a short hash, so one body never answers for another
+    """
+    mask = request.headers.get(app.config['RESTPLUS_MASK_HEADER'])
+    if ndjson:
+        etag += '-ndjson'
+    if mask:
+        etag += '-' + hashlib.sha1(mask.encode('utf-8')).hexdigest()[:12]
+    return etag
+
+
+def expected_versions(inventory_id):
+    """
+    Returns the versions an If-Match header allows a write over, or None
+    when any version will do. Only strong tags of this Inventory count,
+    including those of a masked representation
+    """
+    if not request.if_match or request.if_match.star_tag:
+        return None
+    versions = set()
+    prefix = '{}-{}-'.format(Inventory.epoch(), inventory_id)
+    for etag in request.if_match.as_set():
+        version = etag[len(prefix):].split('-')[0]
+        if etag.startswith(prefix) and version.isdigit():
+            versions.add(int(version))
+    return versions
+
+
+def check_not_modified(etag, vary=None):
+    """
+    Raises NotModified if If-None-Match names etag, else returns the ETag
+    header, and the Vary header naming the request headers etag depends on
+    """
+    if request.if_none_match.contains_weak(etag):
+        raise NotModified(etag, vary)
+    headers = {'ETag': quote_etag(etag)}
+    if vary:
+        headers['Vary'] = vary
+    return headers
+
+
+def next_page_link(cursor):
+    """ Builds a Link header pointing at the page after cursor """
+    args = request.args.to_dict()
+    args.pop('after_id', None)
+    args['cursor'] = cursor
+    return '<{}?{}>; rel="next"'.format(request.base_url, url_encode(args))
+
+
 def initialize_logging(log_level=logging.INFO):
     """ Initialized the default logging to STDOUT """
     if not app.debug:
@@ -330,7 +330,8 @@ $(function () {
 
         var ajax = $.ajax({
             type: "GET",
-            url: "/inventories/count?" + queryString,
+            // the table below lists the counted records, which are only sent on request
+            url: "/inventories/count?" + queryString + (queryString ? '&' : '') + 'records=true',
             contentType:"application/json",
             data: ''
         })
@@ -345,7 +346,7 @@ $(function () {
             header += '<th style="width:40%">Quantity</th>'
             header += '<th style="width:10%">status</th></tr>'
             $("#search_results").append(header);
-            records = res.records
+            records = res.records || []
             for(var i = 0; i < records.length; i++) {
                 inventory = records[i];
                 var row = "<tr><td>"+inventory.id+"</td><td>"+inventory.name+"</td><td>"+inventory.quantity+"</td><td>"+inventory.status+"</td></tr>";
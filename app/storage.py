@@ -0,0 +1,1070 @@
+# Copyright 2017 NYU-FOXTROT. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Storage backends for Inventory records
+
+A backend stores records as dictionaries with an id, name, quantity and
+status, keeps an index of ids per name, quantity and status value
+(compared case insensitively), the lower-cased names in order for
+prefix searches, the ids in order of quantity for range queries, and
+the quantity totals per name and per name and status. Writes go through
+transaction(), which hands the current records to a function and applies
+the changes it returns atomically, so the Inventory model states each
+write once for every backend. Every write gives the record the next
+version of its id and bumps the generation of the whole collection, so
+readers can tell whether what they saw before is still current.
+
+Classes
+-------
+Storage - the interface every backend implements
+RedisStorage - records, indexes and totals in Redis, shared by all workers
+MemoryStorage - records, indexes and totals in this process only
+"""
+
+import logging
+import os
+import threading
+import uuid
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict
+
+from redis.exceptions import WatchError
+
+from app.codec import JsonCodec
+from app.layout import get_layout
+
+# attributes with an index of ids
+INDEXED = ('name', 'quantity', 'status')
+
+
+class InsufficientQuantityError(Exception):
+    """ Used when an adjustment would take a quantity below its floor """
+    pass
+
+
+def normalize(value):
+    """ Lower-cases strings so that lookups are case insensitive """
+    if hasattr(value, 'lower'):
+        return value.lower()
+    return value
+
+
+def encode_name(name):
+    """ Returns a name lower-cased and UTF-8 encoded, as the name index orders it """
+    name = normalize(name)
+    if not isinstance(name, bytes):
+        name = name.encode('utf-8')
+    return name
+
+
+def next_version(old):
+    """ Returns the version a record replacing old is written with """
+    return (old.get('version', 0) if old else 0) + 1
+
+
+def floor_error(inventory_id, quantity, delta, floor):
+    """ Builds the error for an adjustment that would break its floor """
+    return InsufficientQuantityError(
+        'Inventory {} has {}, cannot adjust by {} below {}'.format(
+            inventory_id, quantity, delta, floor))
+
+
+class Storage(object):
+    """ The operations the Inventory model needs from a backend """
+    name = None
+
+    def next_ids(self, count=1):
+        """ Reserves count new ids and returns the first of them """
+        raise NotImplementedError
+
+    def read(self, inventory_id):
+        """ Returns a record, or None if there is no such id """
+        raise NotImplementedError
+
+    def read_many(self, ids):
+        """ Returns the records for ids in order, None where missing """
+        raise NotImplementedError
+
+    def read_quantity(self, inventory_id):
+        """ Returns just the quantity of a record, or None """
+        data = self.read(inventory_id)
+        return None if data is None else data['quantity']
+
+    def scan(self, batch_size=500):
+        """ Yields every record, batch_size at a time, in no particular order """
+        raise NotImplementedError
+
+    def select(self, filters, after_id=0, count=None, minimum=None, maximum=None):
+        """
+        Returns the ids greater than after_id of the records that match
+        every filter and have a quantity from minimum to maximum (either
+        may be None for no bound), in id order and at most count of them
+        """
+        raise NotImplementedError
+
+    def select_by_quantity(self, filters, minimum=None, maximum=None, count=None,
+                           reverse=False):
+        """
+        Returns the ids of the records that match every filter and have a
+        quantity from minimum to maximum (either may be None for no
+        bound), ordered by quantity, highest first if reverse, and at
+        most count of them
+        """
+        raise NotImplementedError
+
+    def estimate(self, filters, minimum=None, maximum=None):
+        """
+        Returns an upper bound of the records that match every filter and
+        have a quantity from minimum to maximum, and the number of records
+        """
+        raise NotImplementedError
+
+    def select_names(self, prefix='', after=None, count=None):
+        """
+        Returns (name, id) pairs from the name index in order, with names
+        lower-cased: only names that start with prefix, only the pairs
+        that come after the pair after, and at most count of them
+        """
+        raise NotImplementedError
+
+    def total_quantity(self, name, status=None):
+        """ Returns the quantity total for a name, or a name and status """
+        raise NotImplementedError
+
+    def generation(self):
+        """ Returns a counter of the writes made to the collection """
+        raise NotImplementedError
+
+    def epoch(self):
+        """
+        Returns a value that changes whenever ids, versions and the
+        generation may start over, so that tags built from them before
+        never match again
+        """
+        raise NotImplementedError
+
+    def transaction(self, ids, func):
+        """
+        Applies changes based on the current records, atomically
+
+        func is called with a dictionary of the records for ids (None
+        where missing) and returns a list of (id, old, new) changes, where
+        old is the current record and new the replacement or None to
+        delete, plus a result. func may be called again if the records
+        change underneath it; an exception it raises aborts the transaction.
+        Each new record has its version set, in place, as it is written
+
+        Returns:
+            the result of the last call to func
+        """
+        raise NotImplementedError
+
+    def adjust(self, inventory_id, delta, floor=None):
+        """
+        Adds delta to a quantity, refusing to go below floor
+
+        Returns:
+            the new quantity, or None if there is no such id
+        Raises:
+            InsufficientQuantityError - if the result would be below floor
+        """
+        def adjust(current):
+            """ Replaces the record with one that has the new quantity """
+            old = current[inventory_id]
+            if old is None:
+                return [], None
+            quantity = old['quantity'] + delta
+            if floor is not None and quantity < floor:
+                raise floor_error(inventory_id, old['quantity'], delta, floor)
+            return [(inventory_id, old, dict(old, quantity=quantity))], quantity
+
+        return self.transaction([inventory_id], adjust)
+
+    def clear(self):
+        """ Removes every record """
+        raise NotImplementedError
+
+    def reindex(self, batch_size=500):
+        """ Rebuilds the indexes and totals from the records, returning how many """
+        return 0
+
+    def migrate_codec(self, batch_size=500):
+        """ Rewrites records stored with an older codec, returning how many """
+        return 0
+
+    def migrate_layout(self, source, batch_size=500):
+        """ Moves records stored in the source layout, returning how many """
+        return 0
+
+    def listen(self, cache):
+        """ Keeps cache coherent with writes made by other processes """
+        pass
+
+    def stop_listening(self):
+        """ Stops keeping a cache coherent """
+        pass
+
+    def pool_stats(self):
+        """ Returns the connection pool figures, if the backend has one """
+        return {}
+
+    def close(self):
+        """ Releases connections and background threads """
+        pass
+
+
+class RedisStorage(Storage):
+    """
+    Records, their index sets and totals in Redis
+
+    Every attribute index is a sorted set of ids scored by the id, so
+    pages can be read in id order; the name index is ordered by its
+    members instead, for ZRANGEBYLEX. Writes happen under WATCH in one
+    MULTI that also publishes an invalidation for the caches of the other
+    workers
+    """
+    name = 'redis'
+    logger = logging.getLogger(__name__)
+    # sorted set of every id, used to page through the whole collection
+    ids_key = 'ids'
+    # sorted set of '<lower-cased name>\x00<id>' members, all scored 0 so they
+    # sort by name; the id is zero-padded so that equal names sort by id
+    names_key = 'names'
+    # sorted set of every id scored by its quantity, for range queries
+    quantities_key = 'quantities'
+    # hash of quantity totals per name, and one hash per name with its totals per status
+    totals_key = 'totals'
+    invalidation_channel = 'inventory:invalidate'
+    # counter bumped by every write, the version of the collection as a whole
+    generation_key = 'generation'
+    # random value replaced by every clear(), as ids and versions start over
+    epoch_key = 'epoch'
+
+    def __init__(self, redis, layout, codec, bucket_size=100):
+        self.redis = redis
+        self.layout = layout
+        self.codec = codec
+        self.bucket_size = bucket_size
+        self.__origin = uuid.uuid4().hex
+        self.__listener = None
+        self.__cache = None
+        self.__epoch = None
+
+    def __worker(self):
+        """ Identifies this process on the invalidation channel """
+        return '%s-%d' % (self.__origin, os.getpid())
+
+    def __index_key(self, attribute, value):
+        """ Returns the key of the index set for an attribute value """
+        return '%s:%s' % (attribute, normalize(value))
+
+    @staticmethod
+    def __name_member(name, inventory_id):
+        """ Returns the member of the name index for a record """
+        return b'%s\x00%020d' % (encode_name(name), int(inventory_id))
+
+    @staticmethod
+    def __name_entry(member):
+        """ Returns the (name, id) pair a name index member stands for """
+        name, _, inventory_id = member.rpartition(b'\x00')
+        return name.decode('utf-8'), int(inventory_id)
+
+    def __totals_fields(self, data):
+        """ Returns the (hash, field) pairs of the totals a record counts towards """
+        return [(self.totals_key, normalize(data['name'])),
+                (self.__index_key(self.totals_key, data['name']), normalize(data['status']))]
+
+    def __index_sets(self, pipe, data):
+        """ Adds a record to the index set of each searchable attribute """
+        pipe.zadd(self.ids_key, {data['id']: data['id']})
+        pipe.zadd(self.names_key, {self.__name_member(data['name'], data['id']): 0})
+        pipe.zadd(self.quantities_key, {data['id']: data['quantity']})
+        for attribute in INDEXED:
+            pipe.zadd(self.__index_key(attribute, data[attribute]), {data['id']: data['id']})
+
+    def __index(self, pipe, data):
+        """ Adds a record to the index sets and totals """
+        self.__index_sets(pipe, data)
+        for key, field in self.__totals_fields(data):
+            pipe.hincrby(key, field, data['quantity'])
+
+    def __unindex(self, pipe, data):
+        """ Removes a record from the index set of each searchable attribute """
+        pipe.zrem(self.ids_key, data['id'])
+        pipe.zrem(self.names_key, self.__name_member(data['name'], data['id']))
+        pipe.zrem(self.quantities_key, data['id'])
+        for attribute in INDEXED:
+            pipe.zrem(self.__index_key(attribute, data[attribute]), data['id'])
+        for key, field in self.__totals_fields(data):
+            pipe.hincrby(key, field, -data['quantity'])
+
+    def __write(self, pipe, inventory_id, old, new):
+        """
+        Queues the commands that replace record old with record new
+        Either may be None when creating or deleting; the index sets
+        always follow the stored record
+        """
+        if old:
+            self.__unindex(pipe, old)
+        if new:
+            new['version'] = next_version(old)
+            self.layout.write(pipe, new)
+            self.__index(pipe, new)
+        else:
+            self.layout.delete(pipe, inventory_id)
+        pipe.incr(self.generation_key)
+        # tell the other workers to drop their cached copy once this commits
+        pipe.publish(self.invalidation_channel, '%s %s' % (self.__worker(), inventory_id))
+
+    def next_ids(self, count=1):
+        return self.redis.incrby('index', count) - count + 1
+
+    def read(self, inventory_id):
+        return self.layout.read(self.redis, inventory_id)
+
+    def read_many(self, ids):
+        return self.layout.read_many(self.redis, [int(i) for i in ids])
+
+    def read_quantity(self, inventory_id):
+        return self.layout.read_quantity(self.redis, inventory_id)
+
+    def scan(self, batch_size=500):
+        # SCAN pages keep memory and round trips bounded by batch_size.
+        # A key may come back twice while Redis rehashes; repeats within a
+        # page are dropped here, callers must tolerate ones across pages
+        cursor = 0
+        while True:
+            cursor, ids = self.layout.scan(self.redis, cursor, batch_size)
+            ids = list(OrderedDict.fromkeys(ids))
+            records = [data for data in self.read_many(ids) if data is not None]
+            if records:
+                yield records
+            if not cursor:
+                break
+
+    def select(self, filters, after_id=0, count=None, minimum=None, maximum=None):
+        """
+        Query planner that returns the ids matching every filter, in id order
+
+        Single filters read their index set directly. For several filters
+        the cardinality of each index set is fetched first: an empty set
+        answers the query without touching the others, and otherwise the
+        sets are intersected on the server starting from the smallest one.
+        A quantity range is checked while walking, see __select_range
+        """
+        keys = [self.__index_key(attribute, value)
+                for attribute, value in sorted(filters.items())]
+        if minimum is not None or maximum is not None:
+            return self.__select_range(keys, after_id, count, minimum, maximum)
+        start = '(%d' % after_id
+        page = {'start': 0, 'num': count} if count else {}
+        if len(keys) < 2:
+            key = keys[0] if keys else self.ids_key
+            return [int(i) for i in self.redis.zrangebyscore(key, start, '+inf', **page)]
+        pipe = self.redis.pipeline(transaction=False)
+        for key in keys:
+            pipe.zcard(key)
+        sizes = pipe.execute()
+        if not min(sizes):
+            return []
+        keys = [key for _, key in sorted(zip(sizes, keys))]
+        self.logger.info('Intersecting %s', ', '.join(keys))
+        result_key = 'query:' + uuid.uuid4().hex
+        pipe = self.redis.pipeline()
+        # every index scores an id by itself, so MIN keeps the id as the score
+        pipe.zinterstore(result_key, keys, aggregate='MIN')
+        pipe.zrangebyscore(result_key, start, '+inf', **page)
+        pipe.delete(result_key)
+        return [int(i) for i in pipe.execute()[1]]
+
+    # KEYS[1] is the index set walked in id order, KEYS[2] the quantity range
+    # index and the rest other index sets every id must be in; ARGV holds
+    # the id to start after, how many ids to return ('' for all), the
+    # lowest and highest quantity ('' for no bound) and how many entries
+    # to walk. Returns the last id walked ('' once the set is exhausted)
+    # and the matching ids
+    __select_range_script = """
+local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '(' .. ARGV[1], '+inf', 'LIMIT', 0, ARGV[5])
+local count, low, high = tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+local found = {}
+for _, id in ipairs(ids) do
+    local quantity = tonumber(redis.call('ZSCORE', KEYS[2], id))
+    local match = quantity and (not low or quantity >= low) and (not high or quantity <= high)
+    for i = 3, #KEYS do
+        match = match and redis.call('ZSCORE', KEYS[i], id)
+    end
+    if match then
+        found[#found + 1] = id
+        if #found == count then
+            return {id, found}
+        end
+    end
+end
+if #ids < tonumber(ARGV[5]) then
+    return {'', found}
+end
+return {ids[#ids], found}
+"""
+
+    def __select_range(self, keys, after_id, count, minimum, maximum, batch_size=500):
+        """
+        Walks an index set in id order, batch_size entries per script
+        call, keeping the ids whose quantity score is in range, so a
+        page costs its own ids rather than the whole range
+        """
+        keys = (keys[:1] or [self.ids_key]) + [self.quantities_key] + keys[1:]
+        ids = []
+        while not count or len(ids) < count:
+            cursor, page = self.redis.eval(
+                self.__select_range_script, len(keys), *(keys + [
+                    after_id, count - len(ids) if count else '',
+                    '' if minimum is None else minimum,
+                    '' if maximum is None else maximum, batch_size]))
+            ids.extend(int(i) for i in page)
+            if not cursor:
+                break
+            after_id = int(cursor)
+        return ids
+
+    def select_by_quantity(self, filters, minimum=None, maximum=None, count=None,
+                           reverse=False):
+        """
+        Reads a range of the quantity index with ZRANGEBYSCORE, in
+        O(log n) plus one step per id returned. With filters the index
+        is first intersected with their index sets, weighted 0 so that
+        the quantity stays the score. Equal quantities come in the order
+        of the digits of their ids
+        """
+        low = '-inf' if minimum is None else minimum
+        high = '+inf' if maximum is None else maximum
+        page = {'start': 0, 'num': count} if count else {}
+
+        def read(client, key):
+            """ Reads the range from key, in the requested direction """
+            if reverse:
+                return client.zrevrangebyscore(key, high, low, **page)
+            return client.zrangebyscore(key, low, high, **page)
+
+        if not filters:
+            return [int(i) for i in read(self.redis, self.quantities_key)]
+        weights = dict((self.__index_key(attribute, value), 0)
+                       for attribute, value in filters.items())
+        weights[self.quantities_key] = 1
+        self.logger.info('Intersecting %s', ', '.join(sorted(weights)))
+        result_key = 'query:' + uuid.uuid4().hex
+        pipe = self.redis.pipeline()
+        pipe.zinterstore(result_key, weights)
+        read(pipe, result_key)
+        pipe.delete(result_key)
+        return [int(i) for i in pipe.execute()[1]]
+
+    def estimate(self, filters, minimum=None, maximum=None):
+        """ Reads the size of each index set involved in one round trip """
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.zcard(self.ids_key)
+        for attribute, value in filters.items():
+            pipe.zcard(self.__index_key(attribute, value))
+        if minimum is not None or maximum is not None:
+            pipe.zcount(self.quantities_key, '-inf' if minimum is None else minimum,
+                        '+inf' if maximum is None else maximum)
+        sizes = pipe.execute()
+        return min(sizes), sizes[0]
+
+    def select_names(self, prefix='', after=None, count=None):
+        """
+        Reads a range of the name index with ZRANGEBYLEX, which costs
+        O(log n) to find the start plus one step per pair returned.
+        Members are compared byte by byte and end in the zero-padded id,
+        so equal names come in id order
+        """
+        prefix = encode_name(prefix)
+        # no UTF-8 string holds a 0xff byte, so it sorts after every name with the prefix
+        low, high = (b'[' + prefix, b'[' + prefix + b'\xff') if prefix else (b'-', b'+')
+        if after is not None:
+            low = b'(' + self.__name_member(*after)
+        page = {'start': 0, 'num': count} if count else {}
+        return [self.__name_entry(member)
+                for member in self.redis.zrangebylex(self.names_key, low, high, **page)]
+
+    def total_quantity(self, name, status=None):
+        if status is None:
+            key, field = self.totals_key, normalize(name)
+        else:
+            key, field = self.__index_key(self.totals_key, name), normalize(status)
+        return int(self.redis.hget(key, field) or 0)
+
+    def generation(self):
+        return int(self.redis.get(self.generation_key) or 0)
+
+    def epoch(self):
+        # kept until a clear() by this worker or the '*' of another one
+        if self.__epoch is None:
+            pipe = self.redis.pipeline()
+            pipe.setnx(self.epoch_key, uuid.uuid4().hex[:8])
+            pipe.get(self.epoch_key)
+            self.__epoch = pipe.execute()[1].decode('utf-8')
+        return self.__epoch
+
+    def transaction(self, ids, func):
+        def apply(pipe):
+            """ Reads the watched records and queues the changes """
+            current = dict(zip(ids, self.read_many(ids)))
+            changes, result = func(current)
+            pipe.multi()
+            for inventory_id, old, new in changes:
+                self.__write(pipe, inventory_id, old, new)
+            return result
+
+        return self.redis.transaction(apply, *set(self.layout.key(i) for i in ids),
+                                      value_from_callable=True)
+
+    # Updates the indexes, totals and generation after an adjust script has
+    # moved the quantity of record id from old to new. Keys and arguments
+    # are theirs; quantities are formatted with %d, as Lua would otherwise
+    # write 1e14 and up in exponent notation
+    __adjust_indexes = """
+redis.call('INCR', KEYS[4])
+redis.call('ZREM', ARGV[4] .. ':' .. string.format('%d', old), id)
+redis.call('ZADD', ARGV[4] .. ':' .. string.format('%d', new), id, id)
+redis.call('ZADD', KEYS[2], new, id)
+name, status = string.lower(name), string.lower(status)
+redis.call('HINCRBY', KEYS[3], name, delta)
+redis.call('HINCRBY', KEYS[3] .. ':' .. name, status, delta)
+redis.call('PUBLISH', ARGV[5], ARGV[6])
+return {'ok', new}
+"""
+
+    # KEYS are the record hash, the quantity range index, the totals key and
+    # the generation key. ARGV holds the id, delta, floor ('' for none), the
+    # quantity index prefix and the invalidation channel and message. The
+    # index sets and per name totals are found from the record, so they
+    # cannot be passed in KEYS: like the transactions, the scripts need a
+    # single Redis node. Non-ASCII names or statuses return 'fallback' since
+    # Lua cannot lower-case them the way the index keys were built, and so
+    # do quantities from 2^53 up, which Lua numbers cannot hold exactly
+    __adjust_hash_script = """
+local fields = redis.call('HMGET', KEYS[1], 'name', 'quantity', 'status')
+if not fields[2] then
+    return {'missing'}
+end
+local name, status = fields[1], fields[3]
+if string.find(name .. status, '[\\128-\\255]') then
+    return {'fallback'}
+end
+local id, delta = ARGV[1], tonumber(ARGV[2])
+local old = tonumber(fields[2])
+if math.abs(old) >= 2^53 or math.abs(old + delta) >= 2^53 then
+    return {'fallback'}
+end
+if ARGV[3] ~= '' and old + delta < tonumber(ARGV[3]) then
+    return {'floor', old}
+end
+local new = redis.call('HINCRBY', KEYS[1], 'quantity', delta)
+redis.call('HINCRBY', KEYS[1], 'version', 1)
+""" + __adjust_indexes
+
+    # KEYS[1] is the record string, the rest as for the hash script. Values
+    # the JSON codec did not write (its version byte and then the array of
+    # FIELDS and the version) return 'fallback' as well, and so do
+    # quantities from 1e14 up, which cjson would write with 14 digits
+    __adjust_json_script = """
+local value = redis.call('GET', KEYS[1])
+if not value then
+    return {'missing'}
+end
+if string.sub(value, 1, 1) ~= '\\1' then
+    return {'fallback'}
+end
+local record = cjson.decode(string.sub(value, 2))
+local name, status = record[2], record[4]
+if string.find(name .. status, '[\\128-\\255]') then
+    return {'fallback'}
+end
+local id, delta = ARGV[1], tonumber(ARGV[2])
+local old = record[3]
+if math.abs(old) >= 1e14 or math.abs(old + delta) >= 1e14 then
+    return {'fallback'}
+end
+if ARGV[3] ~= '' and old + delta < tonumber(ARGV[3]) then
+    return {'floor', old}
+end
+local new = old + delta
+record[3], record[5] = new, (record[5] or 0) + 1
+redis.call('SET', KEYS[1], '\\1' .. cjson.encode(record))
+""" + __adjust_indexes
+
+    def adjust(self, inventory_id, delta, floor=None):
+        """
+        Adds delta to a quantity, refusing to go below floor
+
+        With a layout that keeps the quantity in its own field, or with
+        strings written by the JSON codec, a server side script applies the
+        delta and the index updates in a single round trip. Otherwise the
+        record is read and rewritten under WATCH, so concurrent adjustments
+        are retried instead of overwriting each other
+        """
+        script = None
+        if self.layout.field_updates:
+            script = self.__adjust_hash_script
+        elif self.layout.name == 'string' and self.codec.codec.version == JsonCodec.version:
+            script = self.__adjust_json_script
+        if script:
+            result = self.redis.eval(
+                script, 4, self.layout.key(inventory_id), self.quantities_key,
+                self.totals_key, self.generation_key,
+                inventory_id, delta, '' if floor is None else floor, 'quantity',
+                self.invalidation_channel, '%s %s' % (self.__worker(), inventory_id))
+            outcome = result[0]
+            if outcome == b'missing':
+                return None
+            if outcome == b'floor':
+                raise floor_error(inventory_id, result[1], delta, floor)
+            if outcome != b'fallback':
+                return result[1]
+        return super(RedisStorage, self).adjust(inventory_id, delta, floor)
+
+    def clear(self):
+        # carry the generation over so that earlier ones never come back, and
+        # start a new epoch since ids and versions do come back
+        generation = self.generation()
+        self.__epoch = uuid.uuid4().hex[:8]
+        pipe = self.redis.pipeline()
+        pipe.flushall()
+        pipe.set(self.generation_key, generation + 1)
+        pipe.set(self.epoch_key, self.__epoch)
+        pipe.publish(self.invalidation_channel, '%s *' % self.__worker())
+        pipe.execute()
+
+    @staticmethod
+    def __bytes(value):
+        """ Returns a key, member or field as Redis hands it back """
+        return value if isinstance(value, bytes) else value.encode('utf-8')
+
+    def reindex(self, batch_size=500):
+        """
+        Rebuilds the index sets and totals from the records, in place
+
+        Nothing goes through one big MULTI, which would stall every other
+        client: each SCAN page of records is added to the index sets in a
+        pipeline of its own, then every index set is walked with ZSCAN,
+        batch_size members at a time, dropping the ids whose record is
+        gone or no longer has that value. Totals are summed on the way
+        and written at the end, counting each id once even if SCAN returns
+        it on two pages. Queries keep working throughout, but a write
+        racing a page may be indexed by its old values, so run it while
+        writes are quiet, e.g. at start up with INVENTORY_REINDEX
+
+        Returns:
+            the number of records that were indexed
+        """
+        indexed = 0
+        totals = {}
+        seen = set()
+        for records in self.scan(batch_size):
+            records = [data for data in records if data['id'] not in seen]
+            seen.update(data['id'] for data in records)
+            pipe = self.redis.pipeline(transaction=False)
+            for data in records:
+                self.__index_sets(pipe, data)
+                for key, field in self.__totals_fields(data):
+                    fields = totals.setdefault(self.__bytes(key), {})
+                    field = self.__bytes(field)
+                    fields[field] = fields.get(field, 0) + data['quantity']
+            pipe.execute()
+            indexed += len(records)
+        self.__prune(self.ids_key, batch_size, lambda data: str(data['id']))
+        self.__prune(self.quantities_key, batch_size, lambda data: str(data['id']))
+        self.__prune(self.names_key, batch_size,
+                     lambda data: self.__name_member(data['name'], data['id']))
+        for attribute in INDEXED:
+            for key in self.redis.scan_iter(match=attribute + ':*', count=batch_size):
+                self.__prune(key, batch_size, lambda data, key=key, attribute=attribute:
+                             str(data['id']) if self.__bytes(self.__index_key(
+                                 attribute, data[attribute])) == key else None)
+        self.__write_totals(totals, batch_size)
+        self.logger.info('Reindexed %d records', indexed)
+        return indexed
+
+    def __prune(self, key, batch_size, member_of):
+        """
+        Walks an index set with ZSCAN, removing the members no record
+        accounts for; member_of(data) returns the member that a record
+        has in the set, or None if it does not belong there
+        """
+        cursor = 0
+        while True:
+            cursor, entries = self.redis.zscan(key, cursor, count=batch_size)
+            members = [member for member, _ in entries]
+            # name index members end in the id, the others are the id
+            ids = [int(member.rpartition(b'\x00')[2]) for member in members]
+            stale = [member for member, data in zip(members, self.read_many(ids))
+                     if data is None or member_of(data) != member]
+            if stale:
+                self.redis.zrem(key, *stale)
+            if not cursor:
+                break
+
+    def __write_totals(self, totals, batch_size):
+        """ Replaces the totals hashes with totals, batch_size fields at a time """
+        pipe = self.redis.pipeline(transaction=False)
+        queued = 0
+        for key, fields in totals.items():
+            for field, quantity in fields.items():
+                pipe.hset(key, field, quantity)
+                queued += 1
+                if queued % batch_size == 0:
+                    pipe.execute()
+        pipe.execute()
+        for key in self.redis.scan_iter(match=self.totals_key + '*', count=batch_size):
+            if key not in totals:
+                self.redis.delete(key)
+                continue
+            stale = [field for field, _ in self.redis.hscan_iter(key, count=batch_size)
+                     if field not in totals[key]]
+            for start in range(0, len(stale), batch_size):
+                self.redis.hdel(key, *stale[start:start + batch_size])
+
+    def migrate_codec(self, batch_size=500):
+        """
+        Rewrites every record not yet stored with the current codec
+
+        Each SCAN page is read under WATCH and rewritten in one MULTI; a
+        page that changes underneath is simply read again. Layouts that do
+        not store encoded values have nothing to migrate
+
+        Returns:
+            the number of records that were rewritten
+        """
+        migrated = 0
+        cursor = 0
+        while True:
+            cursor, ids = self.layout.scan(self.redis, cursor, batch_size)
+            while ids:
+                try:
+                    with self.redis.pipeline() as pipe:
+                        pipe.watch(*set(self.layout.key(i) for i in ids))
+                        values = self.layout.read_values(self.redis, ids)
+                        stale = [value for value in values
+                                 if value is not None and not self.codec.is_current(value)]
+                        pipe.multi()
+                        for value in stale:
+                            self.layout.write(pipe, self.codec.decode(value))
+                        pipe.execute()
+                    migrated += len(stale)
+                    break
+                except WatchError:
+                    continue
+            if not cursor:
+                break
+        self.logger.info('Migrated %d records to the %s codec', migrated, self.codec.codec.name)
+        return migrated
+
+    def migrate_layout(self, source, batch_size=500):
+        """
+        Moves every record stored in the source layout to the current layout
+
+        Args:
+            source (string): the name of the layout the records are in now
+            batch_size (int): records moved per transaction
+
+        Returns:
+            the number of records that were moved
+        """
+        source = get_layout(source, self.codec, self.bucket_size)
+        if source.name == self.layout.name:
+            return 0
+        moved = 0
+        cursor = 0
+        while True:
+            cursor, ids = source.scan(self.redis, cursor, batch_size)
+            ids = [int(i) for i in ids]
+            while ids:
+                try:
+                    with self.redis.pipeline() as pipe:
+                        pipe.watch(*set(source.key(i) for i in ids))
+                        records = [data for data in source.read_many(self.redis, ids)
+                                   if data is not None]
+                        pipe.multi()
+                        for data in records:
+                            self.layout.write(pipe, data)
+                            source.delete(pipe, data['id'])
+                        pipe.execute()
+                    moved += len(records)
+                    break
+                except WatchError:
+                    continue
+            if not cursor:
+                break
+        self.logger.info('Moved %d records from the %s to the %s layout',
+                         moved, source.name, self.layout.name)
+        return moved
+
+    def __invalidated(self, message):
+        """
+        Drops the cache entry named by a message on the invalidation channel
+        Messages are '<worker> <id>', or '<worker> *' to drop everything;
+        our own messages are skipped since writers invalidate locally
+        """
+        origin, _, key = message['data'].partition(' ')
+        if origin == self.__worker():
+            return
+        if key == '*':
+            self.__epoch = None
+            self.__cache.clear()
+        else:
+            self.__cache.invalidate(int(key))
+
+    def listen(self, cache):
+        """ Subscribes a background thread to cache invalidations from other workers """
+        self.stop_listening()
+        if cache.size <= 0:
+            return
+        self.__cache = cache
+        pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{self.invalidation_channel: self.__invalidated})
+        self.__listener = pubsub.run_in_thread(sleep_time=1, daemon=True)
+        # anything cached before we subscribed may have missed its message
+        cache.clear()
+
+    def stop_listening(self):
+        """ Stops the invalidation listener, if there is one """
+        if self.__listener:
+            self.__listener.stop()
+            self.__listener = None
+
+    def pool_stats(self):
+        """ Returns how many Redis connections are open, in use and idle """
+        pool = self.redis.connection_pool
+        if hasattr(pool, 'pool'):  # a BlockingConnectionPool
+            idle = len([connection for connection in list(pool.pool.queue) if connection])
+            created = len(pool._connections)
+        else:
+            idle = len(pool._available_connections)
+            created = pool._created_connections
+        return {
+            'max_connections': pool.max_connections,
+            'created': created,
+            'in_use': created - idle,
+            'idle': idle
+        }
+
+    def close(self):
+        self.stop_listening()
+        self.redis.connection_pool.disconnect()
+
+
+class MemoryStorage(Storage):
+    """
+    Records, indexes and totals in dictionaries guarded by one lock
+
+    For single process deployments and fast test runs: nothing is shared
+    with other processes and nothing survives a restart. Reads and writes
+    copy records, so callers never hold the stored dictionaries
+    """
+    name = 'memory'
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.writes = 0
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            # ids and versions start over, and so do the writes of a new process
+            self.epoch_value = uuid.uuid4().hex[:8]
+            self.records = {}
+            # every id, kept sorted for paging
+            self.ids = []
+            # (lower-cased name, id) of every record, kept sorted for prefix searches
+            self.names = []
+            # (quantity, id digits, id) of every record, kept sorted for range
+            # queries; equal quantities sort by the id digits, as in Redis
+            self.quantities = []
+            # attribute -> normalized value -> set of ids
+            self.indexes = dict((attribute, {}) for attribute in INDEXED)
+            # normalized name -> normalized status -> quantity
+            self.totals = {}
+            self.last_id = 0
+            self.writes += 1
+
+    def __index(self, data):
+        """ Adds a record to the indexes and totals """
+        insort(self.ids, data['id'])
+        insort(self.names, (normalize(data['name']), data['id']))
+        insort(self.quantities, (data['quantity'], str(data['id']), data['id']))
+        for attribute in INDEXED:
+            self.indexes[attribute].setdefault(normalize(data[attribute]), set()).add(data['id'])
+        statuses = self.totals.setdefault(normalize(data['name']), {})
+        status = normalize(data['status'])
+        statuses[status] = statuses.get(status, 0) + data['quantity']
+
+    def __unindex(self, data):
+        """ Removes a record from the indexes and totals """
+        del self.ids[bisect_left(self.ids, data['id'])]
+        del self.names[bisect_left(self.names, (normalize(data['name']), data['id']))]
+        del self.quantities[bisect_left(self.quantities,
+                                        (data['quantity'], str(data['id']), data['id']))]
+        for attribute in INDEXED:
+            index = self.indexes[attribute]
+            value = normalize(data[attribute])
+            index[value].discard(data['id'])
+            if not index[value]:
+                del index[value]
+        statuses = self.totals[normalize(data['name'])]
+        statuses[normalize(data['status'])] -= data['quantity']
+
+    def next_ids(self, count=1):
+        with self.lock:
+            self.last_id += count
+            return self.last_id - count + 1
+
+    def read(self, inventory_id):
+        data = self.records.get(int(inventory_id))
+        return None if data is None else dict(data)
+
+    def read_many(self, ids):
+        with self.lock:
+            return [self.read(inventory_id) for inventory_id in ids]
+
+    def scan(self, batch_size=500):
+        position = 0
+        while True:
+            with self.lock:
+                page = self.ids[position:position + batch_size]
+                records = [dict(self.records[inventory_id]) for inventory_id in page]
+            if not records:
+                break
+            yield records
+            position += batch_size
+
+    def select(self, filters, after_id=0, count=None, minimum=None, maximum=None):
+        if minimum is not None or maximum is not None:
+            return self.__select_range(filters, after_id, count, minimum, maximum)
+        with self.lock:
+            if not filters:
+                ids = self.ids[bisect_right(self.ids, after_id):]
+                return ids[:count] if count else ids
+            matches = [self.indexes[attribute].get(normalize(value), set())
+                       for attribute, value in filters.items()]
+            matches.sort(key=len)
+            ids = set(matches[0]).intersection(*matches[1:])
+        ids = sorted(inventory_id for inventory_id in ids if inventory_id > after_id)
+        return ids[:count] if count else ids
+
+    def __select_range(self, filters, after_id, count, minimum, maximum):
+        """ Walks the ids in order, checking the quantity of each record """
+        ids = []
+        with self.lock:
+            matches = [self.indexes[attribute].get(normalize(value), set())
+                       for attribute, value in filters.items()]
+            for inventory_id in self.ids[bisect_right(self.ids, after_id):]:
+                if count and len(ids) == count:
+                    break
+                quantity = self.records[inventory_id]['quantity']
+                if (minimum is None or quantity >= minimum) and \
+                        (maximum is None or quantity <= maximum) and \
+                        all(inventory_id in match for match in matches):
+                    ids.append(inventory_id)
+        return ids
+
+    def select_by_quantity(self, filters, minimum=None, maximum=None, count=None,
+                           reverse=False):
+        ids = []
+        with self.lock:
+            start, end = self.__quantity_bounds(minimum, maximum)
+            matches = None
+            if filters:
+                matches = [self.indexes[attribute].get(normalize(value), set())
+                           for attribute, value in filters.items()]
+                matches.sort(key=len)
+                matches = set(matches[0]).intersection(*matches[1:])
+            step = -1 if reverse else 1
+            position = end - 1 if reverse else start
+            while start <= position < end and (not count or len(ids) < count):
+                inventory_id = self.quantities[position][2]
+                if matches is None or inventory_id in matches:
+                    ids.append(inventory_id)
+                position += step
+        return ids
+
+    def __quantity_bounds(self, minimum, maximum):
+        """ Returns the slice of the quantity index from minimum to maximum """
+        start = 0 if minimum is None else bisect_left(self.quantities, (minimum,))
+        end = len(self.quantities) if maximum is None else \
+            bisect_left(self.quantities, (maximum + 1,))
+        return start, end
+
+    def estimate(self, filters, minimum=None, maximum=None):
+        with self.lock:
+            sizes = [len(self.ids)]
+            sizes.extend(len(self.indexes[attribute].get(normalize(value), ()))
+                         for attribute, value in filters.items())
+            if minimum is not None or maximum is not None:
+                start, end = self.__quantity_bounds(minimum, maximum)
+                sizes.append(max(end - start, 0))
+        return min(sizes), sizes[0]
+
+    def select_names(self, prefix='', after=None, count=None):
+        prefix = normalize(prefix)
+        entries = []
+        with self.lock:
+            position = bisect_left(self.names, (prefix,))
+            if after is not None:
+                position = max(position, bisect_right(self.names, tuple(after)))
+            while position < len(self.names) and (not count or len(entries) < count):
+                entry = self.names[position]
+                if not entry[0].startswith(prefix):
+                    break
+                entries.append(entry)
+                position += 1
+        return entries
+
+    def generation(self):
+        return self.writes
+
+    def epoch(self):
+        return self.epoch_value
+
+    def total_quantity(self, name, status=None):
+        with self.lock:
+            statuses = self.totals.get(normalize(name), {})
+            if status is None:
+                return sum(statuses.values())
+            return statuses.get(normalize(status), 0)
+
+    def reindex(self, batch_size=500):
+        with self.lock:
+            self.ids = []
+            self.names = []
+            self.quantities = []
+            self.indexes = dict((attribute, {}) for attribute in INDEXED)
+            self.totals = {}
+            for data in self.records.values():
+                self.__index(data)
+            return len(self.records)
+
+    def transaction(self, ids, func):
+        with self.lock:
+            current = dict((inventory_id, self.read(inventory_id)) for inventory_id in ids)
+            changes, result = func(current)
+            for inventory_id, old, new in changes:
+                if old:
+                    self.__unindex(old)
+                    del self.records[old['id']]
+                if new:
+                    new['version'] = next_version(old)
+                    self.records[new['id']] = dict(new)
+                    self.__index(new)
+                self.writes += 1
+            return result
@@ -0,0 +1,44 @@
+"""
+Inventory Service Cooperative Runner
+
+Serves the Inventory Service from a single process on gevent. The
+standard library is monkey patched before the app is imported, so every
+Redis round trip made by the Inventory model yields to other requests
+instead of blocking the process, and one worker can keep hundreds of
+requests in flight. Each in-flight request holds a Redis connection, so
+raise REDIS_MAX_CONNECTIONS along with ASYNC_CONNECTIONS.
+
+Requires gevent:
+
+    $ pip install gevent
+    $ python async_run.py
+"""
+
+from gevent import monkey
+monkey.patch_all()
+
+import os
+
+from gevent.pool import Pool
+from gevent.pywsgi import WSGIServer
+
+from app import app, server
+
+# Pull options from environment
+DEBUG = (os.getenv('DEBUG', 'False') == 'True')
+PORT = os.getenv('PORT', '5000')
+# most requests served at the same time before new connections wait
+CONNECTIONS = int(os.getenv('ASYNC_CONNECTIONS', '1000'))
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == "__main__":
+    print "****************************************"
+    print " Inventory   S E R V I C E   R U N N I N G"
+    print "****************************************"
+    server.initialize_logging()
+    app.debug = DEBUG
+    http = WSGIServer(('0.0.0.0', int(PORT)), app, spawn=Pool(CONNECTIONS),
+                      log=None if not DEBUG else 'default')
+    http.serve_forever()
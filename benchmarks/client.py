@@ -0,0 +1,110 @@
+"""
+HTTP load generation shared by the serving benchmarks
+
+start() launches a runner script in a subprocess and drive() replays a
+list of requests against it from concurrent client threads.
+"""
+
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+
+def start(script, port, env=None):
+    """ Starts a runner on port and waits until it answers """
+    env = dict(os.environ, PORT=str(port), **(env or {}))
+    with open(os.devnull, 'w') as devnull:
+        process = subprocess.Popen([sys.executable, script], env=env,
+                                   stdout=devnull, stderr=devnull)
+    url = 'http://127.0.0.1:{}'.format(port)
+    for _ in range(100):
+        try:
+            requests.get(url + '/healthcheck')
+            return process, url
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError('{} did not start'.format(script))
+
+
+def stop(process):
+    """ Stops a runner started with start() """
+    process.terminate()
+    process.wait()
+
+
+def percentile(ordered, fraction):
+    """ Returns the value below which the given fraction of ordered falls """
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def drive(url, calls, concurrency):
+    """
+    Sends every call from concurrency clients and returns the figures
+
+    Args:
+        url (string): the base url of the service
+        calls (list): (method, path, json body or None) tuples, sent in order
+        concurrency (int): clients sending at the same time
+
+    Returns:
+        a dictionary with the request count, errors (5xx or no response),
+        throughput and p50/p95/p99 latency in milliseconds, plus the median
+        and most Redis round trips when the service traces them
+    """
+    latencies = []
+    errors = []
+    round_trips = []
+    counter = iter(range(len(calls)))
+    lock = threading.Lock()
+
+    def client():
+        """ Issues requests until the shared counter runs out """
+        session = requests.Session()
+        while True:
+            with lock:
+                position = next(counter, None)
+            if position is None:
+                return
+            method, path, body = calls[position]
+            started = time.time()
+            try:
+                resp = session.request(method, url + path, json=body)
+                ok = resp.status_code < 500
+                traced = resp.headers.get('X-Redis-Round-Trips')
+            except requests.RequestException:
+                ok = False
+                traced = None
+            elapsed = time.time() - started
+            with lock:
+                (latencies if ok else errors).append(elapsed)
+                if traced is not None:
+                    round_trips.append(int(traced))
+
+    clients = [threading.Thread(target=client) for _ in range(concurrency)]
+    started = time.time()
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    elapsed = time.time() - started
+    latencies.sort()
+    result = {
+        'requests': len(calls),
+        'errors': len(errors),
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2)
+    }
+    if round_trips:
+        round_trips.sort()
+        result['redis_round_trips_p50'] = percentile(round_trips, 0.50)
+        result['redis_round_trips_max'] = round_trips[-1]
+    return result
@@ -0,0 +1,53 @@
+"""
+Record Codec Benchmark
+
+Compares the encode and decode cost and the stored size of one Inventory
+record for every available codec. Run from the project root with:
+
+    $ python -m benchmarks.codec_benchmark --number 100000
+"""
+
+import argparse
+import json
+import sys
+import timeit
+
+from app.codec import CODECS, CodecError
+
+RECORD = {'id': 123456, 'name': u'body lotion', 'quantity': 42, 'status': u'openBox'}
+
+
+def measure(codec, number):
+    """ Returns the per-record cost in microseconds and the stored size of a codec """
+    value = codec.encode(RECORD)
+    assert codec.decode(value) == RECORD
+    encode = timeit.timeit(lambda: codec.encode(RECORD), number=number)
+    decode = timeit.timeit(lambda: codec.decode(value), number=number)
+    return {
+        'codec': codec.name,
+        'bytes_per_record': len(value),
+        'encode_us': round(encode / number * 1e6, 3),
+        'decode_us': round(decode / number * 1e6, 3)
+    }
+
+
+def main(argv=None):
+    """ Runs the benchmark and prints the results as JSON """
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--number', type=int, default=100000,
+                        help='records encoded and decoded per codec')
+    args = parser.parse_args(argv)
+    results = []
+    for name in sorted(CODECS):
+        try:
+            codec = CODECS[name]()
+        except CodecError as error:
+            results.append({'codec': name, 'skipped': str(error)})
+            continue
+        results.append(measure(codec, args.number))
+    json.dump(results, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+"""
+Endpoint Latency Benchmark
+
+Seeds the database with each requested number of Inventories, starts the
+service and drives every route with concurrent clients, one route at a
+time. Throughput and p50/p95/p99 latency per route are printed as JSON
+(or written to --output) so runs from different releases can be diffed;
+--trace adds the Redis round trips each route made.
+Run from the project root with:
+
+    $ python -m benchmarks.endpoint_benchmark --sizes 1000,100000,1000000
+
+The Redis database the service uses is flushed before each size.
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+
+from app.models import Inventory
+from benchmarks.client import drive, start, stop
+
+# names repeat every NAMES records so a name matches size / NAMES Inventories
+NAMES = 1000
+STATUSES = ('new', 'openBox', 'used')
+QUANTITIES = 1000
+RUNNERS = {
+    'development': ('run.py', {'SERVER': 'development'}),
+    'production': ('run.py', {'SERVER': 'production'}),
+    'async': ('async_run.py', {})
+}
+
+
+def inventory(i):
+    """ Returns the attributes of the i-th synthetic Inventory """
+    return {
+        'name': 'item{}'.format(i % NAMES),
+        'quantity': i % QUANTITIES,
+        'status': STATUSES[i % len(STATUSES)]
+    }
+
+
+def seed(records):
+    """ Replaces the database contents with synthetic Inventories """
+    Inventory.init_db()
+    Inventory.remove_all()
+    started = time.time()
+    for first in range(0, records, 1000):
+        Inventory.batch([('create', Inventory(0, **inventory(i)))
+                         for i in range(first, min(first + 1000, records))])
+    return round(time.time() - started, 2)
+
+
+def routes(records, count):
+    """
+    Returns the calls that exercise each route, in the order they are run
+
+    Writes come last and delete the highest ids so that the reads before
+    them always hit existing Inventories
+    """
+    def spread(i):
+        """ Returns an existing id, scattered over the whole range """
+        return 1 + (i * 7919) % records
+
+    return [
+        ('healthcheck', [('GET', '/healthcheck', None)] * count),
+        ('get', [('GET', '/inventories/{}'.format(spread(i)), None) for i in range(count)]),
+        ('list', [('GET', '/inventories?limit=100&cursor={}'.format(spread(i)), None)
+                  for i in range(count)]),
+        ('list_by_name', [('GET', '/inventories?limit=100&name=item{}'.format(i % NAMES), None)
+                          for i in range(count)]),
+        ('list_by_name_prefix', [('GET', '/inventories?limit=20&name_prefix=item{}'.format(
+            i % 100), None) for i in range(count)]),
+        ('list_by_status', [('GET', '/inventories?limit=100&status={}'.format(
+            STATUSES[i % len(STATUSES)]), None) for i in range(count)]),
+        ('list_by_quantity', [('GET', '/inventories?limit=100&quantity={}'.format(
+            i % QUANTITIES), None) for i in range(count)]),
+        ('list_sorted', [('GET', '/inventories?limit=50&sort={}&status={}'.format(
+            ('-quantity', 'name')[i % 2], STATUSES[i % len(STATUSES)]), None)
+            for i in range(count)]),
+        ('low_stock', [('GET', '/inventories/low-stock?limit=100&threshold={}'.format(
+            i % QUANTITIES), None) for i in range(count)]),
+        ('query', [('GET', '/inventories/query?name=item{}&status={}'.format(
+            i % NAMES, STATUSES[i % len(STATUSES)]), None) for i in range(count)]),
+        ('count', [('GET', '/inventories/count?name=item{}'.format(i % NAMES), None)
+                   for i in range(count)]),
+        ('post', [('POST', '/inventories', inventory(i)) for i in range(count)]),
+        ('put', [('PUT', '/inventories/{}'.format(spread(i)), inventory(i + 1))
+                 for i in range(count)]),
+        ('adjust', [('PATCH', '/inventories/{}/adjust'.format(spread(i)), {'delta': 1})
+                    for i in range(count)]),
+        ('batch', [('POST', '/inventories/batch',
+                    [{'op': 'create', 'data': inventory(i * 10 + j)} for j in range(10)])
+                   for i in range(count)]),
+        ('delete', [('DELETE', '/inventories/{}'.format(records - i), None)
+                    for i in range(min(count, records))])
+    ]
+
+
+def revision():
+    """ Returns the git commit being measured, if there is one """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD']).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    """ Runs the benchmark and prints the results as JSON """
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='1000,100000,1000000',
+                        help='comma separated numbers of Inventories to seed')
+    parser.add_argument('--requests', type=int, default=1000, help='requests per route')
+    parser.add_argument('--concurrency', type=int, default=20, help='concurrent clients')
+    parser.add_argument('--runner', choices=sorted(RUNNERS), default='production',
+                        help='how the service is served')
+    parser.add_argument('--routes', help='comma separated subset of routes to drive')
+    parser.add_argument('--trace', action='store_true',
+                        help='also report the Redis round trips of each route')
+    parser.add_argument('--port', type=int, default=5090, help='port to serve on')
+    parser.add_argument('--output', help='write the JSON here instead of stdout')
+    args = parser.parse_args(argv)
+    script, env = RUNNERS[args.runner]
+    if args.trace:
+        env = dict(env, INVENTORY_TRACE='true')
+    selected = args.routes.split(',') if args.routes else None
+    output = {
+        'revision': revision(),
+        'python': platform.python_version(),
+        'runner': args.runner,
+        'concurrency': args.concurrency,
+        'requests_per_route': args.requests,
+        'sizes': []
+    }
+    for size in [int(size) for size in args.sizes.split(',')]:
+        measured = {'records': size, 'seed_seconds': seed(size), 'routes': []}
+        process, url = start(script, args.port, env)
+        try:
+            for name, calls in routes(size, args.requests):
+                if selected and name not in selected:
+                    continue
+                result = drive(url, calls, args.concurrency)
+                result['route'] = name
+                measured['routes'].append(result)
+        finally:
+            stop(process)
+        output['sizes'].append(measured)
+    if args.output:
+        with open(args.output, 'w') as results:
+            json.dump(output, results, indent=2, sort_keys=True)
+    else:
+        json.dump(output, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+Record Load Benchmark
+
+Compares turning stored records into Inventory objects with the schema
+validating deserialize() against the trusted from_record() path, and the
+memory an object takes with and without __slots__. Run from the project
+root with:
+
+    $ python -m benchmarks.load_benchmark --records 100000
+"""
+
+import argparse
+import json
+import sys
+import timeit
+
+from app.models import Inventory
+
+RECORD = {'id': 123456, 'name': u'body lotion', 'quantity': 42, 'status': u'openBox'}
+
+
+class PlainInventory(object):
+    """ The attributes of an Inventory kept in a per-instance __dict__ """
+
+    def __init__(self, inventoryid=0, name='', quantity=0, status=''):
+        self.id = inventoryid
+        self.name = name
+        self.quantity = quantity
+        self.status = status
+
+
+def object_size(inventory):
+    """ Returns the bytes held by an object and its attribute dictionary """
+    size = sys.getsizeof(inventory)
+    if hasattr(inventory, '__dict__'):
+        size += sys.getsizeof(inventory.__dict__)
+    return size
+
+
+def main(argv=None):
+    """ Runs the benchmark and prints the results as JSON """
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--records', type=int, default=100000,
+                        help='records loaded per path')
+    args = parser.parse_args(argv)
+    validated = timeit.timeit(lambda: Inventory(RECORD['id']).deserialize(RECORD),
+                              number=args.records)
+    trusted = timeit.timeit(lambda: Inventory.from_record(RECORD), number=args.records)
+    results = {
+        'records': args.records,
+        'validated_records_per_second': int(args.records / validated),
+        'trusted_records_per_second': int(args.records / trusted),
+        'speedup': round(validated / trusted, 1),
+        'bytes_per_object_with_dict': object_size(PlainInventory(
+            RECORD['id'], RECORD['name'], RECORD['quantity'], RECORD['status'])),
+        'bytes_per_object_with_slots': object_size(Inventory.from_record(RECORD))
+    }
+    json.dump(results, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+Storage Layout Memory Benchmark
+
+Loads the same synthetic records into an empty Redis database with every
+storage layout in turn, through the same writes the service makes, and
+reports the memory Redis uses for them: the total, which is what the
+Redis instance has to be sized for, and how much of it the records and
+the indexes and totals each take. Run from the project root with:
+
+    $ python -m benchmarks.memory_benchmark --records 1000000
+
+The database given by --db is flushed before and after each layout.
+"""
+
+import argparse
+import json
+import sys
+import time
+
+from redis import Redis
+
+from app.codec import Registry, get_codec
+from app.layout import LAYOUTS, get_layout
+from app.storage import INDEXED, RedisStorage
+
+NAMES = (u'shampoo', u'body lotion', u'conditioner', u'toothpaste', u'hand soap')
+STATUSES = (u'new', u'openBox', u'used')
+
+
+def record(inventory_id):
+    """ Returns a synthetic record, cycling through names and statuses """
+    return {
+        'id': inventory_id,
+        'name': NAMES[inventory_id % len(NAMES)],
+        'quantity': inventory_id % 1000,
+        'status': STATUSES[inventory_id % len(STATUSES)]
+    }
+
+
+def used_memory(redis):
+    """ Returns the bytes Redis has allocated for data """
+    return redis.info('memory')['used_memory']
+
+
+def drop_indexes(redis, storage):
+    """ Deletes the index sets and totals, leaving only the records """
+    keys = [storage.ids_key, storage.names_key, storage.quantities_key, storage.totals_key,
+            storage.generation_key]
+    for pattern in [storage.totals_key + ':*'] + [attribute + ':*' for attribute in INDEXED]:
+        keys.extend(redis.scan_iter(match=pattern, count=1000))
+    for start in range(0, len(keys), 1000):
+        redis.delete(*keys[start:start + 1000])
+
+
+def measure(redis, layout, codec, records, batch_size):
+    """ Loads records with a layout and returns its memory figures """
+    redis.flushdb()
+    storage = RedisStorage(redis, layout, codec)
+    baseline = used_memory(redis)
+    started = time.time()
+    for start in range(1, records + 1, batch_size):
+        ids = range(start, min(start + batch_size, records + 1))
+        storage.transaction(ids, lambda current, ids=ids: (
+            [(inventory_id, None, record(inventory_id)) for inventory_id in ids], None))
+    elapsed = time.time() - started
+    used = used_memory(redis) - baseline
+    keys = redis.dbsize()
+    sample = layout.key(1)
+    encoding = redis.object('encoding', sample)
+    drop_indexes(redis, storage)
+    record_bytes = used_memory(redis) - baseline
+    result = {
+        'layout': layout.name,
+        'records': records,
+        'keys': keys,
+        'used_memory_bytes': used,
+        'bytes_per_record': round(float(used) / records, 1),
+        'record_bytes_per_record': round(float(record_bytes) / records, 1),
+        'index_bytes_per_record': round(float(used - record_bytes) / records, 1),
+        'load_seconds': round(elapsed, 2),
+        'encoding': encoding
+    }
+    if hasattr(layout, 'size'):
+        result['bucket_size'] = layout.size
+    redis.flushdb()
+    return result
+
+
+def main(argv=None):
+    """ Runs the benchmark and prints the results as JSON """
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--records', type=int, default=1000000,
+                        help='records loaded per layout')
+    parser.add_argument('--bucket-size', type=int, default=100,
+                        help='records per hash for the bucket layout')
+    parser.add_argument('--codec', default='json', help='codec for encoded layouts')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6379)
+    parser.add_argument('--db', type=int, default=15, help='scratch database to use')
+    parser.add_argument('--batch-size', type=int, default=10000,
+                        help='records written per transaction')
+    args = parser.parse_args(argv)
+    redis = Redis(host=args.host, port=args.port, db=args.db)
+    codec = Registry(get_codec(args.codec))
+    results = []
+    for name in sorted(LAYOUTS):
+        layout = get_layout(name, codec, args.bucket_size)
+        results.append(measure(redis, layout, codec, args.records, args.batch_size))
+    json.dump(results, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Serving Benchmark
+
+Starts the service with the threadless run.py and with the gevent based
+async_run.py, drives both with the same concurrent read workload and
+checks that they answer every request with identical bodies. Run from
+the project root with:
+
+    $ python -m benchmarks.serving_benchmark --requests 5000 --concurrency 100
+
+The Redis database the service uses is flushed and seeded with --records
+Inventories first.
+"""
+
+import argparse
+import json
+import sys
+
+import requests
+
+from app.models import Inventory
+from benchmarks.client import drive, start, stop
+
+RUNNERS = (('sync', 'run.py'), ('async', 'async_run.py'))
+NAMES = ('shampoo', 'conditioner', 'soap', 'lotion', 'toothpaste')
+
+
+def seed(records):
+    """ Replaces the database contents with synthetic Inventories """
+    Inventory.init_db()
+    Inventory.remove_all()
+    for first in range(0, records, 1000):
+        Inventory.batch([('create', Inventory(0, NAMES[i % len(NAMES)], i % 50, 'new'))
+                         for i in range(first, min(first + 1000, records))])
+
+
+def paths(records):
+    """ Returns the request paths of the workload, cycled through by the clients """
+    workload = ['/inventories/{}'.format(1 + (i * 7919) % records) for i in range(20)]
+    workload += ['/inventories/query?name={}&status=new'.format(name) for name in NAMES]
+    workload += ['/inventories/count?name={}'.format(name) for name in NAMES]
+    workload += ['/inventories?limit=20&cursor={}'.format(i * 100) for i in range(5)]
+    return workload
+
+
+def main(argv=None):
+    """ Runs the benchmark and prints the results as JSON """
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--records', type=int, default=10000, help='Inventories seeded')
+    parser.add_argument('--requests', type=int, default=5000, help='requests per runner')
+    parser.add_argument('--concurrency', type=int, default=100, help='concurrent clients')
+    parser.add_argument('--port', type=int, default=5050, help='first port to serve on')
+    args = parser.parse_args(argv)
+    seed(args.records)
+    workload = paths(args.records)
+    results = []
+    bodies = {}
+    for offset, (name, script) in enumerate(RUNNERS):
+        process, url = start(script, args.port + offset)
+        try:
+            bodies[name] = [requests.get(url + path).json() for path in workload]
+            calls = [('GET', workload[i % len(workload)], None) for i in range(args.requests)]
+            result = drive(url, calls, args.concurrency)
+        finally:
+            stop(process)
+        result.update({'runner': name, 'concurrency': args.concurrency})
+        results.append(result)
+    output = {'results': results, 'identical_responses': bodies['sync'] == bodies['async']}
+    json.dump(output, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
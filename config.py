@@ -1,3 +1,9 @@
 import logging
 SECRET_KEY = 'secret-for-dev'
-LOGGING_LEVEL = logging.INFO
\ No newline at end of file
+LOGGING_LEVEL = logging.INFO
+# page size of GET /inventories when only a cursor is given
+DEFAULT_PAGE_LIMIT = 100
+# largest number of operations accepted by POST /inventories/batch
+MAX_BATCH_SIZE = 1000
+# Inventories per chunk of a streamed GET /inventories response
+STREAM_CHUNK_SIZE = 100
@@ -0,0 +1,41 @@
+"""
+Gunicorn settings for the production runner
+
+Used by `SERVER=production python run.py`, or directly with:
+
+    $ gunicorn --config gunicorn_config.py run:app
+
+The app is imported once in the master and forked into the workers; each
+worker drops anything Redis related it inherited and connects on its
+first request. Send the master SIGHUP to replace the workers gracefully
+(after a configuration change); as the code is preloaded, deploy new code
+with SIGUSR2, which starts a new master beside the old one, then SIGTERM
+the old master once the new workers are up.
+"""
+
+import os
+
+bind = '0.0.0.0:{}'.format(os.getenv('PORT', '5000'))
+# load the app before forking so workers share its memory and start fast
+preload_app = True
+# a fixed default: in a container the host CPU count says nothing about
+# the memory each worker can have, so size it with WEB_CONCURRENCY
+workers = int(os.getenv('WEB_CONCURRENCY', '2'))
+# more than one thread per worker switches to the threaded gthread worker
+threads = int(os.getenv('WEB_THREADS', '1'))
+# recycle a worker after this many requests (0 never), spread by the jitter
+max_requests = int(os.getenv('WEB_MAX_REQUESTS', '10000'))
+max_requests_jitter = int(os.getenv('WEB_MAX_REQUESTS_JITTER', '1000'))
+timeout = int(os.getenv('WEB_TIMEOUT', '30'))
+# seconds workers get to finish in-flight requests on reload or shutdown
+graceful_timeout = int(os.getenv('WEB_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.getenv('WEB_KEEPALIVE', '2'))
+loglevel = 'debug' if os.getenv('DEBUG', 'False') == 'True' else 'info'
+accesslog = '-' if os.getenv('WEB_ACCESS_LOG', 'False') == 'True' else None
+
+
+def post_fork(server, worker):
+    """ Makes sure a new worker opens its own Redis connections """
+    from app.models import Inventory
+    Inventory.disconnect()
+    server.log.info('Worker %s ready', worker.pid)
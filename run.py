@@ -2,14 +2,20 @@
 Inventory Service Runner
 
 Start the Inventory Service and initializes logging
+
+SERVER=development (the default) runs Flask's single process server;
+SERVER=production hands over to a pre-forked gunicorn worker pool that
+is configured in gunicorn_config.py
 """
 
 import os
+import sys
 from app import app, server
 
 # Pull options from environment
 DEBUG = (os.getenv('DEBUG', 'False') == 'True')
 PORT = os.getenv('PORT', '5000')
+SERVER = os.getenv('SERVER', 'development')
 
 ######################################################################
 #   M A I N
@@ -19,4 +25,9 @@ if __name__ == "__main__":
     print " Inventory   S E R V I C E   R U N N I N G"
     print "****************************************"
     server.initialize_logging()
+    if SERVER == 'production':
+        config = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gunicorn_config.py')
+        os.execvp('gunicorn', ['gunicorn', '--config', config, 'run:app'])
+    elif SERVER != 'development':
+        sys.exit('SERVER must be development or production, not {}'.format(SERVER))
     app.run(host='0.0.0.0', port=int(PORT), debug=DEBUG)
@@ -0,0 +1,73 @@
+# Test cases can be run with:
+# nosetests
+# coverage report -m
+
+""" Test cases for the process-local cache """
+
+import time
+import unittest
+
+from app.cache import LRUCache
+
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestLRUCache(unittest.TestCase):
+    """ Test Cases for LRUCache """
+
+    def test_get_and_set(self):
+        """ Cache a value and count hits and misses """
+        cache = LRUCache(2, 60)
+        self.assertIs(cache.get(1), None)
+        cache.set(1, 'shampoo')
+        self.assertEqual(cache.get(1), 'shampoo')
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['size'], 1)
+
+    def test_evicts_least_recently_used(self):
+        """ Evict the least recently used value when full """
+        cache = LRUCache(2, 60)
+        cache.set(1, 'shampoo')
+        cache.set(2, 'soap')
+        cache.get(1)
+        cache.set(3, 'lotion')
+        self.assertIs(cache.get(2), None)
+        self.assertEqual(cache.get(1), 'shampoo')
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_expires_entries(self):
+        """ Expire values older than the time to live """
+        cache = LRUCache(2, 0.01)
+        cache.set(1, 'shampoo')
+        time.sleep(0.02)
+        self.assertIs(cache.get(1), None)
+
+    def test_stale_set_is_ignored(self):
+        """ Ignore values read before an invalidation """
+        cache = LRUCache(2, 60)
+        token = cache.token()
+        cache.invalidate(1)
+        cache.set(1, 'shampoo', token)
+        self.assertIs(cache.get(1), None)
+        cache.set(1, 'shampoo', cache.token())
+        self.assertEqual(cache.get(1), 'shampoo')
+
+    def test_clear_and_disabled(self):
+        """ Clear the cache and never store when the size is zero """
+        cache = LRUCache(2, 60)
+        cache.set(1, 'shampoo')
+        cache.clear()
+        self.assertIs(cache.get(1), None)
+        disabled = LRUCache(0, 60)
+        disabled.set(1, 'shampoo')
+        self.assertIs(disabled.get(1), None)
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+# Test cases can be run with:
+# nosetests
+# coverage report -m
+
+""" Test cases for the record codecs """
+
+import pickle
+import unittest
+
+from app.codec import CodecError, JsonCodec, MsgpackCodec, PickleCodec, Registry, \
+    get_codec, msgpack
+
+DATA = {'id': 7, 'name': u'shampoo', 'quantity': 3, 'status': u'new', 'version': 2}
+
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestCodecs(unittest.TestCase):
+    """ Test Cases for record codecs """
+
+    def test_json_round_trip(self):
+        """ Encode and decode a record as JSON """
+        codec = JsonCodec()
+        value = codec.encode(DATA)
+        self.assertEqual(value[:1], JsonCodec.version)
+        self.assertEqual(codec.decode(value), DATA)
+        self.assertTrue(len(value) < len(pickle.dumps(DATA)))
+
+    def test_decode_without_version(self):
+        """ Read an array written before records had versions as version 0 """
+        data = JsonCodec().decode(JsonCodec.version + b'[7,"shampoo",3,"new"]')
+        self.assertEqual(data, dict(DATA, version=0))
+
+    @unittest.skipIf(msgpack is None, 'msgpack is not installed')
+    def test_msgpack_round_trip(self):
+        """ Encode and decode a record as MessagePack """
+        codec = MsgpackCodec()
+        value = codec.encode(DATA)
+        self.assertEqual(value[:1], MsgpackCodec.version)
+        self.assertEqual(codec.decode(value), DATA)
+
+    def test_unknown_codec(self):
+        """ Ask for a codec that does not exist """
+        self.assertRaises(CodecError, get_codec, 'yaml')
+
+    def test_registry_reads_every_codec(self):
+        """ Read values written by the current and the legacy codec """
+        registry = Registry(get_codec('json'), allow_pickle=True)
+        legacy = PickleCodec().encode(DATA)
+        self.assertEqual(registry.decode(legacy), DATA)
+        self.assertFalse(registry.is_current(legacy))
+        value = registry.encode(DATA)
+        self.assertEqual(registry.decode(value), DATA)
+        self.assertTrue(registry.is_current(value))
+
+    def test_registry_refuses_pickle(self):
+        """ Refuse to unpickle legacy values when pickle is not allowed """
+        registry = Registry(get_codec('json'))
+        self.assertRaises(CodecError, registry.decode, pickle.dumps(DATA))
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == '__main__':
+    unittest.main()
@@ -4,9 +4,18 @@
 
 """ Test cases for Inventory Model """
 
+import json
+import os
+import pickle
+import threading
+import time
 import unittest
 
-from app.models import Inventory, DataValidationError
+from mock import patch
+
+from app.codec import CodecError
+from app.models import Inventory, DataValidationError, InsufficientQuantityError, \
+    VersionConflictError
 
 VCAP_SERVICES = {
     'rediscloud': [
@@ -101,6 +110,14 @@ class Testinventories(unittest.TestCase):
         self.assertEqual(testInventory.quantity, 2)
         self.assertEqual(testInventory.status, "new")
 
+    def test_from_record(self):
+        """ Build an Inventory from a stored record without validation """
+        data = {"id": 3, "name": "shampoo", "quantity": 2, "status": "new"}
+        inventory = Inventory.from_record(data)
+        self.assertEqual(inventory.serialize(), data)
+        self.assertFalse(hasattr(inventory, '__dict__'))
+        self.assertRaises(AttributeError, setattr, inventory, 'color', 'blue')
+
     def test_deserialize_with_no_name(self):
         """ Deserialize Inventory without a name """
         testInventory = Inventory()
@@ -117,6 +134,11 @@ class Testinventories(unittest.TestCase):
         testInventory = Inventory()
         self.assertRaises(DataValidationError, testInventory.deserialize, "data")
 
+    def test_deserialize_with_boolean_quantity(self):
+        """ Deserialize an Inventory whose quantity is a boolean """
+        data = {"name": "shampoo", "quantity": True, "status": "new"}
+        self.assertRaises(DataValidationError, Inventory().deserialize, data)
+
     def test_findInventory(self):
         """ Find Inventory by ID """
         Inventory(0, "shampoo", 1, "new").save()
@@ -161,6 +183,387 @@ class Testinventories(unittest.TestCase):
         self.assertEqual(len(inventories), 1)
         self.assertEqual(inventories[0].name, "shampoo")
 
+    def test_find_by_name_is_case_insensitive(self):
+        """ Find Inventory by Name ignoring case """
+        Inventory(0, "Shampoo", 1, "New").save()
+        self.assertEqual(len(Inventory.find_by_name("SHAMPOO")), 1)
+        self.assertEqual(len(Inventory.find_by_status("new")), 1)
+
+    def test_update_moves_index_entries(self):
+        """ Update Inventory and find it by its new values only """
+        testInventory = Inventory(0, "shampoo", 1, "new")
+        testInventory.save()
+        testInventory.status = "used"
+        testInventory.quantity = 3
+        testInventory.save()
+        self.assertEqual(len(Inventory.find_by_status("new")), 0)
+        self.assertEqual(len(Inventory.find_by_quantity(1)), 0)
+        inventories = Inventory.find_by_status("used")
+        self.assertEqual(len(inventories), 1)
+        self.assertEqual(inventories[0].quantity, 3)
+        self.assertEqual(len(Inventory.find_by_quantity(3)), 1)
+
+    def test_delete_removes_index_entries(self):
+        """ Delete Inventory and no longer find it by name """
+        testInventory = Inventory(0, "shampoo", 1, "new")
+        testInventory.save()
+        Inventory(0, "shampoo", 2, "used").save()
+        testInventory.delete()
+        inventories = Inventory.find_by_name("shampoo")
+        self.assertEqual(len(inventories), 1)
+        self.assertEqual(inventories[0].status, "used")
+        self.assertEqual(len(Inventory.find_by_status("new")), 0)
+
+    def test_iter_all_in_batches(self):
+        """ Iterate over all Inventories a few at a time """
+        for i in range(25):
+            Inventory(0, "soap", i, "new").save()
+        inventories = Inventory.iter_all(batch_size=4)
+        self.assertFalse(isinstance(inventories, list))
+        self.assertEqual([inventory.id for inventory in inventories], range(1, 26))
+
+    def test_find_page(self):
+        """ Find Inventories one page at a time """
+        for name in ("shampoo", "soap", "shampoo", "shampoo"):
+            Inventory(0, name, 1, "new").save()
+        inventories, next_id = Inventory.find_page(2)
+        self.assertEqual([inventory.id for inventory in inventories], [1, 2])
+        self.assertEqual(next_id, 2)
+        inventories, next_id = Inventory.find_page(2, next_id)
+        self.assertEqual([inventory.id for inventory in inventories], [3, 4])
+        self.assertIs(next_id, None)
+        inventories, next_id = Inventory.find_page(1, 1, name='SHAMPOO')
+        self.assertEqual([inventory.id for inventory in inventories], [3])
+        self.assertEqual(next_id, 3)
+
+    def test_find_by_quantity_range(self):
+        """ Find Inventories by a range of quantities, in quantity order """
+        for name, quantity, status in (("shampoo", 7, "new"), ("soap", 2, "used"),
+                                       ("lotion", 4, "new"), ("shampoo", 0, "new"),
+                                       ("soap", 12, "new")):
+            Inventory(0, name, quantity, status).save()
+        self.assertEqual([i.id for i in Inventory.find_by_quantity_range(2, 7)], [2, 3, 1])
+        self.assertEqual([i.id for i in Inventory.find_by_quantity_range(maximum=4, limit=2)],
+                         [4, 2])
+        self.assertEqual([i.id for i in Inventory.find_by_quantity_range(3, status="NEW")],
+                         [3, 1, 5])
+        self.assertEqual([i.id for i in Inventory.find_low_stock(5)], [4, 2, 3])
+        self.assertEqual([i.id for i in Inventory.find_low_stock(5, name="soap")], [2])
+        self.assertEqual(Inventory.find_by_quantity_range(8, 7), [])
+        self.assertEqual([i.id for i in Inventory.query(quantity_min=4)], [1, 3, 5])
+        self.assertEqual([i.id for i in Inventory.query(quantity_max=4, status="new")], [3, 4])
+        inventories, next_id = Inventory.find_page(1, 1, quantity_min=4)
+        self.assertEqual(([i.id for i in inventories], next_id), ([3], 3))
+        Inventory(3, "lotion", 9, "new").save()
+        Inventory.find(4).delete()
+        self.assertEqual(Inventory.adjust_quantity(5, -11), 1)
+        self.assertEqual([i.id for i in Inventory.find_low_stock(5)], [5, 2])
+        self.assertEqual([i.id for i in Inventory.find_by_quantity_range(7)], [1, 3])
+
+    def test_find_page_in_wide_quantity_range(self):
+        """ Page through a wide quantity range by walking the ids in order """
+        Inventory.batch([('create', Inventory(0, "item", i % 3, "used" if i < 600 else "new"))
+                         for i in range(1200)])
+        with patch.object(Inventory.storage, 'select_by_quantity', side_effect=AssertionError):
+            inventories, next_id = Inventory.find_page(2, 0, quantity_min=1, name="item",
+                                                       status="new")
+            self.assertEqual(([i.id for i in inventories], next_id), ([602, 603], 603))
+            inventories, next_id = Inventory.find_page(3, 1190, quantity_max=0)
+            self.assertEqual(([i.id for i in inventories], next_id), ([1192, 1195, 1198], None))
+
+    def test_find_sorted(self):
+        """ Find Inventories in the order of an index, combined with filters """
+        for name, quantity, status in (("soap", 7, "new"), ("Lotion", 2, "used"),
+                                       ("shampoo", 4, "new"), ("lotion", 9, "new"),
+                                       ("conditioner", 4, "used")):
+            Inventory(0, name, quantity, status).save()
+        def ids(sort, limit=None, name_prefix=None, **filters):
+            return [i.id for i in Inventory.find_sorted(sort, limit, name_prefix, **filters)]
+        self.assertEqual(ids('id'), [1, 2, 3, 4, 5])
+        self.assertEqual(ids('name'), [5, 2, 4, 3, 1])
+        self.assertEqual(ids('quantity', 3), [2, 3, 5])
+        self.assertEqual(ids('-quantity', 2), [4, 1])
+        self.assertEqual(ids('-quantity', status="new", quantity_max=8), [1, 3])
+        self.assertEqual(ids('name', 2, status="new"), [4, 3])
+        self.assertEqual(ids('name', None, "lo", name="lotion"), [2, 4])
+        self.assertEqual(ids('name', None, "s", name="lotion"), [])
+        self.assertEqual(ids('name', None, "s", status="used"), [])
+        self.assertEqual(ids('id', 2, quantity_min=4), [1, 3])
+        self.assertEqual(ids('-quantity', None, "l"), [4, 2])
+        self.assertEqual(ids('id', 1, "s"), [1])
+        self.assertRaises(DataValidationError, Inventory.find_sorted, 'price')
+        self.assertRaises(DataValidationError, Inventory.find_sorted, 'quantity', color="red")
+
+    def test_sorted_ties(self):
+        """ Order equal names and quantities the same way on every path """
+        for inventory_id in range(1, 12):
+            Inventory(0, "soap" if inventory_id in (2, 10) else "zinc", 1, "new").save()
+        def ids(sort, limit=None, name_prefix=None, **filters):
+            return [i.id for i in Inventory.find_sorted(sort, limit, name_prefix, **filters)]
+        walked = [i.id for i in Inventory.find_by_name_prefix("")]
+        self.assertEqual(walked, [2, 10, 1, 3, 4, 5, 6, 7, 8, 9, 11])
+        self.assertEqual(ids('name', None, None, status="new"), walked)
+        self.assertEqual(ids('name', 1, status="new"), [2])
+        self.assertEqual(ids('name', None, "soap"), [2, 10])
+        self.assertEqual(ids('quantity', 3), [1, 10, 11])
+        self.assertEqual(ids('-quantity', 3), [9, 8, 7])
+        self.assertEqual(ids('quantity', 3, "zi"), [1, 11, 3])
+        self.assertEqual(ids('-quantity', 2, "zi"), [9, 8])
+
+    def test_find_by_name_prefix(self):
+        """ Find Inventories whose name starts with a prefix, in name order """
+        for name, status in (("Shampoo", "new"), ("soap", "new"), ("shaving foam", "used"),
+                             ("sham", "new"), (u"\u00e9clair", "new")):
+            Inventory(0, name, 1, status).save()
+        self.assertEqual([i.name for i in Inventory.find_by_name_prefix("SHA")],
+                         ["sham", "Shampoo", "shaving foam"])
+        self.assertEqual([i.id for i in Inventory.find_by_name_prefix("sha", 2, batch_size=1)],
+                         [4, 1])
+        self.assertEqual([i.id for i in Inventory.find_by_name_prefix("sha", 1, status="used")],
+                         [3])
+        self.assertEqual([i.id for i in Inventory.find_by_name_prefix(u"\u00c9")], [5])
+        self.assertEqual(list(Inventory.find_by_name_prefix("shampoos")), [])
+        self.assertRaises(DataValidationError, Inventory.find_by_name_prefix, "sha", id=1)
+        Inventory(1, "lotion", 1, "new").save()
+        Inventory.find(4).delete()
+        self.assertEqual([i.id for i in Inventory.find_by_name_prefix("sh")], [3])
+        self.assertEqual([i.id for i in Inventory.find_by_name_prefix("")], [1, 3, 2, 5])
+
+    def test_adjust_quantity(self):
+        """ Adjust the quantity of an Inventory """
+        Inventory(0, "shampoo", 5, "new").save()
+        self.assertEqual(Inventory.adjust_quantity(1, -3), 2)
+        self.assertEqual(Inventory.find(1).quantity, 2)
+        self.assertEqual(len(Inventory.find_by_quantity(5)), 0)
+        self.assertEqual(len(Inventory.find_by_quantity(2)), 1)
+        self.assertIs(Inventory.adjust_quantity(7, 1), None)
+
+    def test_adjust_quantity_below_floor(self):
+        """ Adjust the quantity of an Inventory below its floor """
+        Inventory(0, "shampoo", 2, "new").save()
+        self.assertRaises(InsufficientQuantityError, Inventory.adjust_quantity, 1, -3, 0)
+        self.assertEqual(Inventory.find(1).quantity, 2)
+        self.assertEqual(Inventory.adjust_quantity(1, -2, 0), 0)
+
+    def test_adjust_quantity_concurrently(self):
+        """ Adjust the quantity of an Inventory from several threads """
+        Inventory(0, "shampoo", 100, "new").save()
+        def take_stock():
+            for _ in range(20):
+                Inventory.adjust_quantity(1, -1)
+        workers = [threading.Thread(target=take_stock) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(Inventory.find(1).quantity, 20)
+
+    def test_save_expected_version(self):
+        """ Only write over the version a conditional save expects """
+        Inventory(0, "shampoo", 5, "new").save()
+        inventory = Inventory.find(1)
+        self.assertEqual(inventory.version, 1)
+        inventory.quantity = 4
+        inventory.save(expected_versions=[1])
+        self.assertEqual(inventory.version, 2)
+        inventory.quantity = 3
+        self.assertRaises(VersionConflictError, inventory.save, [1])
+        self.assertEqual(Inventory.find(1).quantity, 4)
+        self.assertRaises(VersionConflictError, Inventory(7, "soap", 1, "new").save, [1])
+        self.assertEqual(Inventory.find(7), None)
+
+    def test_concurrent_conditional_saves(self):
+        """ Let exactly one of several writers of the same version win """
+        Inventory(0, "shampoo", 5, "new").save()
+        outcomes = []
+
+        def update(quantity):
+            try:
+                Inventory(1, "shampoo", quantity, "new").save(expected_versions=[1])
+                outcomes.append(quantity)
+            except VersionConflictError:
+                outcomes.append(None)
+        workers = [threading.Thread(target=update, args=(i,)) for i in range(8)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        winners = [quantity for quantity in outcomes if quantity is not None]
+        self.assertEqual(len(winners), 1)
+        self.assertEqual(Inventory.find(1).quantity, winners[0])
+        self.assertEqual(Inventory.find(1).version, 2)
+
+    def test_total_quantity(self):
+        """ Keep the total quantity per name and status up to date """
+        shampoo = Inventory(0, "shampoo", 5, "new")
+        shampoo.save()
+        Inventory(0, "Shampoo", 2, "used").save()
+        Inventory(0, "soap", 9, "new").save()
+        self.assertEqual(Inventory.total_quantity("SHAMPOO"), 7)
+        self.assertEqual(Inventory.total_quantity("shampoo", "new"), 5)
+        shampoo.status = "used"
+        shampoo.save()
+        Inventory.adjust_quantity(2, 1)
+        self.assertEqual(Inventory.total_quantity("shampoo", "new"), 0)
+        self.assertEqual(Inventory.total_quantity("shampoo", "used"), 8)
+        shampoo.delete()
+        self.assertEqual(Inventory.total_quantity("shampoo"), 3)
+        self.assertEqual(Inventory.total_quantity("lotion"), 0)
+        Inventory.reindex()
+        self.assertEqual(Inventory.total_quantity("shampoo"), 3)
+
+    def test_reindex_in_place(self):
+        """ Rebuild the indexes page by page, dropping stale entries """
+        for name, quantity, status in (("shampoo", 5, "new"), ("soap", 2, "used")):
+            Inventory(0, name, quantity, status).save()
+        # a record stored before the indexes existed, and leftovers of a lost one
+        pipe = Inventory.redis.pipeline()
+        Inventory.storage.layout.write(pipe, {"id": 3, "name": "Shampoo", "quantity": 1,
+                                              "status": "used", "version": 1})
+        pipe.zadd('status:new', {2: 2, 9: 9})
+        pipe.zadd('name:lotion', {9: 9})
+        pipe.zadd('names', {b'lotion\x009': 0})
+        pipe.zadd('quantities', {9: 4})
+        pipe.hset('totals', 'lotion', 4)
+        pipe.hset('totals:lotion', 'new', 4)
+        pipe.hset('totals:shampoo', 'new', 50)
+        pipe.delete('ids')
+        pipe.execute()
+        with patch.object(Inventory.redis, 'pipeline', wraps=Inventory.redis.pipeline) as pipeline:
+            self.assertEqual(Inventory.reindex(batch_size=2), 3)
+        self.assertTrue(all(call[1].get('transaction') is False
+                            for call in pipeline.call_args_list))
+        self.assertEqual([i.id for i in Inventory.find_by_status("new")], [1])
+        self.assertEqual([i.id for i in Inventory.find_by_name("shampoo")], [1, 3])
+        self.assertEqual(Inventory.find_by_name("lotion"), [])
+        self.assertEqual([i.id for i in Inventory.find_page(2)[0]], [1, 2])
+        self.assertEqual([i.id for i in Inventory.find_by_name_prefix("")], [1, 3, 2])
+        self.assertEqual([i.id for i in Inventory.find_low_stock(5)], [3, 2])
+        self.assertEqual(Inventory.total_quantity("shampoo"), 6)
+        self.assertEqual(Inventory.total_quantity("shampoo", "new"), 5)
+        self.assertEqual(Inventory.total_quantity("lotion"), 0)
+        self.assertFalse(Inventory.redis.exists('totals:lotion'))
+
+    def test_scan_repeats(self):
+        """ Count a record once when SCAN returns it twice during a rehash """
+        for name, quantity in (("shampoo", 5), ("soap", 2)):
+            Inventory(0, name, quantity, "new").save()
+        pages = {0: (7, [1, 1]), 7: (0, [1, 2])}
+        with patch.object(Inventory.storage.layout, 'scan',
+                          side_effect=lambda redis, cursor, count: pages[cursor]):
+            self.assertEqual([[data['id'] for data in records]
+                              for records in Inventory.storage.scan()], [[1], [1, 2]])
+            self.assertEqual([i.id for i in Inventory.iter_all(batch_size=1)], [1, 2])
+            self.assertEqual(Inventory.reindex(), 2)
+        self.assertEqual(Inventory.total_quantity("shampoo"), 5)
+
+    def test_reindex_at_start_up(self):
+        """ Start a reindex when INVENTORY_REINDEX is set """
+        with patch.object(Inventory, 'start_reindex') as start_reindex:
+            with patch.dict(os.environ, {'INVENTORY_REINDEX': 'true'}):
+                Inventory.init_db()
+            start_reindex.assert_called_once_with(source=None)
+        Inventory(0, "shampoo", 5, "new").save()
+        Inventory.redis.delete('ids')
+        Inventory.start_reindex().join()
+        self.assertEqual([i.id for i in Inventory.find_page(1)[0]], [1])
+
+    def test_query(self):
+        """ Query Inventories matching several attributes """
+        Inventory(0, "shampoo", 1, "new").save()
+        Inventory(0, "shampoo", 2, "used").save()
+        Inventory(0, "soap", 2, "used").save()
+        Inventory(0, "shampoo", 2, "used").save()
+        inventories = Inventory.query(name="Shampoo", status="used", quantity=2)
+        self.assertEqual([inventory.id for inventory in inventories], [2, 4])
+        self.assertEqual(Inventory.query(name="shampoo", status="broken"), [])
+        self.assertEqual(len(Inventory.query()), 4)
+        inventories, next_id = Inventory.find_page(1, 0, name="shampoo", quantity=2)
+        self.assertEqual([inventory.id for inventory in inventories], [2])
+        self.assertEqual(next_id, 2)
+        self.assertRaises(DataValidationError, Inventory.query, color="red")
+        self.assertEqual(Inventory.redis.keys('query:*'), [])
+
+    def test_find_uses_cache(self):
+        """ Find Inventory by ID from the cache after the first read """
+        Inventory(0, "shampoo", 1, "new").save()
+        hits = Inventory.cache.hits
+        self.assertEqual(Inventory.find(1).name, "shampoo")
+        self.assertEqual(Inventory.find(1).name, "shampoo")
+        self.assertEqual(Inventory.cache.hits, hits + 1)
+        inventory = Inventory.find(1)
+        inventory.name = "soap"
+        inventory.save()
+        self.assertEqual(Inventory.find(1).name, "soap")
+
+    def test_cache_invalidated_by_other_workers(self):
+        """ Drop cached Inventories that another worker changed """
+        Inventory(0, "shampoo", 1, "new").save()
+        self.assertEqual(Inventory.find(1).name, "shampoo")
+        # write the record the way another process would and announce it
+        data = {"id": 1, "name": "soap", "quantity": 1, "status": "new"}
+        Inventory.redis.set(1, Inventory.codec.encode(data))
+        Inventory.redis.publish(Inventory.invalidation_channel, 'other-worker 1')
+        deadline = time.time() + 5
+        while Inventory.find(1).name != "soap" and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(Inventory.find(1).name, "soap")
+
+    def test_redis_settings(self):
+        """ Read Redis pool settings from credentials and the environment """
+        creds = dict(VCAP_SERVICES['rediscloud'][0]['credentials'], max_connections='7')
+        with patch.dict(os.environ, {'REDIS_SOCKET_TIMEOUT': '0.5',
+                                     'REDIS_RETRY_ON_TIMEOUT': 'false'}):
+            settings = Inventory.redis_settings(creds)
+        self.assertEqual(settings['max_connections'], 7)
+        self.assertEqual(settings['socket_timeout'], 0.5)
+        self.assertFalse(settings['retry_on_timeout'])
+        self.assertEqual(settings['health_check_interval'], 30)
+
+    def test_init_db_with_vcap_services(self):
+        """ Connect to Redis through VCAP_SERVICES with a bounded pool """
+        with patch.dict(os.environ, {'VCAP_SERVICES': json.dumps(VCAP_SERVICES),
+                                     'REDIS_MAX_CONNECTIONS': '3'}):
+            Inventory.init_db()
+        stats = Inventory.pool_stats()
+        self.assertEqual(stats['max_connections'], 3)
+        self.assertTrue(stats['in_use'] + stats['idle'] == stats['created'] <= 3)
+
+    def test_connect_to_redis_gives_up(self):
+        """ Stop retrying a Redis server that is not there """
+        settings = dict(Inventory.redis_settings(), connect_retries=2, retry_backoff=0.01,
+                        socket_connect_timeout=0.5)
+        redis = Inventory.redis
+        try:
+            self.assertIs(Inventory.connect_to_redis('127.0.0.1', 1, None, settings), None)
+        finally:
+            Inventory.redis = redis
+
+    def test_disconnect(self):
+        """ Drop the inherited Redis connection as a forked worker does """
+        Inventory(0, "shampoo", 2, "new").save()
+        Inventory.find(1)
+        Inventory.disconnect()
+        self.assertEqual(Inventory.redis, None)
+        self.assertEqual(Inventory.cache.stats()['size'], 0)
+        Inventory.init_db()
+        self.assertEqual(Inventory.find(1).name, "shampoo")
+
+    def test_migrate_codec(self):
+        """ Rewrite legacy pickled records with the current codec """
+        Inventory(0, "shampoo", 1, "new").save()
+        for inventory_id in (2, 3):
+            data = {"id": inventory_id, "name": "soap", "quantity": 2, "status": "used"}
+            Inventory.redis.set(inventory_id, pickle.dumps(data))
+        self.assertRaises(CodecError, Inventory.find, 2)
+        with patch.object(Inventory.codec, 'allow_pickle', True):
+            self.assertEqual(Inventory.migrate_codec(batch_size=2), 2)
+            self.assertFalse(Inventory.codec.allow_pickle)
+        for inventory_id in (1, 2, 3):
+            self.assertTrue(Inventory.codec.is_current(Inventory.redis.get(inventory_id)))
+        self.assertEqual(Inventory.find(3).name, "soap")
+        self.assertEqual(Inventory.migrate_codec(), 0)
+
 
 ######################################################################
 #   M A I N
@@ -0,0 +1,196 @@
+# Test cases can be run with:
+# nosetests
+# coverage report -m
+
+""" Test cases for the Redis storage layouts """
+
+import unittest
+
+from mock import patch
+
+from app.codec import JsonCodec, PickleCodec, Registry
+from app.layout import BucketLayout, HashLayout, LayoutError, StringLayout, get_layout
+from app.models import Inventory, InsufficientQuantityError
+
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestStringLayout(unittest.TestCase):
+    """ Test Cases for Inventories stored as JSON encoded strings """
+
+    def setUp(self):
+        """ Initialize the Redis database with the string layout and JSON codec """
+        Inventory.init_db()
+        self.layout, self.codec = Inventory.storage.layout, Inventory.storage.codec
+        Inventory.storage.codec = Registry(JsonCodec())
+        Inventory.storage.layout = StringLayout(Inventory.storage.codec)
+        Inventory.remove_all()
+
+    def tearDown(self):
+        Inventory.storage.layout, Inventory.storage.codec = self.layout, self.codec
+
+    def test_adjust_in_place(self):
+        """ Adjust a JSON encoded quantity and its indexes with one script call """
+        Inventory(0, u"Shampoo", 5, u"New").save()
+        with patch.object(Inventory.storage, 'transaction', side_effect=AssertionError):
+            self.assertEqual(Inventory.adjust_quantity(1, -3), 2)
+            self.assertRaises(InsufficientQuantityError, Inventory.adjust_quantity, 1, -3, 0)
+            self.assertEqual(Inventory.adjust_quantity(2, 1), None)
+        self.assertEqual(Inventory.redis.get(1), b'\x01[1,"Shampoo",2,"New",2]')
+        self.assertEqual(Inventory.find(1).version, 2)
+        self.assertEqual(Inventory.find_by_quantity(5), [])
+        self.assertEqual(len(Inventory.find_by_quantity(2)), 1)
+        self.assertEqual(Inventory.total_quantity("shampoo", "new"), 2)
+        self.assertEqual([i.id for i in Inventory.find_low_stock(3)], [1])
+
+    def test_adjust_other_values(self):
+        """ Adjust records the script cannot rewrite through a transaction """
+        Inventory.storage.layout = StringLayout(Registry(PickleCodec()))
+        Inventory(0, u"soap", 4, u"new").save()
+        Inventory.storage.codec.allow_pickle = True
+        Inventory.storage.layout = StringLayout(Inventory.storage.codec)
+        Inventory(0, u"\u00c9clair", 4, u"new").save()
+        self.assertEqual(Inventory.adjust_quantity(1, 1), 5)
+        self.assertEqual(Inventory.adjust_quantity(2, -1), 3)
+        self.assertEqual(Inventory.find(1).quantity, 5)
+        self.assertEqual(Inventory.total_quantity(u"\u00e9clair"), 3)
+        Inventory(0, u"bolt", 123456789012345, u"new").save()
+        self.assertEqual(Inventory.adjust_quantity(3, 1), 123456789012346)
+        self.assertEqual(Inventory.find(3).quantity, 123456789012346)
+        self.assertEqual(Inventory.redis.get(3), b'\x01[3,"bolt",123456789012346,"new",2]')
+
+
+class TestHashLayout(unittest.TestCase):
+    """ Test Cases for Inventories stored as hashes """
+
+    def setUp(self):
+        """ Initialize the Redis database with the hash layout """
+        Inventory.init_db()
+        self.layout = Inventory.storage.layout
+        Inventory.storage.layout = HashLayout(Inventory.codec)
+        Inventory.remove_all()
+
+    def tearDown(self):
+        Inventory.storage.layout = self.layout
+
+    def test_unknown_layout(self):
+        """ Ask for a layout that does not exist """
+        self.assertRaises(LayoutError, get_layout, 'list', Inventory.codec)
+
+    def test_save_as_hash(self):
+        """ Save an Inventory as a hash with a field per attribute """
+        Inventory(0, u"shampoo", 2, u"new").save()
+        self.assertEqual(Inventory.redis.hgetall('inventory:1'),
+                         {b'name': b'shampoo', b'quantity': b'2', b'status': b'new',
+                          b'version': b'1'})
+        self.assertEqual(Inventory.redis.get(1), None)
+        inventory = Inventory.find(1)
+        self.assertEqual((inventory.name, inventory.quantity, inventory.status),
+                         (u"shampoo", 2, u"new"))
+        self.assertEqual(Inventory.find_quantity(1), 2)
+        self.assertEqual(Inventory.find_quantity(2), None)
+        self.assertEqual(len(Inventory.all()), 1)
+        self.assertEqual(len(Inventory.find_by_name("shampoo")), 1)
+
+    def test_adjust_in_place(self):
+        """ Adjust a quantity field and its indexes with one script call """
+        Inventory(0, u"Shampoo", 5, u"New").save()
+        self.assertEqual(Inventory.adjust_quantity(1, -3), 2)
+        self.assertEqual(Inventory.redis.hget('inventory:1', 'quantity'), b'2')
+        self.assertEqual(Inventory.find(1).version, 2)
+        self.assertEqual(Inventory.find_by_quantity(5), [])
+        self.assertEqual(len(Inventory.find_by_quantity(2)), 1)
+        self.assertEqual(Inventory.total_quantity("shampoo"), 2)
+        self.assertEqual(Inventory.total_quantity("shampoo", "new"), 2)
+        self.assertEqual([i.id for i in Inventory.find_low_stock(3)], [1])
+        self.assertEqual(Inventory.find(1).quantity, 2)
+        self.assertEqual(Inventory.adjust_quantity(2, 1), None)
+        self.assertRaises(InsufficientQuantityError, Inventory.adjust_quantity, 1, -3, 0)
+        self.assertEqual(Inventory.find_quantity(1), 2)
+
+    def test_adjust_non_ascii_name(self):
+        """ Adjust an Inventory whose name the script cannot lower-case """
+        Inventory(0, u"\u00c9clair", 4, u"new").save()
+        self.assertEqual(Inventory.adjust_quantity(1, 1), 5)
+        self.assertEqual(Inventory.total_quantity(u"\u00e9clair"), 5)
+        self.assertEqual(Inventory.find(1).name, u"\u00c9clair")
+
+    def test_adjust_large_quantity(self):
+        """ Keep the quantity index of large quantities under their exact value """
+        Inventory(0, u"bolt", 123456789012345, u"new").save()
+        Inventory(0, u"nut", 2 ** 53, u"new").save()
+        self.assertEqual(Inventory.adjust_quantity(1, 1), 123456789012346)
+        self.assertEqual(Inventory.adjust_quantity(2, 1), 2 ** 53 + 1)
+        self.assertEqual([i.id for i in Inventory.query(quantity=123456789012346)], [1])
+        self.assertEqual([i.id for i in Inventory.query(quantity=2 ** 53 + 1)], [2])
+        self.assertEqual(Inventory.query(quantity=123456789012345), [])
+        self.assertEqual(Inventory.find_quantity(2), 2 ** 53 + 1)
+
+    def test_migrate_layout(self):
+        """ Move records from the string layout to the hash layout """
+        Inventory.storage.layout = StringLayout(Inventory.codec)
+        for name in ("shampoo", "soap", "lotion"):
+            Inventory(0, name, 1, "new").save()
+        Inventory.storage.layout = HashLayout(Inventory.codec)
+        self.assertEqual(Inventory.all(), [])
+        self.assertEqual(Inventory.migrate_layout('string', batch_size=2), 3)
+        self.assertEqual(sorted(i.name for i in Inventory.all()),
+                         ["lotion", "shampoo", "soap"])
+        self.assertEqual(Inventory.redis.get(1), None)
+        self.assertEqual(Inventory.migrate_layout('string'), 0)
+        self.assertEqual(Inventory.migrate_layout('hash'), 0)
+
+
+class TestBucketLayout(unittest.TestCase):
+    """ Test Cases for Inventories packed into bucket hashes """
+
+    def setUp(self):
+        """ Initialize the Redis database with small buckets """
+        Inventory.init_db()
+        self.layout = Inventory.storage.layout
+        Inventory.storage.layout = BucketLayout(Inventory.codec, size=2)
+        Inventory.remove_all()
+
+    def tearDown(self):
+        Inventory.storage.layout = self.layout
+
+    def test_get_bucket_layout(self):
+        """ Ask for the bucket layout with a bucket size """
+        layout = get_layout('bucket', Inventory.codec, 10)
+        self.assertEqual(layout.size, 10)
+        self.assertEqual(layout.key(25), 'bucket:2')
+        self.assertEqual(layout.field(25), 5)
+
+    def test_save_into_buckets(self):
+        """ Save Inventories into shared bucket hashes """
+        for name in ("shampoo", "soap", "lotion"):
+            Inventory(0, name, 1, "new").save()
+        self.assertEqual(Inventory.redis.hkeys('bucket:0'), [b'1'])
+        self.assertEqual(sorted(Inventory.redis.hkeys('bucket:1')), [b'0', b'1'])
+        self.assertEqual(Inventory.find(3).name, "lotion")
+        self.assertEqual(sorted(i.id for i in Inventory.iter_all(batch_size=1)), [1, 2, 3])
+        self.assertEqual(len(Inventory.find_by_quantity(1)), 3)
+        self.assertEqual(Inventory.adjust_quantity(2, 4), 5)
+        self.assertEqual(Inventory.find(2).quantity, 5)
+        Inventory.find(2).delete()
+        self.assertEqual(Inventory.find(2), None)
+        self.assertEqual(Inventory.redis.hkeys('bucket:1'), [b'1'])
+
+    def test_migrate_into_buckets(self):
+        """ Move records from the string layout into buckets """
+        Inventory.storage.layout = StringLayout(Inventory.codec)
+        for name in ("shampoo", "soap", "lotion"):
+            Inventory(0, name, 1, "new").save()
+        Inventory.storage.layout = BucketLayout(Inventory.codec, size=Inventory.bucket_size)
+        self.assertEqual(Inventory.migrate_layout('string'), 3)
+        self.assertEqual(sorted(i.name for i in Inventory.all()),
+                         ["lotion", "shampoo", "soap"])
+        self.assertEqual(Inventory.migrate_codec(), 0)
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+# Test cases can be run with:
+# nosetests
+# coverage report -m
+
+""" Test cases for the metrics registry """
+
+import unittest
+
+from mock import patch
+
+from app import metrics
+from app.models import Inventory
+
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestMetrics(unittest.TestCase):
+    """ Test Cases for metrics """
+
+    def test_counter(self):
+        """ Render a counter with labels """
+        counter = metrics.Counter('hits_total', 'Hits', ('route',))
+        counter.inc(route='/a')
+        counter.inc(2, route='/a')
+        counter.inc(route='/b"')
+        self.assertEqual(counter.get(route='/a'), 3)
+        self.assertEqual(counter.render(), '\n'.join([
+            '# HELP hits_total Hits',
+            '# TYPE hits_total counter',
+            'hits_total{route="/a"} 3',
+            'hits_total{route="/b\\""} 1']))
+
+    def test_histogram(self):
+        """ Render cumulative histogram buckets """
+        histogram = metrics.Histogram('size', 'Sizes', buckets=(1, 10))
+        for value in (0, 5, 5, 50):
+            histogram.observe(value)
+        self.assertEqual(histogram.count(), 4)
+        self.assertEqual(histogram.render().splitlines()[2:], [
+            'size_bucket{le="1"} 1',
+            'size_bucket{le="10"} 3',
+            'size_bucket{le="+Inf"} 4',
+            'size_sum 60',
+            'size_count 4'])
+
+    def test_redis_round_trips(self):
+        """ Count the Redis round trips of a request """
+        Inventory.init_db()
+        self.assertTrue(isinstance(Inventory.redis, metrics.InstrumentedRedis))
+        metrics.registry.clear()
+        metrics.start_request()
+        Inventory.redis.get('nothing')
+        pipe = Inventory.redis.pipeline()
+        pipe.get('nothing').get('nothing')
+        pipe.execute()
+        metrics.finish_request('GET', '/test', 200)
+        self.assertEqual(metrics.REDIS_COMMANDS.get(command='GET'), 3)
+        self.assertEqual(metrics.REDIS_LATENCY.count(command='PIPELINE'), 1)
+        self.assertEqual(metrics.HTTP_REQUESTS.get(method='GET', route='/test', status=200), 1)
+        self.assertIn('inventory_redis_round_trips_per_request_sum{method="GET",route="/test"} 2',
+                      metrics.registry.render())
+
+    def test_trace_repeated_commands(self):
+        """ Flag a traced request that goes over budget with one GET per record """
+        Inventory.init_db()
+        metrics.registry.clear()
+        with patch.multiple(metrics, trace=True, round_trip_budget=3, repeat_threshold=3):
+            with patch.object(metrics.logger, 'warning') as warning:
+                metrics.start_request()
+                for inventory_id in range(4):
+                    Inventory.redis.get(inventory_id)
+                Inventory.redis.mget(range(4))
+                self.assertEqual([call[0] for call in metrics.trace_sequence()],
+                                 ['GET'] * 4 + ['MGET'])
+                self.assertEqual(metrics.finish_request('GET', '/test', 200), 5)
+        self.assertEqual(metrics.OVER_BUDGET.get(method='GET', route='/test'), 1)
+        self.assertEqual(metrics.REPEATED_COMMANDS.get(method='GET', route='/test'), 1)
+        message = warning.call_args[0][0] % warning.call_args[0][1:]
+        self.assertIn('5 round trips, budget is 3', message)
+        self.assertIn('possible N+1: GET sent 4 times', message)
+        self.assertIn('GET 3 (', message)
+
+    def test_trace_within_limits(self):
+        """ Stay quiet about a traced request that is within its limits """
+        Inventory.init_db()
+        with patch.object(metrics, 'trace', True):
+            with patch.object(metrics.logger, 'warning') as warning:
+                metrics.start_request()
+                Inventory.redis.get('nothing')
+                self.assertEqual(metrics.finish_request('GET', '/test', 200), 1)
+        self.assertFalse(warning.called)
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == '__main__':
+    unittest.main()
@@ -54,6 +54,31 @@ class TestInventoryServer(unittest.TestCase):
         data = json.loads(resp.data)
         self.assertEqual(len(data), 2)
 
+    def test_stream_inventory_list(self):
+        """ Stream a list as a JSON array over several chunks, or as NDJSON """
+        server.Inventory(0, "soap", 1, 'used').save()
+        with patch.dict(server.app.config, {'STREAM_CHUNK_SIZE': 1}):
+            resp = self.app.get('/inventories')
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertTrue(resp.is_streamed)
+            self.assertEqual(resp.content_type, 'application/json')
+            data = json.loads(resp.data)
+            self.assertEqual(sorted(item['name'] for item in data),
+                             ['conditioner', 'shampoo', 'soap'])
+            resp = self.app.get('/inventories?status=new',
+                                headers={'Accept': 'application/x-ndjson'})
+        self.assertEqual(resp.content_type, 'application/x-ndjson')
+        lines = resp.data.splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], [1, 2])
+        resp = self.app.get('/inventories?name=nothing')
+        self.assertEqual(json.loads(resp.data), [])
+
+    def test_stream_inventory_list_with_mask(self):
+        """ Marshal streamed Inventories through a field mask """
+        resp = self.app.get('/inventories?limit=1', headers={'X-Fields': 'id,name'})
+        self.assertEqual(json.loads(resp.data), [{'id': 1, 'name': 'shampoo'}])
+        self.assertIn('rel="next"', resp.headers['Link'])
+
     def test_get_inventory(self):
         """ Get one Inventory """
         resp = self.app.get('/inventories/2')
@@ -94,6 +119,17 @@ class TestInventoryServer(unittest.TestCase):
         resp = self.app.post('/inventories', data=new_inventory, content_type='application/json')
         self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_create_inventory_with_boolean_quantity(self):
+        """ Create an Inventory whose quantity is a boolean """
+        new_inventory = {'name': 'soap', 'quantity': True, 'status': 'new'}
+        resp = self.app.post('/inventories', data=json.dumps(new_inventory),
+                             content_type='application/json')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.put('/inventories/1', data=json.dumps(new_inventory),
+                            content_type='application/json')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.get_inventory_count(), 2)
+
     def test_update_inventory(self):
         """ Update an Inventory """
         new_shampoo = {'name': 'shampoo', 'quantity': 8, 'status': 'new'}
@@ -181,12 +217,303 @@ class TestInventoryServer(unittest.TestCase):
         data = json.loads(resp.data)
         self.assertEqual(data['count'], 3)
 
+    def test_get_inventory_list_paged(self):
+        """ Get a list of Inventories one page at a time """
+        server.Inventory(0, "soap", 5, 'used').save()
+        resp = self.app.get('/inventories', query_string='limit=2')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = json.loads(resp.data)
+        self.assertEqual([item['id'] for item in data], [1, 2])
+        link = resp.headers.get('Link')
+        self.assertIn('cursor=2', link)
+        self.assertIn('rel="next"', link)
+        resp = self.app.get('/inventories', query_string='limit=2&cursor=2')
+        data = json.loads(resp.data)
+        self.assertEqual([item['id'] for item in data], [3])
+        self.assertIsNone(resp.headers.get('Link'))
+
+    def test_get_inventory_list_paged_with_filter(self):
+        """ Get a page of Inventories with a given quantity """
+        server.Inventory(0, "soap", 5, 'used').save()
+        resp = self.app.get('/inventories', query_string='quantity=5&limit=1&after_id=2')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = json.loads(resp.data)
+        self.assertEqual(len(data), 1)
+        self.assertEqual(data[0]['name'], 'soap')
+
+    def test_get_inventory_list_bad_limit(self):
+        """ Get a list of Inventories with an invalid limit """
+        resp = self.app.get('/inventories', query_string='limit=zero')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.get('/inventories', query_string='limit=0')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_inventory_not_modified(self):
+        """ Answer a conditional GET of an unchanged Inventory with 304 """
+        epoch = server.Inventory.epoch()
+        resp = self.app.get('/inventories/1')
+        etag = resp.headers['ETag']
+        self.assertEqual(etag, '"{}-1-1"'.format(epoch))
+        resp = self.app.get('/inventories/1', headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(resp.data, '')
+        self.assertEqual(resp.headers['ETag'], etag)
+        data = json.dumps({'name': 'shampoo', 'quantity': 3, 'status': 'new'})
+        resp = self.app.put('/inventories/1', data=data, content_type='application/json')
+        self.assertEqual(resp.headers['ETag'], '"{}-1-2"'.format(epoch))
+        resp = self.app.get('/inventories/1', headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(resp.data)['quantity'], 3)
+        self.assertEqual(resp.headers['ETag'], '"{}-1-2"'.format(epoch))
+
+    def test_etag_after_reset(self):
+        """ Never match a tag handed out before the Inventories were reset """
+        etag = self.app.get('/inventories/1').headers['ETag']
+        list_etag = self.app.get('/inventories').headers['ETag']
+        self.app.delete('/inventories/reset')
+        server.Inventory(0, "bleach", 1, 'new').save()
+        resp = self.app.get('/inventories/1', headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(resp.data)['name'], 'bleach')
+        self.assertNotEqual(resp.headers['ETag'], etag)
+        resp = self.app.get('/inventories', headers={'If-None-Match': list_etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.app.put('/inventories/1', data=json.dumps(
+            {'name': 'bleach', 'quantity': 2, 'status': 'new'}),
+                            content_type='application/json', headers={'If-Match': etag})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
+    def test_update_inventory_if_match(self):
+        """ Update an Inventory only while it still matches If-Match """
+        etag = self.app.get('/inventories/1').headers['ETag']
+        data = json.dumps({'name': 'shampoo', 'quantity': 3, 'status': 'new'})
+        resp = self.app.put('/inventories/1', data=data, content_type='application/json',
+                            headers={'If-Match': etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.app.put('/inventories/1', data=data, content_type='application/json',
+                            headers={'If-Match': etag})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(json.loads(resp.data)['error'], 'Precondition Failed')
+        resp = self.app.put('/inventories/1', data=data, content_type='application/json',
+                            headers={'If-Match': '*'})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.headers['ETag'], '"{}-1-3"'.format(server.Inventory.epoch()))
+
+    def test_list_inventories_not_modified(self):
+        """ Answer a conditional list with 304 until any Inventory is written """
+        resp = self.app.get('/inventories?name=shampoo')
+        etag = resp.headers['ETag']
+        resp = self.app.get('/inventories?name=shampoo', headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.app.patch('/inventories/2/adjust', data=json.dumps({'delta': 1}),
+                       content_type='application/json')
+        resp = self.app.get('/inventories?name=shampoo', headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(resp.headers['ETag'], etag)
+        server.Inventory.remove_all()
+        resp = self.app.get('/inventories?name=shampoo', headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+    def test_etag_per_representation(self):
+        """ Give the JSON, NDJSON and masked bodies of a list tags of their own """
+        ndjson = {'Accept': 'application/x-ndjson'}
+        masked = {'X-Fields': 'name'}
+        resp = self.app.get('/inventories')
+        self.assertEqual(resp.headers['Vary'], 'Accept, X-Fields')
+        etag = resp.headers['ETag']
+        etags = set([etag])
+        for headers in (ndjson, masked, dict(ndjson, **masked), {'X-Fields': 'id'}):
+            resp = self.app.get('/inventories', headers=dict(headers, **{'If-None-Match': etag}))
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            etags.add(resp.headers['ETag'])
+            resp = self.app.get('/inventories', headers=dict(
+                headers, **{'If-None-Match': resp.headers['ETag']}))
+            self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(resp.headers['Vary'], 'Accept, X-Fields')
+        self.assertEqual(len(etags), 5)
+        resp = self.app.get('/inventories/1', headers=masked)
+        self.assertEqual(json.loads(resp.data), {'name': 'shampoo'})
+        self.assertNotEqual(resp.headers['ETag'], '"{}-1-1"'.format(server.Inventory.epoch()))
+        resp = self.app.put('/inventories/1', data=json.dumps(
+            {'name': 'shampoo', 'quantity': 3, 'status': 'new'}),
+                            content_type='application/json',
+                            headers={'If-Match': resp.headers['ETag']})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+    def test_adjust_inventory(self):
+        """ Adjust the quantity of an Inventory """
+        data = json.dumps({'delta': -2})
+        resp = self.app.patch('/inventories/2/adjust', data=data, content_type='application/json')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(resp.data), {'id': 2, 'quantity': 3})
+        resp = self.app.get('/inventories', query_string='quantity=3')
+        data = json.loads(resp.data)
+        self.assertEqual(len(data), 1)
+        self.assertEqual(data[0]['name'], 'conditioner')
+
+    def test_adjust_inventory_below_floor(self):
+        """ Adjust an Inventory below its floor """
+        data = json.dumps({'delta': -3, 'floor': 0})
+        resp = self.app.patch('/inventories/1/adjust', data=data, content_type='application/json')
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+        resp = self.app.get('/inventories/1')
+        self.assertEqual(json.loads(resp.data)['quantity'], 2)
+
+    def test_adjust_inventory_not_found(self):
+        """ Adjust an Inventory that can't be found """
+        data = json.dumps({'delta': 1})
+        resp = self.app.patch('/inventories/0/adjust', data=data, content_type='application/json')
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_adjust_inventory_bad_delta(self):
+        """ Adjust an Inventory with a delta that is not an integer """
+        data = json.dumps({'delta': '1'})
+        resp = self.app.patch('/inventories/1/adjust', data=data, content_type='application/json')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_batch_inventories(self):
+        """ Create, update and delete Inventories in one batch """
+        operations = [
+            {'op': 'create', 'data': {'name': 'soap', 'quantity': 4, 'status': 'new'}},
+            {'op': 'update', 'id': 1, 'data': {'name': 'shampoo', 'quantity': 9, 'status': 'used'}},
+            {'op': 'delete', 'id': 2},
+            {'op': 'update', 'id': 42, 'data': {'name': 'lotion', 'quantity': 1, 'status': 'new'}}
+        ]
+        resp = self.app.post('/inventories/batch', data=json.dumps(operations),
+                             content_type='application/json')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        results = json.loads(resp.data)
+        self.assertEqual([result['status'] for result in results], [201, 200, 204, 404])
+        self.assertEqual(results[0]['id'], 3)
+        self.assertEqual(results[0]['data']['name'], 'soap')
+        resp = self.app.get('/inventories')
+        data = sorted(json.loads(resp.data), key=lambda item: item['id'])
+        self.assertEqual([(item['id'], item['quantity']) for item in data], [(1, 9), (3, 4)])
+
+    def test_batch_inventories_invalid(self):
+        """ Reject a batch with an invalid operation """
+        operations = [
+            {'op': 'create', 'data': {'name': 'soap', 'quantity': 4, 'status': 'new'}},
+            {'op': 'update', 'data': {'name': 'shampoo', 'quantity': 9, 'status': 'used'}},
+            {'op': 'create', 'data': {'status': 'used'}},
+            {'op': 'rename', 'id': 1},
+            {'op': 'update', 'id': 1, 'data': {'name': 'soap', 'quantity': False, 'status': 'new'}}
+        ]
+        resp = self.app.post('/inventories/batch', data=json.dumps(operations),
+                             content_type='application/json')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        errors = json.loads(resp.data)['errors']
+        self.assertEqual([error['index'] for error in errors], [1, 2, 3, 4])
+        self.assertEqual(self.get_inventory_count(), 2)
+
+    def test_data_load(self):
+        """ Load a list of Inventories """
+        server.data_load([{'name': 'soap', 'quantity': 4, 'status': 'new'},
+                          {'name': 'lotion', 'quantity': 1, 'status': 'used'}])
+        server.data_load({'name': 'sponge', 'quantity': 7, 'status': 'new'})
+        self.assertEqual(self.get_inventory_count(), 5)
+        self.assertEqual(server.Inventory.find(5).name, 'sponge')
+
+    def test_count_inventories_by_status(self):
+        """ Count total quantity of product in one status """
+        server.Inventory(0, "Shampoo", 4, 'used').save()
+        server.Inventory(0, "shampoo", 1, 'new').save()
+        resp = self.app.get('/inventories/count', query_string='name=shampoo')
+        data = json.loads(resp.data)
+        self.assertEqual(data['count'], 7)
+        self.assertNotIn('records', data)
+        resp = self.app.get('/inventories/count', query_string='name=shampoo&status=new&records=true')
+        data = json.loads(resp.data)
+        self.assertEqual(data['count'], 3)
+        self.assertEqual(len(data['records']), 2)
+
+    def test_count_inventories_without_name(self):
+        """ Count total quantity without a product name """
+        resp = self.app.get('/inventories/count')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_query_inventory_all_filters(self):
+        """ Query Inventories by name, status and quantity together """
+        server.Inventory(0, "shampoo", 5, 'used').save()
+        server.Inventory(0, "shampoo", 2, 'used').save()
+        resp = self.app.get('/inventories/query', query_string='name=shampoo&status=used&quantity=2')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = json.loads(resp.data)
+        self.assertEqual([item['id'] for item in data], [4])
+
+    def test_list_inventories_with_several_filters(self):
+        """ Get a list of Inventories matching every filter """
+        server.Inventory(0, "conditioner", 5, 'used').save()
+        resp = self.app.get('/inventories', query_string='status=used&quantity=5')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = json.loads(resp.data)
+        self.assertEqual([item['id'] for item in data], [3])
+        resp = self.app.get('/inventories', query_string='status=used&quantity=5&name=shampoo')
+        self.assertEqual(json.loads(resp.data), [])
+
+    def test_list_inventories_by_name_prefix(self):
+        """ Get the Inventories whose name starts with a prefix, for type-ahead """
+        server.Inventory(0, "Shaving foam", 1, 'used').save()
+        server.Inventory(0, "soap", 1, 'new').save()
+        resp = self.app.get('/inventories', query_string='name_prefix=sha&limit=20')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = json.loads(resp.data)
+        self.assertEqual([item['name'] for item in data], ['shampoo', 'Shaving foam'])
+        resp = self.app.get('/inventories', query_string='name_prefix=s&status=new&limit=1')
+        self.assertEqual([item['id'] for item in json.loads(resp.data)], [1])
+        resp = self.app.get('/inventories', query_string='name_prefix=sha&cursor=1')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_list_inventories_by_quantity_range(self):
+        """ Get a list of Inventories with a quantity in a range """
+        server.Inventory(0, "soap", 3, 'used').save()
+        resp = self.app.get('/inventories', query_string='quantity_min=3')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['id'] for item in json.loads(resp.data)], [2, 3])
+        resp = self.app.get('/inventories', query_string='quantity_min=2&quantity_max=3&limit=1')
+        self.assertEqual([item['id'] for item in json.loads(resp.data)], [1])
+        self.assertIn('cursor=1', resp.headers['Link'])
+        resp = self.app.get('/inventories/query', query_string='quantity_max=4&status=used')
+        self.assertEqual([item['id'] for item in json.loads(resp.data)], [3])
+        resp = self.app.get('/inventories', query_string='quantity_max=few')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_list_low_stock(self):
+        """ Get the Inventories below a threshold, lowest quantity first """
+        server.Inventory(0, "soap", 1, 'used').save()
+        resp = self.app.get('/inventories/low-stock', query_string='threshold=5')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['id'] for item in json.loads(resp.data)], [3, 1])
+        resp = self.app.get('/inventories/low-stock', query_string='threshold=6&status=new&limit=1')
+        self.assertEqual([item['name'] for item in json.loads(resp.data)], ['shampoo'])
+        resp = self.app.get('/inventories/low-stock')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_list_inventories_sorted(self):
+        """ Get a list of Inventories ordered by quantity, name or id """
+        server.Inventory(0, "body wash", 3, 'used').save()
+        server.Inventory(0, "soap", 9, 'new').save()
+        def ids(query):
+            resp = self.app.get('/inventories', query_string=query)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            return [item['id'] for item in json.loads(resp.data)]
+        self.assertEqual(ids('sort=quantity'), [1, 3, 2, 4])
+        self.assertEqual(ids('sort=-quantity&limit=2'), [4, 2])
+        self.assertEqual(ids('sort=name&status=new'), [2, 1, 4])
+        self.assertEqual(ids('sort=id'), [1, 2, 3, 4])
+        self.assertEqual(ids('sort=quantity&quantity_min=3&limit=2'), [3, 2])
+        self.assertEqual(ids('sort=-quantity&name_prefix=s'), [4, 1])
+        resp = self.app.get('/inventories', query_string='sort=price')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.get('/inventories', query_string='sort=name&cursor=1')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_method_not_allowed(self):
         """ Call a Method thats not Allowed """
         resp = self.app.post('/inventories/0')
         self.assertEqual(resp.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
 
-    @patch('app.models.Inventory.find_by_name')
+    @patch('app.models.Inventory.query')
     def test_mock_search_data_internal_error(self, Inventory_find_mock):
         """ Mocking the 500 ERROR """
         Inventory_find_mock.side_effect = OSError()
@@ -194,6 +521,94 @@ class TestInventoryServer(unittest.TestCase):
         resp = self.app.get('/inventories/query', query_string='name=shampoo&status=new',content_type='application/json')
         self.assertEqual(resp.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    @patch('app.models.Inventory.find')
+    def test_database_unavailable(self, find_mock):
+        """ Report a Redis failure as 503 """
+        find_mock.side_effect = server.ConnectionError('Timeout connecting to server')
+        resp = self.app.get('/inventories/1')
+        self.assertEqual(resp.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    def test_healthcheck(self):
+        """ Report cache and connection pool usage on the health check """
+        resp = self.app.get('/healthcheck')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = json.loads(resp.data)
+        self.assertIn('hits', data['cache'])
+        self.assertIn('in_use', data['pool'])
+
+    def test_metrics(self):
+        """ Report request, Redis and result size metrics """
+        server.metrics.registry.clear()
+        self.app.get('/inventories/1')
+        # streamed lists record their metrics once the body has been read
+        self.app.get('/inventories?name=shampoo').data
+        self.app.get('/inventories/0')
+        resp = self.app.get('/metrics')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertTrue(resp.content_type.startswith('text/plain'))
+        self.assertIn('inventory_http_requests_total{method="GET",'
+                      'route="/inventories/<int:inventory_id>",status="200"} 1', resp.data)
+        self.assertIn('inventory_http_requests_total{method="GET",'
+                      'route="/inventories/<int:inventory_id>",status="404"} 1', resp.data)
+        self.assertIn('inventory_list_result_size_bucket{method="GET",'
+                      'route="/inventories/",le="1"} 1', resp.data)
+        self.assertIn('inventory_redis_commands_total{command="GET"}', resp.data)
+        self.assertIn('inventory_cache{stat="hits"}', resp.data)
+
+    def test_round_trip_budgets(self):
+        """ Keep the Redis round trips of each endpoint within its budget """
+        # lists also read the collection generation for their ETag
+        budgets = [
+            ('get', '/inventories/1', None, 1),
+            ('get', '/inventories', None, 3),
+            ('get', '/inventories?name=shampoo&status=new', None, 4),
+            ('get', '/inventories?limit=1', None, 3),
+            ('get', '/inventories?name_prefix=sha&limit=20', None, 3),
+            ('get', '/inventories?quantity_max=4&limit=20', None, 4),
+            ('get', '/inventories/low-stock?threshold=5&status=new', None, 2),
+            ('get', '/inventories?sort=-quantity&limit=50', None, 3),
+            ('get', '/inventories?sort=name&status=new&limit=50', None, 4),
+            ('get', '/inventories/query?name=shampoo', None, 2),
+            ('get', '/inventories/count?name=shampoo', None, 1),
+            ('post', '/inventories', {'name': 'soap', 'quantity': 1, 'status': 'new'}, 4),
+            ('put', '/inventories/2', {'name': 'soap', 'quantity': 1, 'status': 'new'}, 4),
+            ('patch', '/inventories/2/adjust', {'delta': 1}, 3),
+            ('post', '/inventories/batch',
+             [{'op': 'create', 'data': {'name': 'soap', 'quantity': 1, 'status': 'new'}}] * 20, 2),
+            ('delete', '/inventories/1', None, 4)
+        ]
+        with patch.object(server.metrics, 'trace', True):
+            for method, url, body, budget in budgets:
+                server.Inventory.cache.clear()
+                resp = getattr(self.app, method)(url, data=json.dumps(body),
+                                                 content_type='application/json')
+                self.assertTrue(resp.status_code < 300, url)
+                round_trips = int(resp.headers['X-Redis-Round-Trips'])
+                self.assertTrue(round_trips <= budget, '{} {} made {} round trips'.format(
+                    method.upper(), url, round_trips))
+
+    def test_sorted_by_name_round_trips(self):
+        """ Keep filtered name orders from walking the whole name index """
+        server.Inventory.batch([('create', server.Inventory(0, 'item{:04d}'.format(i), 1, 'new'))
+                                for i in range(1200)])
+        server.Inventory(0, 'zinc', 3, 'used').save()
+        budgets = [
+            ('/inventories?sort=name&name=zinc&limit=1', 3),
+            ('/inventories?sort=name&status=used&limit=1', 4),
+            ('/inventories?sort=name&quantity_min=3&limit=1', 4),
+            ('/inventories?sort=name&status=new&limit=5', 4)
+        ]
+        with patch.object(server.metrics, 'trace', True):
+            for url, budget in budgets:
+                server.Inventory.cache.clear()
+                resp = self.app.get(url)
+                self.assertEqual(resp.status_code, status.HTTP_200_OK)
+                self.assertEqual(len(json.loads(resp.data)), 1 if budget == 3 or 'new' not in url
+                                 else 5, url)
+                round_trips = int(resp.headers['X-Redis-Round-Trips'])
+                self.assertTrue(round_trips <= budget, '{} made {} round trips'.format(
+                    url, round_trips))
+
     def test_415_unsupported_media_type(self):
         """ Update an Inventory """
         new_shampoo = {'name': 'shampoo', 'quantity': 8, 'status': 'new'}
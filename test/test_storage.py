@@ -0,0 +1,169 @@
+# Test cases can be run with:
+# nosetests
+# coverage report -m
+
+""" Test cases for the in-process storage backend """
+
+import os
+import unittest
+
+from mock import patch
+
+from app.models import Inventory, InsufficientQuantityError
+from app.storage import MemoryStorage
+
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestMemoryStorage(unittest.TestCase):
+    """ Test Cases for Inventories kept in memory """
+
+    def setUp(self):
+        """ Store Inventories in a fresh MemoryStorage """
+        self.storage = Inventory.storage
+        Inventory.use_storage(MemoryStorage())
+
+    def tearDown(self):
+        if self.storage is not None:
+            Inventory.use_storage(self.storage)
+
+    def test_crud(self):
+        """ Create, read, update and delete an Inventory """
+        Inventory(0, "shampoo", 2, "new").save()
+        inventory = Inventory.find(1)
+        self.assertEqual((inventory.name, inventory.quantity, inventory.status),
+                         ("shampoo", 2, "new"))
+        inventory.quantity = 5
+        inventory.save()
+        self.assertEqual(Inventory.find_quantity(1), 5)
+        self.assertEqual(len(Inventory.find_by_quantity(2)), 0)
+        Inventory.find(1).delete()
+        self.assertEqual(Inventory.find(1), None)
+        self.assertEqual(Inventory.all(), [])
+        Inventory(0, "soap", 1, "new").save()
+        self.assertEqual(Inventory.find(2).name, "soap")
+
+    def test_epoch(self):
+        """ Start a new epoch with every process and every clear """
+        epoch = Inventory.epoch()
+        self.assertNotEqual(MemoryStorage().epoch(), epoch)
+        self.assertEqual(Inventory.epoch(), epoch)
+        Inventory.remove_all()
+        self.assertNotEqual(Inventory.epoch(), epoch)
+
+    def test_records_are_copied(self):
+        """ Changing a read record does not change the stored one """
+        Inventory(0, "shampoo", 2, "new").save()
+        Inventory.storage.read(1)['name'] = "soap"
+        Inventory.storage.read_many([1])[0]['name'] = "soap"
+        self.assertEqual(Inventory.storage.read(1)['name'], "shampoo")
+
+    def test_query_and_pages(self):
+        """ Query the indexes and page through the results in id order """
+        for name, status in (("Shampoo", "new"), ("soap", "used"), ("shampoo", "New"),
+                             ("shampoo", "used")):
+            Inventory(0, name, 1, status).save()
+        self.assertEqual([i.id for i in Inventory.query(name="SHAMPOO", status="new")], [1, 3])
+        self.assertEqual([i.id for i in Inventory.query(name="lotion", status="new")], [])
+        self.assertEqual([i.id for i in Inventory.query()], [1, 2, 3, 4])
+        page, next_id = Inventory.find_page(2, name="shampoo")
+        self.assertEqual(([i.id for i in page], next_id), ([1, 3], 3))
+        page, next_id = Inventory.find_page(2, next_id, name="shampoo")
+        self.assertEqual(([i.id for i in page], next_id), ([4], None))
+        page, next_id = Inventory.find_page(3, 1)
+        self.assertEqual(([i.id for i in page], next_id), ([2, 3, 4], None))
+
+    def test_name_prefix(self):
+        """ Keep the name index in order through every write """
+        for name in ("soap", "Shampoo", "shaving foam", "shampoo"):
+            Inventory(0, name, 1, "new").save()
+        self.assertEqual(Inventory.storage.select_names("SHA"),
+                         [("shampoo", 2), ("shampoo", 4), ("shaving foam", 3)])
+        self.assertEqual(Inventory.storage.select_names("sha", ("shampoo", 2), 1),
+                         [("shampoo", 4)])
+        Inventory(2, "lotion", 1, "new").save()
+        Inventory.find(3).delete()
+        self.assertEqual([i.id for i in Inventory.find_by_name_prefix("s")], [4, 1])
+        Inventory.storage.names = []
+        Inventory.reindex()
+        self.assertEqual(Inventory.storage.select_names(), [("lotion", 2), ("shampoo", 4),
+                                                            ("soap", 1)])
+
+    def test_quantity_range(self):
+        """ Keep the quantity index in order through every write """
+        for name, quantity in (("soap", 3), ("shampoo", 1), ("shampoo", 3), ("lotion", 8)):
+            Inventory(0, name, quantity, "new").save()
+        self.assertEqual(Inventory.storage.select_by_quantity({}, 2, 8), [1, 3, 4])
+        self.assertEqual(Inventory.storage.select_by_quantity({'name': "SHAMPOO"}, count=1), [2])
+        self.assertEqual(Inventory.storage.select_by_quantity({'name': "lotion"}, 9), [])
+        self.assertEqual(Inventory.storage.estimate({'name': "shampoo"}, 2), (2, 4))
+        self.assertEqual(Inventory.storage.estimate({}, 2, 3), (2, 4))
+        self.assertEqual(Inventory.storage.select({'name': "shampoo"}, 0, 1, 2), [3])
+        self.assertEqual([i.id for i in Inventory.find_sorted('name', quantity_min=3)], [4, 3, 1])
+        Inventory.adjust_quantity(4, -6)
+        Inventory.find(1).delete()
+        self.assertEqual([i.id for i in Inventory.find_low_stock(4)], [2, 4, 3])
+        self.assertEqual(Inventory.storage.select_by_quantity({}, 2, count=2, reverse=True),
+                         [3, 4])
+        self.assertEqual([i.id for i in Inventory.find_sorted('-quantity', 1, name="shampoo")],
+                         [3])
+        Inventory.storage.quantities = []
+        Inventory.reindex()
+        self.assertEqual(Inventory.storage.select_by_quantity({}, maximum=2), [2, 4])
+
+    def test_totals(self):
+        """ Keep quantity totals per name and status through every write """
+        Inventory(0, "shampoo", 2, "new").save()
+        Inventory(0, "Shampoo", 3, "used").save()
+        self.assertEqual(Inventory.total_quantity("shampoo"), 5)
+        self.assertEqual(Inventory.total_quantity("shampoo", "USED"), 3)
+        Inventory.find(2).delete()
+        self.assertEqual(Inventory.total_quantity("shampoo"), 2)
+        self.assertEqual(Inventory.total_quantity("lotion"), 0)
+        Inventory.storage.totals.clear()
+        Inventory.reindex()
+        self.assertEqual(Inventory.total_quantity("shampoo", "new"), 2)
+
+    def test_batch_and_adjust(self):
+        """ Apply a batch and adjust quantities with a floor """
+        Inventory(0, "shampoo", 2, "new").save()
+        results = Inventory.batch([('create', Inventory(0, "soap", 1, "new")),
+                                   ('update', Inventory(1, "shampoo", 4, "new")),
+                                   ('delete', Inventory(9, "lotion", 1, "new"))])
+        self.assertEqual([result and result.id for result in results], [2, 1, None])
+        self.assertEqual(Inventory.adjust_quantity(1, -3), 1)
+        self.assertRaises(InsufficientQuantityError, Inventory.adjust_quantity, 1, -2, 0)
+        self.assertEqual(Inventory.adjust_quantity(9, 1), None)
+        self.assertEqual(Inventory.total_quantity("shampoo"), 1)
+        self.assertEqual([i.id for i in Inventory.find_by_quantity(1)], [1, 2])
+
+    def test_scan_and_remove_all(self):
+        """ Walk every record a page at a time, then remove them all """
+        for name in ("shampoo", "soap", "lotion"):
+            Inventory(0, name, 1, "new").save()
+        pages = list(Inventory.storage.scan(batch_size=2))
+        self.assertEqual([len(page) for page in pages], [2, 1])
+        Inventory.remove_all()
+        self.assertEqual(Inventory.all(), [])
+        self.assertEqual(Inventory.migrate_codec(), 0)
+        self.assertEqual(Inventory.pool_stats(), {})
+
+    def test_init_db_keeps_memory_storage(self):
+        """ Select memory storage through the environment """
+        Inventory(0, "shampoo", 2, "new").save()
+        storage = Inventory.storage
+        with patch.dict(os.environ, {'INVENTORY_STORAGE': 'memory'}):
+            Inventory.init_db()
+            Inventory.disconnect()
+            Inventory.init_db()
+        self.assertIs(Inventory.storage, storage)
+        self.assertEqual(Inventory.redis, None)
+        self.assertEqual(Inventory.find(1).name, "shampoo")
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == '__main__':
+    unittest.main()